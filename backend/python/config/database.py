@@ -4,6 +4,7 @@ Gerenciador de conexão com o banco de dados Supabase
 from supabase import create_client, Client
 from config.settings import settings
 from utils.logger import logger
+from utils.prazo import limitar_requisicao_http
 
 
 class Database:
@@ -25,6 +26,9 @@ class Database:
                 settings.SUPABASE_URL,
                 settings.SUPABASE_KEY
             )
+            # Consultas e downloads não passam do prazo da requisição em andamento
+            for sessao in (self._client.postgrest.session, self._client.storage.session):
+                sessao.event_hooks['request'].append(limitar_requisicao_http)
             logger.info("✅ Conexão com Supabase estabelecida")
         except Exception as e:
             logger.error(f"❌ Erro ao conectar com Supabase: {e}")
@@ -29,20 +29,91 @@ class Settings:
     
     # Configurações do Google Gemini
     GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
+    # Pool de chaves separadas por vírgula (se vazio, usa apenas GOOGLE_API_KEY)
+    GOOGLE_API_KEYS = [k.strip() for k in os.getenv("GOOGLE_API_KEYS", "").split(",") if k.strip()]
     GEMINI_MODEL = "gemini-2.5-flash"
     GEMINI_THINKING_MODE = True
     
+    # Hedging: requisição duplicada quando o primeiro token demora além do percentil
+    GEMINI_HEDGE_ATIVO = os.getenv("GEMINI_HEDGE_ATIVO", "False").lower() == "true"
+    GEMINI_HEDGE_PERCENTIL = 95
+    GEMINI_HEDGE_MAX_EXTRA = 0.1  # No máximo 10% de requisições extras
+    GEMINI_HEDGE_MIN_AMOSTRAS = 20  # Latências necessárias antes de disparar hedges
+    GEMINI_HEDGE_JANELA = 200  # Latências recentes consideradas no percentil
+    
+    # Micro-lotes: perguntas curtas sem histórico de usuários diferentes numa só chamada
+    GEMINI_MICROLOTE_ATIVO = os.getenv("GEMINI_MICROLOTE_ATIVO", "False").lower() == "true"
+    GEMINI_MICROLOTE_JANELA_MS = 300  # Tempo de espera para juntar perguntas
+    GEMINI_MICROLOTE_MAX_PERGUNTAS = 5
+    GEMINI_MICROLOTE_MAX_CARACTERES = 500  # Perguntas maiores vão sozinhas
+    
+    # Concorrência adaptativa: chamadas simultâneas ao Gemini ajustadas pela latência e por erros 429/503
+    GEMINI_CONCORRENCIA_INICIAL = 8
+    GEMINI_CONCORRENCIA_MIN = 1
+    GEMINI_CONCORRENCIA_MAX = int(os.getenv("GEMINI_CONCORRENCIA_MAX", 16))
+    GEMINI_CONCORRENCIA_TOLERANCIA_LATENCIA = 2.0  # Latência recente acima de 2x a de referência reduz o limite
+    
     # Configurações de Rate Limiting
-    API_RATE_LIMIT = 80  # Porcentagem para começar throttling
-    API_MAX_REQUESTS_PER_MINUTE = 60
-    API_DELAY_SECONDS = 2  # Delay quando atingir 80%
+    API_MAX_REQUESTS_PER_MINUTE = 60  # Por chave da API
+    API_KEY_COOLDOWN_SECONDS = 60  # Tempo fora do pool após erro de cota
+    API_KEY_COOLDOWN_ERRO_SERVIDOR_SECONDS = 10  # Tempo fora do pool após erro 5xx do Gemini
+    # Orçamento mensal (mês do calendário; o contador zera sozinho no dia 1º)
+    API_LIMITE_MENSAL = int(os.getenv("API_LIMITE_MENSAL", 1500))
+    # Se a previsão passar do orçamento, as requisições são espaçadas para o saldo
+    # durar até o fim do mês, ou até esta data se for antes (ex.: último dia da feira)
+    API_ORCAMENTO_ATE = os.getenv("API_ORCAMENTO_ATE")  # "AAAA-MM-DD"
+    API_PREVISAO_JANELA_HORAS = 24  # Uso recente que projeta o consumo do mês
+    API_RITMO_RAJADA = 5  # Requisições que podem passar juntas acima do ritmo
+    API_BACKOFF_MAX_SECONDS = 60  # Teto sugerido aos clientes para o backoff exponencial
+    API_MONITOR_FLUSH_SECONDS = 10  # Intervalo máximo entre gravações do estado do monitor
+    API_MONITOR_FLUSH_MAX_PENDENTES = 20  # Alterações acumuladas que forçam uma gravação
+    # Estado do monitor: "memoria" (um processo) ou "sqlite" (compartilhado entre workers)
+    API_MONITOR_BACKEND = os.getenv("API_MONITOR_BACKEND", "memoria")
+    API_MONITOR_SQLITE_PATH = Path(os.getenv("API_MONITOR_SQLITE_PATH", "storage/temp/api_monitor.db"))
+    API_SERIE_USO_PATH = Path(os.getenv("API_SERIE_USO_PATH", "storage/temp/serie_uso.npz"))
+    
+    # Cotas por usuário (conforme o tipo) e por projeto, em fichas; recarga contínua
+    COTAS_POR_TIPO_USUARIO = {
+        "participante": {"capacidade": 20, "recarga_minuto": 4},
+        "orientador": {"capacidade": 30, "recarga_minuto": 6},
+        "admin": {"capacidade": 100, "recarga_minuto": 30}
+    }
+    COTA_PROJETO = {"capacidade": 40, "recarga_minuto": 8}  # Compartilhada pelos membros
+    COTA_CUSTO_POR_MODO = {"normal": 1, "thinking": 4}
     
+    # Prazos de ponta a ponta (segundos) por endpoint, com override por modo ("endpoint:modo")
+    PRAZO_PADRAO_SECONDS = 30
+    PRAZOS_SECONDS = {
+        "mensagem": 60,
+        "mensagem:thinking": 120,
+        "regenerar": 60
+    }
+    
+    # Configurações de Geração em segundo plano
+    GERACAO_MAX_WORKERS = int(os.getenv("GERACAO_MAX_WORKERS", 8))
+    GERACAO_HEARTBEAT_SECONDS = 2  # Intervalo dos keep-alives do streaming
+    
+    # Paginação por cursor (mensagens e chats)
+    PAGINA_LIMITE_PADRAO = 50
+    PAGINA_LIMITE_MAX = 100
+
+    # Cache de leituras por id (tabela -> validade e tamanho). Cada worker tem o seu:
+    # escritas invalidam o cache do processo que escreveu; nos demais vale o TTL
+    CACHE_DAO_ATIVO = os.getenv("CACHE_DAO_ATIVO", "True").lower() == "true"
+    CACHE_DAO = {
+        "usuarios": {"ttl_segundos": 60, "max_itens": 2000},
+        "projetos": {"ttl_segundos": 60, "max_itens": 500}
+    }
+
     # Configurações de Segurança
     SECRET_KEY = os.getenv("SECRET_KEY")
     JWT_ALGORITHM = "HS256"
     JWT_EXPIRATION_HOURS = 24
     BCRYPT_ROUNDS = 12
     
+    # Token (Bearer) exigido pelo /metrics; se vazio, o endpoint fica desligado (404)
+    METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+    
     # Configurações de Upload
     UPLOAD_FOLDER = Path("uploads")
     MAX_UPLOAD_SIZE = 10 * 1024 * 1024  # 10MB
@@ -65,8 +136,7 @@ class Settings:
         """Valida se todas as configurações obrigatórias estão presentes"""
         required = [
             "SUPABASE_URL",
-            "SUPABASE_KEY",
-            "GOOGLE_API_KEY"
+            "SUPABASE_KEY"
         ]
         
         missing = []
@@ -74,16 +144,33 @@ class Settings:
             if not getattr(cls, var):
                 missing.append(var)
         
+        if not cls.get_gemini_api_keys():
+            missing.append("GOOGLE_API_KEY")
+        
         if missing:
             raise ValueError(f"Variáveis de ambiente obrigatórias faltando: {', '.join(missing)}")
         
         return True
     
+    @classmethod
+    def get_gemini_api_keys(cls):
+        """Retorna as chaves do pool do Gemini, sem duplicatas"""
+        chaves = cls.GOOGLE_API_KEYS or ([cls.GOOGLE_API_KEY] if cls.GOOGLE_API_KEY else [])
+        return list(dict.fromkeys(chaves))
+    
+    @classmethod
+    def get_prazo(cls, endpoint: str, modo: str = None) -> float:
+        """Retorna o prazo (segundos) do endpoint, considerando o modo se houver override"""
+        if modo and f"{endpoint}:{modo}" in cls.PRAZOS_SECONDS:
+            return cls.PRAZOS_SECONDS[f"{endpoint}:{modo}"]
+        return cls.PRAZOS_SECONDS.get(endpoint, cls.PRAZO_PADRAO_SECONDS)
+    
     @classmethod
     def get_gemini_config(cls):
         """Retorna configuração do Gemini"""
         return {
             "api_key": cls.GOOGLE_API_KEY,
+            "api_keys": cls.get_gemini_api_keys(),
             "model": cls.GEMINI_MODEL,
             "thinking_mode": cls.GEMINI_THINKING_MODE
         }
@@ -2,15 +2,21 @@
 Controller para funcionalidades administrativas
 """
 from typing import Dict, List, Optional
-from dao.usuario_dao import UsuarioDAO, TipoUsuarioDAO
+from dao.usuario_dao import UsuarioDAO, tipos_usuario
 from dao.projeto_dao import ProjetoDAO
-from dao.chat_dao import ChatDAO
+from dao.chat_dao import ChatDAO, tipos_ia
 from dao.mensagem_dao import MensagemDAO
 from services.auth_service import auth_service
 from services.api_monitor_service import api_monitor
 from services.context_service import context_service
+from services.chaves_gemini_service import pool_chaves_gemini
+from services.hedge_service import hedge_service
+from services.microlote_service import microlote_service
+from services.cota_service import cota_service
+from services.concorrencia_service import limite_gemini
 from models.usuario import Usuario
 from models.projeto import Projeto
+from utils.cache_lru import relatorio_caches
 from utils.logger import logger
 from utils.helpers import helpers
 from utils.validators import validators
@@ -22,7 +28,7 @@ class AdminController:
     
     def __init__(self):
         self.usuario_dao = UsuarioDAO()
-        self.tipo_usuario_dao = TipoUsuarioDAO()
+        self.tipo_usuario_dao = tipos_usuario
         self.projeto_dao = ProjetoDAO()
         self.chat_dao = ChatDAO()
         self.mensagem_dao = MensagemDAO()
@@ -166,6 +172,13 @@ class AdminController:
             if not ano or not validators.validate_ano_edicao(ano):
                 return helpers.create_response(False, "Ano de edição inválido")
             
+            # Membros opcionais (listas de IDs), vinculados junto com a criação
+            participantes = dados.get('participantes') or []
+            orientadores = dados.get('orientadores') or []
+            erro_membros = self._validar_membros(participantes, orientadores)
+            if erro_membros:
+                return helpers.create_response(False, erro_membros)
+            
             # Cria projeto
             projeto = Projeto(
                 nome=dados['nome'],
@@ -178,6 +191,14 @@ class AdminController:
             
             if projeto_criado:
                 logger.info(f"✅ Projeto criado: {projeto_criado.nome}")
+                
+                if (participantes or orientadores) and not self.projeto_dao.adicionar_membros(
+                    projeto_criado.id, participantes, orientadores
+                ):
+                    return helpers.create_response(
+                        False, "Projeto criado, mas houve erro ao vincular os membros", data=projeto_criado.to_dict()
+                    )
+                
                 return helpers.create_response(
                     True,
                     "Projeto criado com sucesso",
@@ -190,15 +211,33 @@ class AdminController:
             logger.error_trace(e, "criar_projeto")
             return helpers.create_response(False, "Erro ao criar projeto", error=str(e))
     
+    def _validar_membros(self, participantes: List[int], orientadores: List[int]) -> Optional[str]:
+        """Confere numa única consulta se os IDs existem e têm o tipo certo (retorna o erro)"""
+        if not participantes and not orientadores:
+            return None
+        
+        usuarios = {u.id: u for u in self.usuario_dao.listar_por_ids(list(participantes) + list(orientadores))}
+        for id in participantes:
+            if id not in usuarios:
+                return f"Usuário {id} não encontrado"
+            if not usuarios[id].is_participante():
+                return f"Usuário {id} não é participante"
+        for id in orientadores:
+            if id not in usuarios:
+                return f"Usuário {id} não encontrado"
+            if not usuarios[id].is_orientador():
+                return f"Usuário {id} não é orientador"
+        return None
+    
     def vincular_participante_projeto(self, projeto_id: int, participante_id: int) -> Dict:
         """Vincula participante a um projeto"""
         try:
-            # Verifica se projeto existe
-            if not self.projeto_dao.buscar_por_id(projeto_id):
+            # Verifica se projeto existe (sem carregar os membros)
+            if not self.projeto_dao.exists("id", projeto_id):
                 return helpers.create_response(False, "Projeto não encontrado")
             
             # Verifica se usuário existe e é participante
-            usuario = self.usuario_dao.buscar_por_id(participante_id)
+            usuario = self.usuario_dao.buscar_por_id(participante_id, "publico")
             if not usuario:
                 return helpers.create_response(False, "Usuário não encontrado")
             
@@ -221,12 +260,12 @@ class AdminController:
     def vincular_orientador_projeto(self, projeto_id: int, orientador_id: int) -> Dict:
         """Vincula orientador a um projeto"""
         try:
-            # Verifica se projeto existe
-            if not self.projeto_dao.buscar_por_id(projeto_id):
+            # Verifica se projeto existe (sem carregar os membros)
+            if not self.projeto_dao.exists("id", projeto_id):
                 return helpers.create_response(False, "Projeto não encontrado")
             
             # Verifica se usuário existe e é orientador
-            usuario = self.usuario_dao.buscar_por_id(orientador_id)
+            usuario = self.usuario_dao.buscar_por_id(orientador_id, "publico")
             if not usuario:
                 return helpers.create_response(False, "Usuário não encontrado")
             
@@ -263,8 +302,7 @@ class AdminController:
                     usuarios_total += len(usuarios)
             
             # Contagem de projetos
-            projetos = self.projeto_dao.listar_todos()
-            total_projetos = len(projetos)
+            total_projetos = self.projeto_dao.count()
             
             # Contagem de chats
             total_chats = self.chat_dao.count()
@@ -272,7 +310,7 @@ class AdminController:
             # Contagem de mensagens
             total_mensagens = self.mensagem_dao.count()
             
-            # Status da API
+            # Status da API (um único retrato do monitor)
             status_api = api_monitor.obter_relatorio()
             estatisticas_api = api_monitor.obter_estatisticas_periodo()
             
@@ -296,15 +334,25 @@ class AdminController:
                 },
                 'api': {
                     'status': status_api,
-                    'estatisticas': estatisticas_api
+                    'estatisticas': estatisticas_api,
+                    'chaves': pool_chaves_gemini.obter_relatorio(),
+                    'hedge': hedge_service.obter_relatorio(),
+                    'microlote': microlote_service.obter_relatorio(),
+                    'cotas': cota_service.obter_relatorio(),
+                    'concorrencia': limite_gemini.obter_relatorio()
                 },
                 'contextos': {
                     'cache': contextos_info,
                     'disponiveis': len(contextos_disponiveis)
                 },
+                'referencias': {
+                    'tipos_usuario': tipos_usuario.obter_relatorio(),
+                    'tipos_ia': tipos_ia.obter_relatorio()
+                },
+                'caches': relatorio_caches(),
                 'sistema': {
-                    'ativo': api_monitor.uso_atual['sistema_ativo'],
-                    'throttling': api_monitor.uso_atual['throttling_ativo'],
+                    'ativo': status_api['sistema_ativo'],
+                    'throttling': status_api['throttling_ativo'],
                     'database_ok': db.health_check()
                 }
             }
@@ -352,6 +400,25 @@ class AdminController:
         except Exception as e:
             return helpers.create_response(False, "Erro ao desativar sistema", error=str(e))
     
+    def recarregar_referencias(self) -> Dict:
+        """Recarrega do banco as tabelas de referência (tipos de usuário e de IA)"""
+        try:
+            tabelas = {'tipos_usuario': tipos_usuario, 'tipos_ia': tipos_ia}
+            falhas = [nome for nome, tabela in tabelas.items() if not tabela.carregar()]
+            if falhas:
+                return helpers.create_response(
+                    False, "Erro ao recarregar tabelas de referência", error=f"Falha em: {', '.join(falhas)}"
+                )
+            
+            return helpers.create_response(
+                True,
+                "Tabelas de referência recarregadas",
+                data={nome: tabela.obter_relatorio() for nome, tabela in tabelas.items()}
+            )
+        except Exception as e:
+            logger.error_trace(e, "recarregar_referencias")
+            return helpers.create_response(False, "Erro ao recarregar tabelas de referência", error=str(e))
+    
     def resetar_contador_mensal(self) -> Dict:
         """Reseta contador mensal da API"""
         try:
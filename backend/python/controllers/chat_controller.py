@@ -2,10 +2,11 @@
 Controller para gerenciar chats
 """
 from typing import Dict, Optional
-from dao.chat_dao import ChatDAO, TipoIADAO
+from dao.chat_dao import ChatDAO, tipos_ia
 from dao.mensagem_dao import MensagemDAO
 from dao.projeto_dao import ProjetoDAO
 from models.chat import Chat
+from config.settings import settings
 from utils.logger import logger
 from utils.helpers import helpers
 
@@ -16,7 +17,7 @@ class ChatController:
     def __init__(self):
         self.chat_dao = ChatDAO()
         self.mensagem_dao = MensagemDAO()
-        self.tipo_ia_dao = TipoIADAO()
+        self.tipo_ia_dao = tipos_ia
         self.projeto_dao = ProjetoDAO()
     
     def criar_chat(self, projeto_id: int, tipo_ia_nome: str, titulo: str) -> Dict:
@@ -32,8 +33,8 @@ class ChatController:
             Dict com resultado da operação
         """
         try:
-            # Verifica se projeto existe
-            projeto = self.projeto_dao.buscar_por_id(projeto_id)
+            # Verifica se projeto existe (só o nome é usado)
+            projeto = self.projeto_dao.buscar_por_id(projeto_id, "resumo")
             if not projeto:
                 return helpers.create_response(False, "Projeto não encontrado", error="Project not found")
             
@@ -100,31 +101,41 @@ class ChatController:
             logger.error_trace(e, "buscar_chat")
             return helpers.create_response(False, "Erro ao buscar chat", error=str(e))
     
-    def listar_chats_projeto(self, projeto_id: int) -> Dict:
+    def listar_chats_projeto(self, projeto_id: int, limit: Optional[int] = None, cursor: Optional[str] = None) -> Dict:
         """
-        Lista todos os chats de um projeto
+        Lista os chats de um projeto, mais novos primeiro
         
         Args:
             projeto_id: ID do projeto
+            limit: Chats por página
+            cursor: Cursor de `paginacao` de uma resposta anterior
         
         Returns:
-            Dict com resultado da operação
+            Dict com resultado da operação e cursores da página
         """
         try:
-            chats = self.chat_dao.listar_por_projeto(projeto_id)
+            limite = self._limite_pagina(limit)
+            direcao, posicao = None, None
+            if cursor:
+                decodificado = helpers.decode_cursor(cursor)
+                if decodificado is None:
+                    return helpers.create_response(False, "Cursor inválido", error="Invalid cursor")
+                direcao, posicao = decodificado
             
-            # Adiciona contagem de mensagens a cada chat
-            chats_com_info = []
-            for chat in chats:
-                chat_dict = chat.to_dict()
-                chat_dict['total_mensagens'] = self.mensagem_dao.contar_mensagens_chat(chat.id)
-                chats_com_info.append(chat_dict)
+            # Total de mensagens e última atividade vêm na mesma consulta
+            chats, ha_mais = self.chat_dao.listar_resumo_por_projeto(projeto_id, limite, direcao, posicao)
             
-            return helpers.create_response(
+            resposta = helpers.create_response(
                 True,
                 f"{len(chats)} chat(s) encontrado(s)",
-                data=chats_com_info
+                data=[chat.to_dict() for chat in chats]
+            )
+            # A lista é decrescente: o "próximo" fica do lado dos chats mais antigos
+            cursores = helpers.page_cursors(
+                [(c.data_criacao, c.id) for c in reversed(chats) if c.data_criacao], ha_mais, direcao
             )
+            resposta['paginacao'] = {'anterior': cursores['depois'], 'proximo': cursores['antes']}
+            return resposta
             
         except Exception as e:
             logger.error_trace(e, "listar_chats_projeto")
@@ -172,9 +183,8 @@ class ChatController:
             Dict com resultado da operação
         """
         try:
-            # Verifica se chat existe
-            chat = self.chat_dao.buscar_por_id(chat_id)
-            if not chat:
+            # Verifica se chat existe (sem montar o chat)
+            if not self.chat_dao.exists("id", chat_id):
                 return helpers.create_response(False, "Chat não encontrado", error="Chat not found")
             
             # Deleta chat (cascade deleta mensagens)
@@ -190,25 +200,42 @@ class ChatController:
             logger.error_trace(e, "deletar_chat")
             return helpers.create_response(False, "Erro ao deletar chat", error=str(e))
     
-    def listar_mensagens_chat(self, chat_id: int, limit: int = 100) -> Dict:
+    def listar_mensagens_chat(self, chat_id: int, limit: Optional[int] = None, cursor: Optional[str] = None,
+                              resumo: bool = False) -> Dict:
         """
-        Lista mensagens de um chat
+        Lista mensagens de um chat em ordem cronológica (sem cursor, as mais recentes)
         
         Args:
             chat_id: ID do chat
-            limit: Limite de mensagens
+            limit: Mensagens por página
+            cursor: Cursor de `paginacao` de uma resposta anterior
+            resumo: Só a prévia do conteúdo, sem anexos
         
         Returns:
-            Dict com resultado da operação
+            Dict com resultado da operação e cursores da página
         """
         try:
-            mensagens = self.mensagem_dao.listar_por_chat(chat_id, limit)
+            limite = self._limite_pagina(limit)
+            direcao, posicao = None, None
+            if cursor:
+                decodificado = helpers.decode_cursor(cursor)
+                if decodificado is None:
+                    return helpers.create_response(False, "Cursor inválido", error="Invalid cursor")
+                direcao, posicao = decodificado
             
-            return helpers.create_response(
+            mensagens, ha_mais = self.mensagem_dao.listar_pagina(
+                chat_id, limite, direcao, posicao, "resumo" if resumo else None
+            )
+            
+            resposta = helpers.create_response(
                 True,
                 f"{len(mensagens)} mensagem(ns) encontrada(s)",
                 data=[msg.to_dict() for msg in mensagens]
             )
+            # "anterior" = mensagens mais antigas, "proximo" = mais novas
+            cursores = helpers.page_cursors([(m.data_envio, m.id) for m in mensagens], ha_mais, direcao)
+            resposta['paginacao'] = {'anterior': cursores['antes'], 'proximo': cursores['depois']}
+            return resposta
             
         except Exception as e:
             logger.error_trace(e, "listar_mensagens_chat")
@@ -251,6 +278,12 @@ class ChatController:
         except Exception as e:
             logger.error_trace(e, "listar_tipos_ia")
             return helpers.create_response(False, "Erro ao listar tipos de IA", error=str(e))
+    
+    def _limite_pagina(self, limit: Optional[int]) -> int:
+        """Tamanho de página dentro de [1, PAGINA_LIMITE_MAX]"""
+        if not limit:
+            return settings.PAGINA_LIMITE_PADRAO
+        return max(1, min(int(limit), settings.PAGINA_LIMITE_MAX))
 
 
 # Instância global
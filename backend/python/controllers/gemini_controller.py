@@ -1,15 +1,23 @@
 """
 Controller para gerenciar interações com o Gemini AI
 """
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime, timezone
 from typing import Dict, Optional
+from config.settings import settings
 from services.gemini_service import gemini_service
 from services.context_service import context_service
-from services.api_monitor_service import api_monitor
+from services.api_monitor_service import api_monitor, ReservaRequisicao
+from services.cancelamento_service import cancelamento_service, Cancelamento
+from services.microlote_service import microlote_service
+from services.cota_service import cota_service
+from services.concorrencia_service import CapacidadeEsgotadaError
 from dao.mensagem_dao import MensagemDAO
 from dao.chat_dao import ChatDAO
 from models.mensagem import Mensagem
 from utils.logger import logger
 from utils.helpers import helpers
+from utils.prazo import Prazo, PrazoEsgotadoError
 
 
 class GeminiController:
@@ -18,9 +26,37 @@ class GeminiController:
     def __init__(self):
         self.mensagem_dao = MensagemDAO()
         self.chat_dao = ChatDAO()
+        
+        # Workers para gerações executadas em segundo plano (rota com streaming)
+        self.executor = ThreadPoolExecutor(
+            max_workers=settings.GERACAO_MAX_WORKERS,
+            thread_name_prefix="geracao"
+        )
+    
+    def iniciar_processamento(self, chat_id: int, usuario_id: int, conteudo: str,
+                              usar_thinking: bool = False,
+                              tipo_usuario: Optional[str] = None,
+                              reserva: Optional[ReservaRequisicao] = None) -> tuple[Cancelamento, Future]:
+        """
+        Inicia o processamento da mensagem em segundo plano
+        
+        A vaga no rate limit (`reserva`) pode já ter sido reservada pela rota.
+        
+        Returns:
+            Tuple[cancelamento, futuro_com_resultado]
+        """
+        cancelamento = cancelamento_service.registrar(usuario_id, chat_id)
+        futuro = self.executor.submit(
+            self.processar_mensagem,
+            chat_id, usuario_id, conteudo, usar_thinking, cancelamento, tipo_usuario, reserva
+        )
+        return cancelamento, futuro
     
     def processar_mensagem(self, chat_id: int, usuario_id: int, conteudo: str, 
-                          usar_thinking: bool = False) -> Dict:
+                          usar_thinking: bool = False,
+                          cancelamento: Optional[Cancelamento] = None,
+                          tipo_usuario: Optional[str] = None,
+                          reserva: Optional[ReservaRequisicao] = None) -> Dict:
         """
         Processa mensagem do usuário e gera resposta da IA
         
@@ -29,42 +65,69 @@ class GeminiController:
             usuario_id: ID do usuário
             conteudo: Mensagem do usuário
             usar_thinking: Se deve usar thinking mode
+            cancelamento: Sinal de cancelamento da rota em streaming (desconexão
+                do cliente); se não informado, um é registrado só para
+                `/api/ia/cancelar` descartar a resposta
+            tipo_usuario: Tipo do usuário (define a cota individual)
+            reserva: Vaga no rate limit já reservada pela rota; se não
+                informada, é reservada aqui (e devolvida se não for usada)
         
         Returns:
             Dict com resultado da operação
         """
+        # Só com um cancelamento vindo de quem chamou a geração é feita em
+        # streaming (interrompível no meio); sem ele a chamada ao Gemini é simples
+        # e um cancelamento pedido durante ela só impede que a resposta seja salva
+        cancelamento_geracao = cancelamento
+        if cancelamento is None:
+            cancelamento = cancelamento_service.registrar(usuario_id, chat_id)
+        
+        # A pergunta só é gravada junto com a resposta, mas com a hora do envio
+        enviada_em = datetime.now(timezone.utc)
+        prazo = Prazo(
+            settings.get_prazo("mensagem", "thinking" if usar_thinking else None),
+            nome=f"mensagem chat {chat_id}",
+            operacao="processar_mensagem"
+        )
+        token_prazo = prazo.ativar()
+        # Fichas da cota ainda não "gastas": devolvidas no finally se a troca não for salva
+        cota_consumida = False
+        projeto_id = None
+        
         try:
             logger.info(f"🔄 Processando mensagem do usuário {usuario_id} no chat {chat_id}")
             
-            # Verifica rate limit
-            pode_fazer, erro_rate = api_monitor.verificar_rate_limit()
-            if not pode_fazer:
-                logger.warning(f"⚠️  Rate limit atingido: {erro_rate}")
-                return helpers.create_response(False, erro_rate, error=erro_rate)
-            
-            # Salva mensagem do usuário
-            logger.info("💾 Salvando mensagem do usuário...")
-            mensagem_usuario = Mensagem(
-                chat_id=chat_id,
-                usuario_id=usuario_id,
-                conteudo=conteudo,
-                e_nota_orientador=False
-            )
-            
-            msg_salva = self.mensagem_dao.criar_mensagem(mensagem_usuario)
-            if not msg_salva:
-                return helpers.create_response(False, "Erro ao salvar mensagem", error="Database error")
-            
-            logger.info(f"✅ Mensagem do usuário salva - ID: {msg_salva.id}")
-            
-            # Busca chat para contexto
-            chat = self.chat_dao.buscar_por_id(chat_id)
+            # Reserva a vaga no rate limit (se a rota ainda não reservou)
+            if reserva is None:
+                with prazo.etapa("fila_admissao"):
+                    reserva, erro_rate, retry_after = api_monitor.reservar_requisicao()
+                if reserva is None:
+                    logger.warning(f"⚠️  Rate limit atingido: {erro_rate}")
+                    return self.resposta_rate_limit(erro_rate, retry_after)
+            
+            # Busca chat (o projeto define a cota compartilhada)
+            with prazo.etapa("carregar_chat"):
+                chat = self.chat_dao.buscar_por_id(chat_id)
             if not chat:
                 return helpers.create_response(False, "Chat não encontrado", error="Chat not found")
             
+            # Verifica cotas do usuário e do projeto
+            projeto_id = chat.projeto_id
+            permitido, cota = cota_service.consumir(usuario_id, tipo_usuario, projeto_id, usar_thinking)
+            cota_consumida = permitido
+            if not permitido:
+                alvo = "sua cota" if cota['bloqueado_por'] == 'usuario' else "a cota do projeto"
+                return helpers.create_response(
+                    False,
+                    f"Você atingiu {alvo} de mensagens. Tente novamente em {cota['retry_after']}s.",
+                    data={"cota": cota},
+                    error="Quota exceeded"
+                )
+            
             # Carrega contextos da Bragantec
             logger.info("📚 Carregando contextos da Bragantec...")
-            sucesso_ctx, contextos, erro_ctx = context_service.carregar_todos_contextos()
+            with prazo.etapa("carregar_contextos"):
+                sucesso_ctx, contextos, erro_ctx = context_service.carregar_todos_contextos()
             
             if not sucesso_ctx:
                 logger.warning(f"⚠️  Erro ao carregar contextos: {erro_ctx}")
@@ -79,23 +142,40 @@ class GeminiController:
             
             # Busca histórico do chat
             logger.info("📜 Carregando histórico do chat...")
-            historico = self.mensagem_dao.listar_por_chat(chat_id, limit=20)
-            historico_formatado = [msg.to_dict() for msg in historico[:-1]]  # Exclui última (a que acabamos de salvar)
+            with prazo.etapa("carregar_historico"):
+                historico = self.mensagem_dao.listar_por_chat(chat_id, limit=19)
+            historico_formatado = [msg.to_dict() for msg in historico]  # A pergunta atual ainda não foi gravada
             logger.info(f"✅ Histórico carregado: {len(historico_formatado)} mensagem(ns) anterior(es)")
             
+            # Não chega a chamar o Gemini se o cliente já desistiu
+            if cancelamento.cancelado:
+                return self._resposta_cancelada(cancelamento)
+            
             # Gera resposta da IA
             logger.info(f"🤖 Gerando resposta da IA (thinking={usar_thinking})...")
             
-            if usar_thinking:
-                sucesso_ia, resposta_ia, erro_ia = gemini_service.gerar_resposta_com_thinking(
-                    conteudo, contextos
-                )
-            else:
-                sucesso_ia, resposta_ia, erro_ia = gemini_service.gerar_resposta(
-                    conteudo, contextos, historico_formatado
-                )
+            requisicoes_api = 1
+            with prazo.etapa("gerar_resposta"):
+                if usar_thinking:
+                    sucesso_ia, resposta_ia, erro_ia = gemini_service.gerar_resposta_com_thinking(
+                        conteudo, contextos, cancelamento_geracao
+                    )
+                elif microlote_service.elegivel(conteudo, historico_formatado):
+                    # Pergunta curta e sem histórico: pode ser respondida junto com outras
+                    sucesso_ia, resposta_ia, erro_ia, requisicoes_api = microlote_service.responder(
+                        conteudo, contextos, cancelamento_geracao
+                    )
+                else:
+                    sucesso_ia, resposta_ia, erro_ia = gemini_service.gerar_resposta(
+                        conteudo, contextos, historico_formatado, cancelamento_geracao
+                    )
+            
+            # Resposta que ninguém vai ler: não persiste nem conta na cota mensal
+            if cancelamento.cancelado:
+                return self._resposta_cancelada(cancelamento)
             
             if not sucesso_ia:
+                api_monitor.registrar_erro()
                 logger.error(f"❌ Erro ao gerar resposta: {erro_ia}")
                 return helpers.create_response(
                     False, 
@@ -105,37 +185,53 @@ class GeminiController:
             
             logger.info(f"✅ Resposta da IA gerada ({len(resposta_ia)} caracteres)")
             
-            # Salva resposta da IA
-            logger.info("💾 Salvando resposta da IA...")
-            mensagem_ia = Mensagem(
-                chat_id=chat_id,
-                usuario_id=None,  # None indica que é da IA
-                conteudo=resposta_ia,
-                e_nota_orientador=False
-            )
-            
-            msg_ia_salva = self.mensagem_dao.criar_mensagem(mensagem_ia)
-            
-            if msg_ia_salva:
-                logger.info(f"✅ Resposta da IA salva - ID: {msg_ia_salva.id}")
-            
-            # Registra uso da API
+            # Registra uso da API (a resposta já foi paga: não interrompe mais por prazo)
+            Prazo.desativar(token_prazo)
+            token_prazo = None
             tokens_estimados = len(conteudo + resposta_ia) // 4
-            api_monitor.registrar_requisicao(tokens=tokens_estimados)
+            with prazo.etapa("atualizar_monitor", verificar=False):
+                api_monitor.registrar_requisicao(
+                    tokens=tokens_estimados,
+                    requisicoes=requisicoes_api,
+                    latencia=prazo.etapas_dict().get("gerar_resposta"),
+                    reserva=reserva
+                )
             logger.info(f"📊 Uso da API registrado (~{tokens_estimados} tokens)")
             
+            # Salva pergunta e resposta juntas (as duas ou nenhuma)
+            logger.info("💾 Salvando pergunta e resposta...")
+            try:
+                with prazo.etapa("salvar_troca", verificar=False):
+                    msg_salva, msg_ia_salva = self.mensagem_dao.salvar_troca(
+                        chat_id, usuario_id, conteudo, resposta_ia, tokens_estimados, enviada_em
+                    )
+            except Exception as e:
+                logger.error(f"❌ Erro ao salvar a troca no chat {chat_id}: {e}")
+                return helpers.create_response(False, "Erro ao salvar mensagem", error="Database error")
+            cota_consumida = False  # Resposta entregue e salva: as fichas ficam gastas
+            
+            logger.info(f"✅ Troca salva - IDs: {msg_salva.id} (usuário), {msg_ia_salva.id} (IA)")
+            logger.info(f"⏱️  Etapas: {prazo.resumo()}")
+            
             # Retorna resultado
             return helpers.create_response(
                 True,
                 "Resposta gerada com sucesso",
                 data={
                     "mensagem_usuario": msg_salva.to_dict(),
-                    "mensagem_ia": msg_ia_salva.to_dict() if msg_ia_salva else None,
+                    "mensagem_ia": msg_ia_salva.to_dict(),
                     "uso_api": api_monitor.obter_relatorio(),
-                    "contextos_usados": len(contextos) if contextos else 0
+                    "contextos_usados": len(contextos) if contextos else 0,
+                    "cota": cota
                 }
             )
             
+        except PrazoEsgotadoError as e:
+            logger.error(f"⏰ Prazo esgotado ao processar mensagem: {e} | {prazo.resumo()}")
+            return self._resposta_prazo_esgotado(e)
+        except CapacidadeEsgotadaError as e:
+            logger.warning(f"🚦 {e} | Chat {chat_id}")
+            return self.resposta_rate_limit(f"{e}. Tente novamente em {e.retry_after}s.", e.retry_after)
         except Exception as e:
             logger.error(f"❌ Erro crítico ao processar mensagem: {e}")
             import traceback
@@ -145,6 +241,81 @@ class GeminiController:
                 "Erro ao processar mensagem",
                 error=str(e)
             )
+        finally:
+            if token_prazo is not None:
+                Prazo.desativar(token_prazo)
+            if reserva is not None:
+                # Sem chamada bem-sucedida ao Gemini a vaga volta para a janela
+                reserva.liberar()
+            if cota_consumida:
+                # Cancelada, com erro ou sem prazo: o usuário não recebeu resposta
+                cota_service.devolver(usuario_id, tipo_usuario, projeto_id, usar_thinking)
+            cancelamento_service.finalizar(cancelamento)
+    
+    def cancelar_geracao(self, chat_id: int, usuario_id: int) -> Dict:
+        """
+        Cancela a geração em andamento do usuário no chat
+        
+        Args:
+            chat_id: ID do chat
+            usuario_id: ID do usuário
+        
+        Returns:
+            Dict com resultado da operação
+        """
+        try:
+            if cancelamento_service.cancelar(usuario_id, chat_id):
+                return helpers.create_response(True, "Geração cancelada")
+            return helpers.create_response(False, "Nenhuma geração em andamento", error="No generation in progress")
+            
+        except Exception as e:
+            logger.error(f"❌ Erro ao cancelar geração: {e}")
+            return helpers.create_response(False, "Erro ao cancelar geração", error=str(e))
+    
+    def resposta_rate_limit(self, erro: str, retry_after: Optional[int]) -> Dict:
+        """
+        Monta a resposta de limite atingido, com dicas de backoff para o cliente
+        
+        Sem retry_after o sistema está desativado (não adianta tentar de novo).
+        """
+        if retry_after is None:
+            return helpers.create_response(False, erro, error="Service unavailable")
+        
+        return helpers.create_response(
+            False,
+            erro,
+            data={
+                "retry_after": retry_after,
+                "backoff": {
+                    "base_segundos": retry_after,
+                    "fator": 2,
+                    "max_segundos": settings.API_BACKOFF_MAX_SECONDS,
+                    "jitter": True
+                }
+            },
+            error="Rate limit exceeded"
+        )
+    
+    def _resposta_prazo_esgotado(self, erro: PrazoEsgotadoError) -> Dict:
+        """Monta a resposta de tempo limite, indicando onde o tempo foi gasto"""
+        return helpers.create_response(
+            False,
+            f"Tempo limite de {erro.prazo.segundos:.0f}s excedido ({erro.etapa}). Tente novamente.",
+            data={
+                "etapa": erro.etapa,
+                "etapas": erro.prazo.etapas_dict()
+            },
+            error="Deadline exceeded"
+        )
+    
+    def _resposta_cancelada(self, cancelamento: Cancelamento) -> Dict:
+        """Registra o cancelamento e monta a resposta correspondente"""
+        api_monitor.registrar_cancelamento(cancelamento.motivo)
+        return helpers.create_response(
+            False,
+            "Geração cancelada",
+            error=cancelamento.motivo
+        )
     
     def adicionar_nota_orientador(self, mensagem_id: int, usuario_id: int, 
                                   nota: str) -> Dict:
@@ -200,28 +371,41 @@ class GeminiController:
         Returns:
             Dict com resultado da operação
         """
+        prazo = Prazo(
+            settings.get_prazo("regenerar"),
+            nome=f"regenerar mensagem {mensagem_id}",
+            operacao="regenerar_resposta"
+        )
+        token_prazo = prazo.ativar()
+        reserva = None
+        
         try:
-            # Verifica rate limit
-            pode_fazer, erro_rate = api_monitor.verificar_rate_limit()
-            if not pode_fazer:
-                return helpers.create_response(False, erro_rate, error=erro_rate)
+            # Reserva a vaga no rate limit
+            with prazo.etapa("fila_admissao"):
+                reserva, erro_rate, retry_after = api_monitor.reservar_requisicao()
+            if reserva is None:
+                return self.resposta_rate_limit(erro_rate, retry_after)
             
             # Busca mensagem original
-            mensagem = self.mensagem_dao.buscar_por_id(mensagem_id)
+            with prazo.etapa("carregar_mensagem"):
+                mensagem = self.mensagem_dao.buscar_por_id(mensagem_id)
             if not mensagem or mensagem.is_from_ia():
                 return helpers.create_response(False, "Mensagem inválida", error="Invalid message")
             
             # Carrega contextos
-            sucesso_ctx, contextos, erro_ctx = context_service.carregar_todos_contextos()
+            with prazo.etapa("carregar_contextos"):
+                sucesso_ctx, contextos, erro_ctx = context_service.carregar_todos_contextos()
             if not sucesso_ctx:
                 contextos = []
             
             # Gera nova resposta
-            sucesso_ia, resposta_ia, erro_ia = gemini_service.gerar_resposta(
-                mensagem.conteudo, contextos
-            )
+            with prazo.etapa("gerar_resposta"):
+                sucesso_ia, resposta_ia, erro_ia = gemini_service.gerar_resposta(
+                    mensagem.conteudo, contextos
+                )
             
             if not sucesso_ia:
+                api_monitor.registrar_erro()
                 return helpers.create_response(False, "Erro ao regenerar resposta", error=erro_ia)
             
             # Salva nova resposta
@@ -232,10 +416,18 @@ class GeminiController:
                 e_nota_orientador=False
             )
             
-            msg_ia_salva = self.mensagem_dao.criar_mensagem(mensagem_ia)
+            with prazo.etapa("salvar_mensagem_ia"):
+                msg_ia_salva = self.mensagem_dao.criar_mensagem(mensagem_ia)
             
             # Registra uso
-            api_monitor.registrar_requisicao(tokens=len(resposta_ia) // 4)
+            Prazo.desativar(token_prazo)
+            token_prazo = None
+            with prazo.etapa("atualizar_monitor", verificar=False):
+                api_monitor.registrar_requisicao(
+                    tokens=len(resposta_ia) // 4,
+                    latencia=prazo.etapas_dict().get("gerar_resposta"),
+                    reserva=reserva
+                )
             
             return helpers.create_response(
                 True,
@@ -243,9 +435,20 @@ class GeminiController:
                 data=msg_ia_salva.to_dict() if msg_ia_salva else None
             )
             
+        except PrazoEsgotadoError as e:
+            logger.error(f"⏰ Prazo esgotado ao regenerar resposta: {e} | {prazo.resumo()}")
+            return self._resposta_prazo_esgotado(e)
+        except CapacidadeEsgotadaError as e:
+            logger.warning(f"🚦 {e} | Mensagem {mensagem_id}")
+            return self.resposta_rate_limit(f"{e}. Tente novamente em {e.retry_after}s.", e.retry_after)
         except Exception as e:
             logger.error(f"❌ Erro ao regenerar resposta: {e}")
             return helpers.create_response(False, "Erro ao regenerar resposta", error=str(e))
+        finally:
+            if token_prazo is not None:
+                Prazo.desativar(token_prazo)
+            if reserva is not None:
+                reserva.liberar()
     
     def obter_status_api(self) -> Dict:
         """Retorna status atual da API"""
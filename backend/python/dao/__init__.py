@@ -1,17 +1,23 @@
 from dao.base_dao import BaseDAO
-from dao.usuario_dao import UsuarioDAO, TipoUsuarioDAO
+from dao.referencia_dao import TabelaReferencia
+from dao.usuario_dao import UsuarioDAO, TipoUsuarioDAO, tipos_usuario
 from dao.projeto_dao import ProjetoDAO
-from dao.chat_dao import ChatDAO, TipoIADAO
+from dao.chat_dao import ChatDAO, TipoIADAO, tipos_ia
 from dao.mensagem_dao import MensagemDAO
 from dao.arquivo_dao import ArquivoDAO
+from dao.sistema_config_dao import SistemaConfigDAO
 
 __all__ = [
     'BaseDAO',
+    'TabelaReferencia',
     'UsuarioDAO',
     'TipoUsuarioDAO',
+    'tipos_usuario',
     'ProjetoDAO',
     'ChatDAO',
     'TipoIADAO',
+    'tipos_ia',
     'MensagemDAO',
-    'ArquivoDAO'
+    'ArquivoDAO',
+    'SistemaConfigDAO'
 ]
\ No newline at end of file
@@ -2,7 +2,7 @@
 DAO de Arquivo
 """
 from typing import Optional, List
-from dao.base_dao import BaseDAO
+from dao.base_dao import BaseDAO, esquecer_leituras
 from models.arquivo import Arquivo
 from utils.logger import logger
 
@@ -24,6 +24,8 @@ class ArquivoDAO(BaseDAO):
         }
         
         result = self.create(data)
+        # Os anexos vêm embutidos nas leituras da mensagem
+        esquecer_leituras("mensagens", arquivo.mensagem_id)
         if result:
             return Arquivo.from_dict(result)
         return None
@@ -51,6 +53,7 @@ class ArquivoDAO(BaseDAO):
     
     def contar_por_mensagem(self, mensagem_id: int) -> int:
         """Conta arquivos de uma mensagem"""
+        self._registrar_chamada("contar_por_mensagem")
         try:
             result = self.table.select("id", count="exact").eq("mensagem_id", mensagem_id).execute()
             return result.count if result.count else 0
@@ -60,6 +63,7 @@ class ArquivoDAO(BaseDAO):
     
     def buscar_por_nome(self, nome_arquivo: str) -> List[Arquivo]:
         """Busca arquivos por nome"""
+        self._registrar_chamada("buscar_por_nome")
         try:
             result = self.table.select("*").ilike("nome_arquivo", f"%{nome_arquivo}%").execute()
             return [Arquivo.from_dict(r) for r in result.data] if result.data else []
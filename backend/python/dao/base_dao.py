@@ -1,20 +1,134 @@
 """
 Base DAO - Classe base para todos os DAOs
 """
-from typing import List, Optional, Dict, Any
+import copy
+from dateutil.parser import isoparse
+from typing import List, Optional, Dict, Any, Tuple
+from flask import g, has_app_context
 from config.database import db
+from config.settings import settings
+from utils.cache_lru import CacheLRU, obter_cache, registrar_cache
 from utils.logger import logger
+from utils.metricas import metricas
+from utils.prazo import verificar_prazo
+
+_chamadas_dao = metricas.contador("apbia_dao_chamadas_total", "Consultas ao banco por tabela e operação")
+_mapa_identidade_consultas = metricas.contador(
+    "apbia_mapa_identidade_consultas_total", "Leituras por id resolvidas pelo mapa de identidade da requisição"
+)
+
+
+def mapa_identidade() -> Optional[Dict[Tuple[str, Any, str], Dict]]:
+    """
+    Linhas já lidas na requisição atual, por (tabela, id, colunas)
+    
+    Fica no `g` do Flask, então dura uma requisição e não é compartilhado
+    entre requisições. Fora de uma requisição (threads de fundo, scripts)
+    retorna None e as leituras vão sempre ao banco. Guarda e entrega cópias:
+    quem altera a linha recebida não muda o que a próxima leitura vê.
+    """
+    if not has_app_context():
+        return None
+    mapa = g.get("mapa_identidade")
+    if mapa is None:
+        mapa = g.mapa_identidade = {}
+    return mapa
+
+
+def esquecer_leituras(tabela: str, id: Any):
+    """Descarta as leituras de um registro (inclusive as que embutem dados que mudaram)"""
+    mapa = mapa_identidade()
+    if mapa:
+        for chave in [c for c in mapa if c[0] == tabela and c[1] == id]:
+            del mapa[chave]
+    
+    cache = obter_cache(tabela)
+    if cache is not None:
+        cache.invalidar_grupo(id)
+
+
+def esquecer_tabela(tabela: str):
+    """Descarta todas as leituras de uma tabela (ex.: quando dados embutidos nela mudam)"""
+    mapa = mapa_identidade()
+    if mapa:
+        for chave in [c for c in mapa if c[0] == tabela]:
+            del mapa[chave]
+    
+    cache = obter_cache(tabela)
+    if cache is not None:
+        cache.limpar()
+
+
+def _criar_cache(tabela: str) -> Optional[CacheLRU]:
+    """Cache de leituras por id da tabela, se configurado em settings.CACHE_DAO"""
+    config = settings.CACHE_DAO.get(tabela)
+    if not settings.CACHE_DAO_ATIVO or not config:
+        return None
+    return registrar_cache(tabela, config["ttl_segundos"], config["max_itens"])
 
 
 class BaseDAO:
     """Classe base para todos os DAOs"""
     
-    def __init__(self, table_name: str):
+    # Valores por consulta IN (mantém a URL da requisição curta)
+    IN_LOTE = 200
+    
+    # Linhas por INSERT em create_many (mantém o corpo da requisição pequeno)
+    INSERT_LOTE = 500
+    
+    # Projeções nomeadas (nome -> colunas) para leituras que não precisam da
+    # linha inteira; os finders aceitam o nome no lugar da lista de colunas
+    PROJECOES: Dict[str, str] = {}
+    
+    # Colunas que não podem ir para o cache do processo (ex.: senha_hash);
+    # leituras com "*" também ficam de fora quando houver alguma
+    COLUNAS_FORA_DO_CACHE: Tuple[str, ...] = ()
+    
+    def __init__(self, table_name: str, select: str = "*"):
         self.table_name = table_name
         self.table = db.get_table(table_name)
+        # Colunas das leituras; pode embutir tabelas relacionadas na mesma
+        # consulta (ex.: "*, tipos_ia(nome)"), sem uma ida ao banco por linha
+        self.select = select
+        # Compartilhado por todas as instâncias do DAO da mesma tabela
+        self.cache = _criar_cache(table_name)
+    
+    def _colunas(self, columns: Optional[str]) -> str:
+        """Colunas da consulta: nome de projeção, lista explícita ou o select padrão"""
+        if not columns:
+            return self.select
+        return self.PROJECOES.get(columns, columns)
+    
+    def _lembrar(self, linhas: List[Dict], colunas: str):
+        """Registra no mapa de identidade linhas lidas com as colunas dadas"""
+        mapa = mapa_identidade()
+        if mapa is None:
+            return
+        for linha in linhas:
+            if linha.get("id") is not None:
+                mapa[(self.table_name, linha["id"], colunas)] = copy.deepcopy(linha)
+    
+    def _pode_guardar(self, colunas: str) -> bool:
+        """Se uma leitura com essas colunas pode ir para o cache do processo"""
+        if self.cache is None:
+            return False
+        if not self.COLUNAS_FORA_DO_CACHE:
+            return True
+        nomes = {coluna.strip() for coluna in colunas.split(",")}
+        return "*" not in nomes and not nomes.intersection(self.COLUNAS_FORA_DO_CACHE)
+    
+    def _esquecer(self, id: int):
+        """Remove do mapa de identidade e do cache as leituras de um registro alterado"""
+        esquecer_leituras(self.table_name, id)
+    
+    def _registrar_chamada(self, operacao: str):
+        """Conta a consulta e falha cedo se o prazo da requisição acabou"""
+        verificar_prazo(f"{self.table_name}.{operacao}")
+        _chamadas_dao.inc(tabela=self.table_name, operacao=operacao)
     
     def create(self, data: Dict[str, Any]) -> Optional[Dict]:
         """Cria um novo registro"""
+        self._registrar_chamada("create")
         try:
             result = self.table.insert(data).execute()
             if result.data:
@@ -25,37 +139,168 @@ class BaseDAO:
             logger.error(f"❌ Erro ao criar registro em {self.table_name}: {e}")
             raise
     
-    def find_by_id(self, id: int) -> Optional[Dict]:
+    def create_many(self, linhas: List[Dict[str, Any]], tabela=None) -> List[Dict]:
+        """
+        Cria vários registros com um INSERT por lote de INSERT_LOTE linhas
+        
+        As linhas devem ter as mesmas colunas. Cada lote entra inteiro ou não
+        entra; se um lote falhar, os anteriores continuam gravados.
+        
+        Args:
+            tabela: Outra tabela (ex.: de vínculo, sem DAO próprio)
+        """
+        if not linhas:
+            return []
+        
+        self._registrar_chamada("create_many")
+        try:
+            criados = []
+            for inicio in range(0, len(linhas), self.INSERT_LOTE):
+                result = (tabela or self.table).insert(linhas[inicio:inicio + self.INSERT_LOTE]).execute()
+                criados.extend(result.data or [])
+            logger.info(f"✅ {len(criados)} registro(s) criado(s) em {self.table_name}")
+            return criados
+        except Exception as e:
+            logger.error(f"❌ Erro ao criar registros em lote em {self.table_name}: {e}")
+            raise
+    
+    def rpc(self, funcao: str, params: Dict[str, Any]) -> List[Dict]:
+        """Chama uma função do banco (uma ida e uma transação); propaga os erros"""
+        self._registrar_chamada(funcao)
+        result = db.client.rpc(funcao, params).execute()
+        return result.data or []
+    
+    def find_by_id(self, id: int, columns: Optional[str] = None) -> Optional[Dict]:
         """Busca registro por ID"""
+        colunas = self._colunas(columns)
+        mapa = mapa_identidade()
+        if mapa is not None and (self.table_name, id, colunas) in mapa:
+            # Já lida nesta requisição (e não alterada desde então)
+            _mapa_identidade_consultas.inc(tabela=self.table_name, resultado="acerto")
+            return copy.deepcopy(mapa[(self.table_name, id, colunas)])
+        
+        guardar = self._pode_guardar(colunas)
+        if guardar:
+            linha = self.cache.obter((id, colunas))
+            if linha is not None:
+                self._lembrar([linha], colunas)
+                return linha
+            versao = self.cache.versao()
+        
+        self._registrar_chamada("find_by_id")
         try:
-            result = self.table.select("*").eq("id", id).execute()
+            result = self.table.select(colunas).eq("id", id).execute()
+            if mapa is not None:
+                _mapa_identidade_consultas.inc(tabela=self.table_name, resultado="falta")
+            self._lembrar(result.data or [], colunas)
+            if guardar and result.data:
+                self.cache.definir((id, colunas), result.data[0], grupo=id, versao=versao)
             return result.data[0] if result.data else None
         except Exception as e:
             logger.error(f"❌ Erro ao buscar por ID em {self.table_name}: {e}")
             return None
     
-    def find_all(self, limit: int = 100, offset: int = 0) -> List[Dict]:
-        """Busca todos os registros"""
+    def find_all(self, limit: int = 100, depois_id: Optional[int] = None, columns: Optional[str] = None) -> List[Dict]:
+        """Busca todos os registros em ordem de id (a partir de `depois_id`, sem OFFSET)"""
+        self._registrar_chamada("find_all")
         try:
-            result = self.table.select("*").range(offset, offset + limit - 1).execute()
+            query = self.table.select(self._colunas(columns))
+            if depois_id is not None:
+                query = query.gt("id", depois_id)
+            result = query.order("id").limit(limit).execute()
             return result.data if result.data else []
         except Exception as e:
             logger.error(f"❌ Erro ao buscar todos em {self.table_name}: {e}")
             return []
     
-    def find_by_field(self, field: str, value: Any) -> List[Dict]:
+    def find_page(self, filtros: Dict[str, Any], limite: int, ordem: str = "id",
+                  direcao: Optional[str] = None, posicao: Optional[Tuple[Any, int]] = None,
+                  columns: Optional[str] = None, tabela=None) -> Tuple[List[Dict], bool]:
+        """
+        Página por keyset na ordenação (ordem, id)
+        
+        Sem posição, traz os `limite` últimos registros da ordenação. Com
+        `direcao` "antes" ou "depois", traz os vizinhos da `posicao`
+        (valor da coluna de ordem, id). Fora "id", a coluna de ordem deve
+        ser um timestamp. O filtro usa a própria posição, sem
+        OFFSET, então páginas profundas custam o mesmo que a primeira.
+        
+        Returns:
+            (registros em ordem crescente, se há mais registros na direção percorrida)
+        """
+        try:
+            return self._buscar_pagina(filtros, limite, ordem, direcao, posicao, columns, tabela)
+        except Exception as e:
+            logger.error(f"❌ Erro ao paginar {self.table_name}: {e}")
+            return [], False
+    
+    def _buscar_pagina(self, filtros: Dict[str, Any], limite: int, ordem: str, direcao: Optional[str],
+                       posicao: Optional[Tuple[Any, int]], columns: Optional[str] = None,
+                       tabela=None) -> Tuple[List[Dict], bool]:
+        """Consulta de find_page; propaga os erros do banco"""
+        self._registrar_chamada("find_page")
+        query = (tabela or self.table).select(self._colunas(columns))
+        for campo, valor in filtros.items():
+            query = query.eq(campo, valor)
+        
+        crescente = direcao == "depois"
+        if posicao is not None:
+            operador = "gt" if crescente else "lt"
+            valor, id = posicao
+            if ordem == "id":
+                query = getattr(query, operador)("id", id)
+            else:
+                # A posição vem do cursor do cliente: só um timestamp válido entra no filtro
+                valor = f'"{isoparse(str(valor)).isoformat()}"'
+                query = query.or_(f"{ordem}.{operador}.{valor},and({ordem}.eq.{valor},id.{operador}.{int(id)})")
+        
+        if ordem != "id":
+            query = query.order(ordem, desc=not crescente)
+        result = query.order("id", desc=not crescente).limit(limite + 1).execute()
+        
+        linhas = result.data or []
+        ha_mais = len(linhas) > limite
+        linhas = linhas[:limite]
+        if not crescente:
+            linhas.reverse()
+        return linhas, ha_mais
+    
+    def find_by_field(self, field: str, value: Any, columns: Optional[str] = None) -> List[Dict]:
         """Busca registros por campo específico"""
+        self._registrar_chamada("find_by_field")
         try:
-            result = self.table.select("*").eq(field, value).execute()
+            colunas = self._colunas(columns)
+            result = self.table.select(colunas).eq(field, value).execute()
+            self._lembrar(result.data or [], colunas)
             return result.data if result.data else []
         except Exception as e:
             logger.error(f"❌ Erro ao buscar por campo em {self.table_name}: {e}")
             return []
     
-    def find_one_by_field(self, field: str, value: Any) -> Optional[Dict]:
+    def find_by_field_in(self, field: str, values: List[Any], columns: Optional[str] = None) -> List[Dict]:
+        """Busca registros cujo campo está entre os valores (uma consulta por lote de IN_LOTE)"""
+        valores = list(dict.fromkeys(v for v in values if v is not None))
+        if not valores:
+            return []
+        
+        self._registrar_chamada("find_by_field_in")
+        try:
+            registros = []
+            for inicio in range(0, len(valores), self.IN_LOTE):
+                result = self.table.select(self._colunas(columns)).in_(field, valores[inicio:inicio + self.IN_LOTE]).execute()
+                registros.extend(result.data or [])
+            return registros
+        except Exception as e:
+            logger.error(f"❌ Erro ao buscar por lista de valores em {self.table_name}: {e}")
+            return []
+    
+    def find_one_by_field(self, field: str, value: Any, columns: Optional[str] = None) -> Optional[Dict]:
         """Busca um registro por campo específico"""
+        self._registrar_chamada("find_one_by_field")
         try:
-            result = self.table.select("*").eq(field, value).limit(1).execute()
+            colunas = self._colunas(columns)
+            result = self.table.select(colunas).eq(field, value).limit(1).execute()
+            self._lembrar(result.data or [], colunas)
             return result.data[0] if result.data else None
         except Exception as e:
             logger.error(f"❌ Erro ao buscar um por campo em {self.table_name}: {e}")
@@ -63,6 +308,7 @@ class BaseDAO:
     
     def update(self, id: int, data: Dict[str, Any]) -> Optional[Dict]:
         """Atualiza um registro"""
+        self._registrar_chamada("update")
         try:
             result = self.table.update(data).eq("id", id).execute()
             if result.data:
@@ -72,9 +318,13 @@ class BaseDAO:
         except Exception as e:
             logger.error(f"❌ Erro ao atualizar registro em {self.table_name}: {e}")
             raise
+        finally:
+            # Depois da escrita: uma leitura concorrente não repõe o valor antigo
+            self._esquecer(id)
     
     def delete(self, id: int) -> bool:
         """Deleta um registro"""
+        self._registrar_chamada("delete")
         try:
             result = self.table.delete().eq("id", id).execute()
             logger.info(f"✅ Registro deletado em {self.table_name}: ID {id}")
@@ -82,9 +332,12 @@ class BaseDAO:
         except Exception as e:
             logger.error(f"❌ Erro ao deletar registro em {self.table_name}: {e}")
             return False
+        finally:
+            self._esquecer(id)
     
     def count(self) -> int:
         """Conta total de registros"""
+        self._registrar_chamada("count")
         try:
             result = self.table.select("id", count="exact").execute()
             return result.count if result.count else 0
@@ -94,6 +347,12 @@ class BaseDAO:
     
     def exists(self, field: str, value: Any) -> bool:
         """Verifica se existe um registro com determinado valor"""
+        mapa = mapa_identidade()
+        if field == "id" and mapa and any(c[0] == self.table_name and c[1] == value for c in mapa):
+            _mapa_identidade_consultas.inc(tabela=self.table_name, resultado="acerto")
+            return True
+        
+        self._registrar_chamada("exists")
         try:
             result = self.table.select("id").eq(field, value).limit(1).execute()
             return len(result.data) > 0 if result.data else False
@@ -1,17 +1,32 @@
 """
 DAO de Chat
 """
-from typing import Optional, List
+from typing import Any, Optional, List, Tuple
+from postgrest.exceptions import APIError
 from dao.base_dao import BaseDAO
+from dao.mensagem_dao import MensagemDAO
+from dao.referencia_dao import TabelaReferencia
+from config.database import db
 from models.chat import Chat, TipoIA
 from utils.logger import logger
 
 
+# Códigos de tabela/view inexistente (PostgREST e Postgres)
+RELACAO_INEXISTENTE = ("PGRST205", "42P01")
+
+
 class ChatDAO(BaseDAO):
     """DAO para gerenciar chats"""
     
+    PROJECOES = {
+        # Colunas da view chats_resumo usadas nas listagens
+        "resumo": "id, projeto_id, tipo_ia_id, titulo, data_criacao, total_mensagens, ultima_mensagem_em, ultima_atividade"
+    }
+    
     def __init__(self):
         super().__init__("chats")
+        # View com total de mensagens e última atividade de cada chat
+        self.tabela_resumo = db.get_table("chats_resumo")
     
     def criar_chat(self, chat: Chat) -> Optional[Chat]:
         """Cria um novo chat"""
@@ -30,19 +45,50 @@ class ChatDAO(BaseDAO):
         """Busca chat por ID"""
         result = self.find_by_id(id)
         if result:
-            chat = Chat.from_dict(result)
-            return self._enrich_chat(chat)
+            return self._montar_chat(result)
         return None
     
     def listar_por_projeto(self, projeto_id: int) -> List[Chat]:
         """Lista chats de um projeto"""
         results = self.find_by_field("projeto_id", projeto_id)
-        return [self._enrich_chat(Chat.from_dict(r)) for r in results]
+        return [self._montar_chat(r) for r in results]
+    
+    def listar_resumo_por_projeto(self, projeto_id: int, limite: int = 100, direcao: Optional[str] = None,
+                                  posicao: Optional[Tuple[Any, int]] = None) -> Tuple[List[Chat], bool]:
+        """
+        Lista chats de um projeto com total de mensagens e última atividade
+        
+        Uma única consulta à view chats_resumo, paginada por keyset em
+        (data_criacao, id), com os chats mais novos primeiro. A chave é
+        imutável: ordenar por ultima_atividade, que muda enquanto o usuário
+        pagina, pularia ou repetiria chats. Se a view ainda não existir no
+        banco, pagina a tabela chats do mesmo jeito e conta as mensagens de
+        cada chat da página; qualquer outro erro é propagado.
+        
+        Returns:
+            (chats, se há mais chats na direção percorrida)
+        """
+        try:
+            linhas, ha_mais = self._buscar_pagina(
+                {"projeto_id": projeto_id}, limite, "data_criacao", direcao, posicao, "resumo", self.tabela_resumo
+            )
+            return [self._montar_chat(r) for r in reversed(linhas)], ha_mais
+        except APIError as e:
+            if e.code not in RELACAO_INEXISTENTE:
+                raise
+            logger.warning(f"⚠️ View chats_resumo inexistente, contando mensagens por chat: {e}")
+        
+        linhas, ha_mais = self._buscar_pagina({"projeto_id": projeto_id}, limite, "data_criacao", direcao, posicao)
+        mensagem_dao = MensagemDAO()
+        chats = [self._montar_chat(r) for r in reversed(linhas)]
+        for chat in chats:
+            chat.total_mensagens = mensagem_dao.contar_mensagens_chat(chat.id)
+        return chats, ha_mais
     
     def listar_por_tipo_ia(self, tipo_ia_id: int) -> List[Chat]:
         """Lista chats por tipo de IA"""
         results = self.find_by_field("tipo_ia_id", tipo_ia_id)
-        return [self._enrich_chat(Chat.from_dict(r)) for r in results]
+        return [self._montar_chat(r) for r in results]
     
     def atualizar_titulo(self, chat_id: int, novo_titulo: str) -> Optional[Chat]:
         """Atualiza título do chat"""
@@ -51,13 +97,10 @@ class ChatDAO(BaseDAO):
             return Chat.from_dict(result)
         return None
     
-    def _enrich_chat(self, chat: Chat) -> Chat:
-        """Enriquece chat com informações adicionais"""
-        # Busca tipo de IA
-        tipo_ia_dao = TipoIADAO()
-        tipo_ia = tipo_ia_dao.buscar_por_id(chat.tipo_ia_id)
-        if tipo_ia:
-            chat.tipo_ia_nome = tipo_ia.nome
+    def _montar_chat(self, row: dict) -> Chat:
+        """Cria o chat com o nome do tipo de IA (da tabela de referência em memória)"""
+        chat = Chat.from_dict(row)
+        chat.tipo_ia_nome = tipos_ia.nome_por_id(chat.tipo_ia_id)
         
         return chat
     
@@ -66,27 +109,12 @@ class ChatDAO(BaseDAO):
         return self.delete(chat_id)
 
 
-class TipoIADAO(BaseDAO):
-    """DAO para gerenciar tipos de IA"""
+class TipoIADAO(TabelaReferencia):
+    """DAO para gerenciar tipos de IA (servidos da memória)"""
     
     def __init__(self):
-        super().__init__("tipos_ia")
-    
-    def buscar_por_nome(self, nome: str) -> Optional[TipoIA]:
-        """Busca tipo de IA por nome"""
-        result = self.find_one_by_field("nome", nome)
-        if result:
-            return TipoIA.from_dict(result)
-        return None
-    
-    def buscar_por_id(self, id: int) -> Optional[TipoIA]:
-        """Busca tipo de IA por ID"""
-        result = self.find_by_id(id)
-        if result:
-            return TipoIA.from_dict(result)
-        return None
-    
-    def listar_todos(self) -> List[TipoIA]:
-        """Lista todos os tipos de IA"""
-        results = self.find_all()
-        return [TipoIA.from_dict(r) for r in results]
\ No newline at end of file
+        super().__init__("tipos_ia", TipoIA)
+
+
+# Instância global
+tipos_ia = TipoIADAO()
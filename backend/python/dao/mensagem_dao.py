@@ -1,18 +1,30 @@
 """
 DAO de Mensagem
 """
-from typing import Optional, List
+from datetime import datetime, timezone
+from typing import Any, Optional, List, Tuple
+from postgrest.exceptions import APIError
 from dao.base_dao import BaseDAO
+from models.arquivo import Arquivo
 from models.mensagem import Mensagem
-from config.database import db
 from utils.logger import logger
 
 
+# Código do PostgREST para função inexistente no banco
+FUNCAO_INEXISTENTE = "PGRST202"
+
+
 class MensagemDAO(BaseDAO):
     """DAO para gerenciar mensagens"""
     
+    PROJECOES = {
+        # Listas leves: prévia do conteúdo cortada no banco (função previa), sem anexos
+        "resumo": "id, chat_id, usuario_id, e_nota_orientador, data_envio, previa, usuarios(nome_completo)"
+    }
+    
     def __init__(self):
-        super().__init__("mensagens")
+        # Autor e anexos embutidos: cada listagem é uma única consulta
+        super().__init__("mensagens", select="*, usuarios(nome_completo), arquivos_chat(*)")
     
     def criar_mensagem(self, mensagem: Mensagem) -> Optional[Mensagem]:
         """Cria uma nova mensagem"""
@@ -28,35 +40,86 @@ class MensagemDAO(BaseDAO):
             return Mensagem.from_dict(result)
         return None
     
+    def salvar_troca(self, chat_id: int, usuario_id: int, pergunta: str, resposta: str,
+                     tokens: Optional[int] = None,
+                     enviada_em: Optional[datetime] = None) -> Tuple[Mensagem, Mensagem]:
+        """
+        Grava a pergunta do usuário e a resposta da IA juntas, numa única ida ao banco
+        
+        A função salvar_troca insere as duas numa transação: ou as duas ficam
+        gravadas ou nenhuma (sem pergunta órfã quando a resposta falha). Se a
+        função ainda não existir no banco, as duas linhas vão num único INSERT,
+        que também é atômico, sem os tokens.
+        
+        Args:
+            enviada_em: Quando o usuário enviou a pergunta (padrão: agora)
+        
+        Returns:
+            (mensagem do usuário, mensagem da IA)
+        
+        Raises:
+            Exception: se a gravação falhar
+        """
+        enviada_em = enviada_em or datetime.now(timezone.utc)
+        try:
+            linhas = self.rpc("salvar_troca", {
+                "p_chat_id": chat_id,
+                "p_usuario_id": usuario_id,
+                "p_pergunta": pergunta,
+                "p_pergunta_em": enviada_em.isoformat(),
+                "p_resposta": resposta,
+                "p_tokens": tokens
+            })
+        except APIError as e:
+            if e.code != FUNCAO_INEXISTENTE:
+                raise
+            logger.warning(f"⚠️ Função salvar_troca indisponível, gravando a troca num único INSERT: {e}")
+            linhas = self.create_many([
+                {"chat_id": chat_id, "usuario_id": usuario_id, "conteudo": pergunta,
+                 "e_nota_orientador": False, "data_envio": enviada_em.isoformat()},
+                {"chat_id": chat_id, "usuario_id": None, "conteudo": resposta,
+                 "e_nota_orientador": False, "data_envio": datetime.now(timezone.utc).isoformat()}
+            ])
+        
+        pergunta_salva = next(l for l in linhas if l.get("usuario_id") is not None)
+        resposta_salva = next(l for l in linhas if l.get("usuario_id") is None)
+        return Mensagem.from_dict(pergunta_salva), Mensagem.from_dict(resposta_salva)
+    
     def buscar_por_id(self, id: int) -> Optional[Mensagem]:
         """Busca mensagem por ID"""
         result = self.find_by_id(id)
         if result:
-            mensagem = Mensagem.from_dict(result)
-            return self._enrich_mensagem(mensagem)
+            return self._montar_mensagem(result)
         return None
     
     def listar_por_chat(self, chat_id: int, limit: int = 100) -> List[Mensagem]:
-        """Lista mensagens de um chat"""
-        try:
-            result = self.table.select("*").eq("chat_id", chat_id).order("data_envio", desc=False).limit(limit).execute()
-            mensagens = [Mensagem.from_dict(m) for m in result.data] if result.data else []
-            return [self._enrich_mensagem(m) for m in mensagens]
-        except Exception as e:
-            logger.error(f"Erro ao listar mensagens: {e}")
-            return []
+        """Lista as `limit` mensagens mais recentes de um chat, em ordem cronológica"""
+        mensagens, _ = self.listar_pagina(chat_id, limit)
+        return mensagens
+    
+    def listar_pagina(self, chat_id: int, limite: int, direcao: Optional[str] = None,
+                      posicao: Optional[Tuple[Any, int]] = None,
+                      columns: Optional[str] = None) -> Tuple[List[Mensagem], bool]:
+        """
+        Página de mensagens de um chat por keyset em (data_envio, id)
+        
+        Sem posição, traz as mais recentes; "antes"/"depois" trazem as mais
+        antigas/novas que a posição. As mensagens vêm em ordem cronológica.
+        """
+        linhas, ha_mais = self.find_page({"chat_id": chat_id}, limite, "data_envio", direcao, posicao, columns)
+        return [self._montar_mensagem(m) for m in linhas], ha_mais
     
     def listar_por_usuario(self, usuario_id: int) -> List[Mensagem]:
         """Lista mensagens de um usuário"""
         results = self.find_by_field("usuario_id", usuario_id)
-        return [self._enrich_mensagem(Mensagem.from_dict(m)) for m in results]
+        return [self._montar_mensagem(m) for m in results]
     
     def listar_notas_orientador(self, chat_id: int) -> List[Mensagem]:
         """Lista apenas notas do orientador em um chat"""
+        self._registrar_chamada("listar_notas_orientador")
         try:
-            result = self.table.select("*").eq("chat_id", chat_id).eq("e_nota_orientador", True).execute()
-            mensagens = [Mensagem.from_dict(m) for m in result.data] if result.data else []
-            return [self._enrich_mensagem(m) for m in mensagens]
+            result = self.table.select(self.select).eq("chat_id", chat_id).eq("e_nota_orientador", True).execute()
+            return [self._montar_mensagem(m) for m in result.data] if result.data else []
         except Exception as e:
             logger.error(f"Erro ao listar notas do orientador: {e}")
             return []
@@ -68,26 +131,13 @@ class MensagemDAO(BaseDAO):
             return Mensagem.from_dict(result)
         return None
     
-    def _enrich_mensagem(self, mensagem: Mensagem) -> Mensagem:
-        """Enriquece mensagem com informações adicionais"""
-        # Busca nome do usuário se existir
-        if mensagem.usuario_id:
-            try:
-                usuario_result = db.get_table("usuarios").select("nome_completo").eq("id", mensagem.usuario_id).execute()
-                if usuario_result.data:
-                    mensagem.usuario_nome = usuario_result.data[0].get("nome_completo")
-            except Exception as e:
-                logger.error(f"Erro ao buscar nome do usuário: {e}")
-        
-        # Busca arquivos anexados
-        try:
-            from dao.arquivo_dao import ArquivoDAO
-            arquivo_dao = ArquivoDAO()
-            mensagem.arquivos = [a.to_dict() for a in arquivo_dao.listar_por_mensagem(mensagem.id)]
-        except Exception as e:
-            logger.error(f"Erro ao buscar arquivos: {e}")
-            mensagem.arquivos = []
-        
+    def _montar_mensagem(self, row: dict) -> Mensagem:
+        """Cria a mensagem a partir da linha com autor e anexos embutidos"""
+        mensagem = Mensagem.from_dict(row)
+        autor = row.get("usuarios")
+        if autor:
+            mensagem.usuario_nome = autor.get("nome_completo")
+        mensagem.arquivos = [Arquivo.from_dict(a).to_dict() for a in row.get("arquivos_chat") or []]
         return mensagem
     
     def deletar_mensagem(self, mensagem_id: int) -> bool:
@@ -96,6 +146,7 @@ class MensagemDAO(BaseDAO):
     
     def contar_mensagens_chat(self, chat_id: int) -> int:
         """Conta mensagens de um chat"""
+        self._registrar_chamada("contar")
         try:
             result = self.table.select("id", count="exact").eq("chat_id", chat_id).execute()
             return result.count if result.count else 0
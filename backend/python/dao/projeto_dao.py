@@ -8,11 +8,24 @@ from config.database import db
 from utils.logger import logger
 
 
+# Projeto com participantes e orientadores embutidos (pelas tabelas de vínculo)
+SELECT_PROJETO = (
+    "*, "
+    "participantes_projetos(usuarios(id, nome_completo, email, bp)), "
+    "orientadores_projetos(usuarios(id, nome_completo, email))"
+)
+
+
 class ProjetoDAO(BaseDAO):
     """DAO para gerenciar projetos"""
     
+    PROJECOES = {
+        # Só o projeto, sem descrição nem membros
+        "resumo": "id, nome, area_projeto, ano_edicao, data_criacao"
+    }
+    
     def __init__(self):
-        super().__init__("projetos")
+        super().__init__("projetos", select=SELECT_PROJETO)
     
     def criar_projeto(self, projeto: Projeto) -> Optional[Projeto]:
         """Cria um novo projeto"""
@@ -28,48 +41,39 @@ class ProjetoDAO(BaseDAO):
             return Projeto.from_dict(result)
         return None
     
-    def buscar_por_id(self, id: int) -> Optional[Projeto]:
-        """Busca projeto por ID"""
-        result = self.find_by_id(id)
+    def buscar_por_id(self, id: int, columns: Optional[str] = None) -> Optional[Projeto]:
+        """Busca projeto por ID (`columns`: colunas ou projeção, ex.: "resumo")"""
+        result = self.find_by_id(id, columns)
         if result:
-            projeto = Projeto.from_dict(result)
-            return self._enrich_projeto(projeto)
+            return self._montar_projeto(result)
         return None
     
     def listar_por_ano(self, ano: int) -> List[Projeto]:
         """Lista projetos por ano"""
         results = self.find_by_field("ano_edicao", ano)
-        return [self._enrich_projeto(Projeto.from_dict(r)) for r in results]
+        return [self._montar_projeto(r) for r in results]
     
     def listar_por_area(self, area: str) -> List[Projeto]:
         """Lista projetos por área"""
         results = self.find_by_field("area_projeto", area)
-        return [self._enrich_projeto(Projeto.from_dict(r)) for r in results]
+        return [self._montar_projeto(r) for r in results]
     
     def listar_todos(self) -> List[Projeto]:
         """Lista todos os projetos"""
         results = self.find_all()
-        return [self._enrich_projeto(Projeto.from_dict(r)) for r in results]
+        return [self._montar_projeto(r) for r in results]
     
     def listar_projetos_participante(self, participante_id: int) -> List[Projeto]:
         """Lista projetos que um participante está vinculado"""
+        self._registrar_chamada("listar_projetos_participante")
         try:
-            # Busca IDs dos projetos
-            result = db.client.table('participantes_projetos').select('projeto_id').eq('participante_id', participante_id).execute()
+            # Os projetos (com seus membros) vêm embutidos nos vínculos: uma única consulta
+            result = db.client.table('participantes_projetos').select(f'projetos({SELECT_PROJETO})').eq('participante_id', participante_id).execute()
             
             if not result.data:
                 return []
             
-            projeto_ids = [r['projeto_id'] for r in result.data]
-            
-            # Busca os projetos
-            projetos = []
-            for projeto_id in projeto_ids:
-                projeto = self.buscar_por_id(projeto_id)
-                if projeto:
-                    projetos.append(projeto)
-            
-            return projetos
+            return [self._montar_projeto(r['projetos']) for r in result.data if r.get('projetos')]
             
         except Exception as e:
             logger.error(f"Erro ao listar projetos do participante: {e}")
@@ -77,23 +81,15 @@ class ProjetoDAO(BaseDAO):
     
     def listar_projetos_orientador(self, orientador_id: int) -> List[Projeto]:
         """Lista projetos que um orientador orienta"""
+        self._registrar_chamada("listar_projetos_orientador")
         try:
-            # Busca IDs dos projetos
-            result = db.client.table('orientadores_projetos').select('projeto_id').eq('orientador_id', orientador_id).execute()
+            # Os projetos (com seus membros) vêm embutidos nos vínculos: uma única consulta
+            result = db.client.table('orientadores_projetos').select(f'projetos({SELECT_PROJETO})').eq('orientador_id', orientador_id).execute()
             
             if not result.data:
                 return []
             
-            projeto_ids = [r['projeto_id'] for r in result.data]
-            
-            # Busca os projetos
-            projetos = []
-            for projeto_id in projeto_ids:
-                projeto = self.buscar_por_id(projeto_id)
-                if projeto:
-                    projetos.append(projeto)
-            
-            return projetos
+            return [self._montar_projeto(r['projetos']) for r in result.data if r.get('projetos')]
             
         except Exception as e:
             logger.error(f"Erro ao listar projetos do orientador: {e}")
@@ -113,37 +109,16 @@ class ProjetoDAO(BaseDAO):
             return Projeto.from_dict(result)
         return None
     
-    def _enrich_projeto(self, projeto: Projeto) -> Projeto:
-        """Enriquece projeto com participantes e orientadores"""
-        # Busca participantes
-        participantes = self._buscar_participantes(projeto.id)
-        projeto.participantes = participantes
-        
-        # Busca orientadores
-        orientadores = self._buscar_orientadores(projeto.id)
-        projeto.orientadores = orientadores
-        
+    def _montar_projeto(self, row: dict) -> Projeto:
+        """Cria o projeto a partir da linha com participantes e orientadores embutidos"""
+        projeto = Projeto.from_dict(row)
+        # Projeções sem os vínculos deixam os membros como None (não carregados)
+        if "participantes_projetos" in row:
+            projeto.participantes = [v["usuarios"] for v in row["participantes_projetos"] or [] if v.get("usuarios")]
+        if "orientadores_projetos" in row:
+            projeto.orientadores = [v["usuarios"] for v in row["orientadores_projetos"] or [] if v.get("usuarios")]
         return projeto
     
-    def _buscar_participantes(self, projeto_id: int) -> List[dict]:
-        """Busca participantes do projeto"""
-        try:
-            # Usa a função RPC 'get_participantes_projeto' do banco de dados
-            result = db.client.rpc('get_participantes_projeto', {'p_projeto_id': projeto_id}).execute()
-            return result.data if result.data else []
-        except Exception as e:
-            logger.error(f"Erro ao buscar participantes: {e}")
-            return []
-    
-    def _buscar_orientadores(self, projeto_id: int) -> List[dict]:
-        """Busca orientadores do projeto"""
-        try:
-            result = db.client.rpc('get_orientadores_projeto', {'p_projeto_id': projeto_id}).execute()
-            return result.data if result.data else []
-        except Exception as e:
-            logger.error(f"Erro ao buscar orientadores: {e}")
-            return []
-    
     def adicionar_participante(self, projeto_id: int, participante_id: int) -> bool:
         """Adiciona participante ao projeto"""
         try:
@@ -156,6 +131,9 @@ class ProjetoDAO(BaseDAO):
         except Exception as e:
             logger.error(f"Erro ao adicionar participante: {e}")
             return False
+        finally:
+            # Os membros vêm embutidos nas leituras (e no cache) do projeto
+            self._esquecer(projeto_id)
     
     def adicionar_orientador(self, projeto_id: int, orientador_id: int) -> bool:
         """Adiciona orientador ao projeto"""
@@ -169,6 +147,28 @@ class ProjetoDAO(BaseDAO):
         except Exception as e:
             logger.error(f"Erro ao adicionar orientador: {e}")
             return False
+        finally:
+            # Os membros vêm embutidos nas leituras (e no cache) do projeto
+            self._esquecer(projeto_id)
+    
+    def adicionar_membros(self, projeto_id: int, participantes: List[int], orientadores: List[int]) -> bool:
+        """Vincula vários participantes e orientadores (um INSERT por tabela de vínculo)"""
+        try:
+            self.create_many(
+                [{"projeto_id": projeto_id, "participante_id": id} for id in dict.fromkeys(participantes)],
+                tabela=db.get_table("participantes_projetos")
+            )
+            self.create_many(
+                [{"projeto_id": projeto_id, "orientador_id": id} for id in dict.fromkeys(orientadores)],
+                tabela=db.get_table("orientadores_projetos")
+            )
+            return True
+        except Exception as e:
+            logger.error(f"Erro ao adicionar membros ao projeto: {e}")
+            return False
+        finally:
+            # Os membros vêm embutidos nas leituras (e no cache) do projeto
+            self._esquecer(projeto_id)
     
     def remover_participante(self, projeto_id: int, participante_id: int) -> bool:
         """Remove participante do projeto"""
@@ -181,6 +181,9 @@ class ProjetoDAO(BaseDAO):
         except Exception as e:
             logger.error(f"Erro ao remover participante: {e}")
             return False
+        finally:
+            # Os membros vêm embutidos nas leituras (e no cache) do projeto
+            self._esquecer(projeto_id)
     
     def remover_orientador(self, projeto_id: int, orientador_id: int) -> bool:
         """Remove orientador do projeto"""
@@ -192,4 +195,7 @@ class ProjetoDAO(BaseDAO):
             return True
         except Exception as e:
             logger.error(f"Erro ao remover orientador: {e}")
-            return False
\ No newline at end of file
+            return False
+        finally:
+            # Os membros vêm embutidos nas leituras (e no cache) do projeto
+            self._esquecer(projeto_id)
@@ -0,0 +1,115 @@
+"""
+DAO base de tabelas de referência (id ↔ nome) servidas da memória
+"""
+import threading
+import time
+from typing import Any, Dict, List, Optional
+from dao.base_dao import BaseDAO
+from utils.logger import logger
+from utils.metricas import metricas
+
+
+class TabelaReferencia(BaseDAO):
+    """
+    Tabela pequena e quase imutável (ex.: tipos_usuario) carregada uma vez
+
+    Consultas por id ou nome são respondidas da memória. Um id ou nome
+    desconhecido provoca uma recarga (no máximo uma a cada
+    `RECARGA_MIN_SECONDS`, para um valor inválido não virar uma consulta
+    por requisição); escritas por este DAO recarregam na hora.
+    """
+
+    RECARGA_MIN_SECONDS = 30
+    LIMITE_LINHAS = 1000
+
+    def __init__(self, table_name: str, modelo):
+        super().__init__(table_name)
+        self.modelo = modelo
+        self._por_id: Dict[int, Any] = {}
+        self._por_nome: Dict[str, Any] = {}
+        self._carregada = False
+        self._ultima_tentativa = 0.0
+        self._lock = threading.Lock()
+
+        self._cargas = metricas.contador(
+            "apbia_referencia_cargas_total", "Cargas das tabelas de referência a partir do banco"
+        )
+
+    def carregar(self) -> bool:
+        """Lê a tabela do banco; em caso de falha mantém o que já estava em memória"""
+        with self._lock:
+            self._ultima_tentativa = time.monotonic()
+            linhas = self.find_all(limit=self.LIMITE_LINHAS)
+            if not linhas:
+                logger.warning(f"⚠️ Tabela de referência {self.table_name} vazia ou indisponível")
+                return False
+
+            itens = [self.modelo.from_dict(linha) for linha in linhas]
+            self._por_id = {item.id: item for item in itens}
+            self._por_nome = {item.nome: item for item in itens}
+            self._carregada = True
+
+        self._cargas.inc(tabela=self.table_name)
+        logger.info(f"📚 {self.table_name}: {len(itens)} registro(s) em memória")
+        return True
+
+    def _recarregar_se_permitido(self) -> bool:
+        """Recarrega se a última tentativa já tem mais de RECARGA_MIN_SECONDS"""
+        if time.monotonic() - self._ultima_tentativa < self.RECARGA_MIN_SECONDS:
+            return False
+        return self.carregar()
+
+    def _garantir_carga(self):
+        if not self._carregada:
+            self._recarregar_se_permitido()
+
+    def buscar_por_id(self, id: int):
+        """Busca registro por ID (da memória)"""
+        self._garantir_carga()
+        item = self._por_id.get(id)
+        if item is None and id is not None and self._recarregar_se_permitido():
+            item = self._por_id.get(id)
+        return item
+
+    def buscar_por_nome(self, nome: str):
+        """Busca registro por nome (da memória)"""
+        self._garantir_carga()
+        item = self._por_nome.get(nome)
+        if item is None and nome and self._recarregar_se_permitido():
+            item = self._por_nome.get(nome)
+        return item
+
+    def nome_por_id(self, id: int) -> Optional[str]:
+        """Nome do registro, ou None se o id for desconhecido"""
+        item = self.buscar_por_id(id)
+        return item.nome if item else None
+
+    def listar_todos(self) -> List:
+        """Lista todos os registros (da memória, ordenados por id)"""
+        self._garantir_carga()
+        return [self._por_id[id] for id in sorted(self._por_id)]
+
+    def create(self, data: Dict[str, Any]) -> Optional[Dict]:
+        result = super().create(data)
+        if result:
+            self.carregar()
+        return result
+
+    def update(self, id: int, data: Dict[str, Any]) -> Optional[Dict]:
+        result = super().update(id, data)
+        if result:
+            self.carregar()
+        return result
+
+    def delete(self, id: int) -> bool:
+        result = super().delete(id)
+        if result:
+            self.carregar()
+        return result
+
+    def obter_relatorio(self) -> Dict:
+        """Quantidade em memória e se a carga já foi feita"""
+        return {
+            'carregada': self._carregada,
+            'registros': len(self._por_id)
+        }
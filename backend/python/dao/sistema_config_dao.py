@@ -0,0 +1,23 @@
+"""
+DAO de Configurações do Sistema
+"""
+from typing import Optional
+from dao.base_dao import BaseDAO
+
+
+class SistemaConfigDAO(BaseDAO):
+    """DAO da tabela sistema_config (valores em texto, por chave)"""
+    
+    def __init__(self):
+        super().__init__("sistema_config")
+    
+    def ler(self, chave: str) -> Optional[str]:
+        """Valor guardado na chave (None se não existir); erros do banco são propagados"""
+        self._registrar_chamada("ler")
+        result = self.table.select("valor").eq("chave", chave).execute()
+        return result.data[0]["valor"] if result.data else None
+    
+    def gravar(self, chave: str, valor: str):
+        """Cria ou substitui o valor da chave; erros do banco são propagados"""
+        self._registrar_chamada("gravar")
+        self.table.upsert({"chave": chave, "valor": valor}).execute()
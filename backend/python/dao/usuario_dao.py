@@ -2,7 +2,8 @@
 DAO de Usuário
 """
 from typing import Optional, List
-from dao.base_dao import BaseDAO
+from dao.base_dao import BaseDAO, esquecer_tabela
+from dao.referencia_dao import TabelaReferencia
 from models.usuario import Usuario, TipoUsuario
 from utils.logger import logger
 
@@ -10,6 +11,14 @@ from utils.logger import logger
 class UsuarioDAO(BaseDAO):
     """DAO para gerenciar usuários"""
     
+    PROJECOES = {
+        # Sem senha_hash: leituras que só identificam ou exibem o usuário
+        "publico": "id, nome_completo, email, tipo_usuario_id, bp, data_criacao, data_atualizacao"
+    }
+    
+    # O hash da senha não fica no cache do processo: só a projeção "publico" é guardada
+    COLUNAS_FORA_DO_CACHE = ("senha_hash",)
+    
     def __init__(self):
         super().__init__("usuarios")
     
@@ -32,27 +41,32 @@ class UsuarioDAO(BaseDAO):
         """Busca usuário por email"""
         result = self.find_one_by_field("email", email)
         if result:
-            return self._enrich_usuario(Usuario.from_dict(result))
+            return self._montar_usuario(result)
         return None
     
     def buscar_por_bp(self, bp: str) -> Optional[Usuario]:
         """Busca usuário por BP"""
         result = self.find_one_by_field("bp", bp)
         if result:
-            return self._enrich_usuario(Usuario.from_dict(result))
+            return self._montar_usuario(result)
         return None
     
-    def buscar_por_id(self, id: int) -> Optional[Usuario]:
-        """Busca usuário por ID"""
-        result = self.find_by_id(id)
+    def buscar_por_id(self, id: int, columns: Optional[str] = None) -> Optional[Usuario]:
+        """Busca usuário por ID (`columns`: colunas ou projeção, ex.: "publico")"""
+        result = self.find_by_id(id, columns)
         if result:
-            return self._enrich_usuario(Usuario.from_dict(result))
+            return self._montar_usuario(result)
         return None
     
+    def listar_por_ids(self, ids: List[int]) -> List[Usuario]:
+        """Lista usuários pelos IDs (sem senha; uma consulta por lote de IN_LOTE)"""
+        results = self.find_by_field_in("id", ids, "publico")
+        return [self._montar_usuario(r) for r in results]
+    
     def listar_por_tipo(self, tipo_usuario_id: int) -> List[Usuario]:
         """Lista usuários por tipo"""
-        results = self.find_by_field("tipo_usuario_id", tipo_usuario_id)
-        return [self._enrich_usuario(Usuario.from_dict(r)) for r in results]
+        results = self.find_by_field("tipo_usuario_id", tipo_usuario_id, "publico")
+        return [self._montar_usuario(r) for r in results]
     
     def atualizar_usuario(self, usuario: Usuario) -> Optional[Usuario]:
         """Atualiza dados do usuário"""
@@ -69,16 +83,16 @@ class UsuarioDAO(BaseDAO):
             data["bp"] = usuario.bp
         
         result = self.update(usuario.id, data)
+        # Nome, email e BP vêm embutidos nos membros dos projetos em cache
+        esquecer_tabela("projetos")
         if result:
             return Usuario.from_dict(result)
         return None
     
-    def _enrich_usuario(self, usuario: Usuario) -> Usuario:
-        """Enriquece usuário com informações do tipo"""
-        tipo_dao = TipoUsuarioDAO()
-        tipo = tipo_dao.buscar_por_id(usuario.tipo_usuario_id)
-        if tipo:
-            usuario.tipo_usuario_nome = tipo.nome
+    def _montar_usuario(self, row: dict) -> Usuario:
+        """Cria o usuário com o nome do tipo (da tabela de referência em memória)"""
+        usuario = Usuario.from_dict(row)
+        usuario.tipo_usuario_nome = tipos_usuario.nome_por_id(usuario.tipo_usuario_id)
         return usuario
     
     def email_existe(self, email: str) -> bool:
@@ -90,27 +104,12 @@ class UsuarioDAO(BaseDAO):
         return self.exists("bp", bp)
 
 
-class TipoUsuarioDAO(BaseDAO):
-    """DAO para gerenciar tipos de usuário"""
+class TipoUsuarioDAO(TabelaReferencia):
+    """DAO para gerenciar tipos de usuário (servidos da memória)"""
     
     def __init__(self):
-        super().__init__("tipos_usuario")
-    
-    def buscar_por_nome(self, nome: str) -> Optional[TipoUsuario]:
-        """Busca tipo por nome"""
-        result = self.find_one_by_field("nome", nome)
-        if result:
-            return TipoUsuario.from_dict(result)
-        return None
-    
-    def buscar_por_id(self, id: int) -> Optional[TipoUsuario]:
-        """Busca tipo por ID"""
-        result = self.find_by_id(id)
-        if result:
-            return TipoUsuario.from_dict(result)
-        return None
-    
-    def listar_todos(self) -> List[TipoUsuario]:
-        """Lista todos os tipos"""
-        results = self.find_all()
-        return [TipoUsuario.from_dict(r) for r in results]
\ No newline at end of file
+        super().__init__("tipos_usuario", TipoUsuario)
+
+
+# Instância global
+tipos_usuario = TipoUsuarioDAO()
@@ -2,13 +2,18 @@
 APBIA - API Principal
 Sistema de Ajuda com IA para Projetos da Bragantec
 """
-from flask import Flask, request, jsonify
+from flask import Flask, Response, g, request, jsonify
 from flask_cors import CORS
 from functools import wraps
+from concurrent.futures import TimeoutError as FuturoTimeoutError
+import hmac
+import json
+import time
 from config.settings import settings
 from config.database import db
 from utils.logger import logger
 from utils.helpers import helpers
+from utils.metricas import metricas
 
 # Controllers
 from controllers.chat_controller import chat_controller
@@ -17,8 +22,10 @@ from controllers.admin_controller import admin_controller
 
 # Services
 from services.auth_service import auth_service
+from services.api_monitor_service import api_monitor
 from dao.projeto_dao import ProjetoDAO
-from dao.usuario_dao import UsuarioDAO
+from dao.usuario_dao import UsuarioDAO, tipos_usuario
+from dao.chat_dao import tipos_ia
 
 # Inicializa Flask
 app = Flask(__name__)
@@ -28,6 +35,68 @@ CORS(app)
 projeto_dao = ProjetoDAO()
 usuario_dao = UsuarioDAO()
 
+# Métricas HTTP (por rota registrada, não pela URL, para não multiplicar séries)
+_requisicoes_http = metricas.contador("apbia_http_requisicoes_total", "Requisições HTTP por rota, método e status")
+_duracao_http = metricas.histograma("apbia_http_duracao_segundos", "Duração das requisições HTTP")
+
+
+def _http_status(result: dict, sucesso: int = 200, falha: int = 400) -> int:
+    """Status HTTP de uma resposta dos controllers"""
+    if result['success']:
+        return sucesso
+    if result.get('error') == "Deadline exceeded":
+        return 504
+    if result.get('error') in ("Quota exceeded", "Rate limit exceeded"):
+        return 429
+    if result.get('error') == "Service unavailable":
+        return 503
+    return falha
+
+
+def _headers_ia(result: dict) -> dict:
+    """Retry-After e saldo das cotas do usuário e do projeto nos headers da resposta"""
+    data = result.get('data') or {}
+    headers = {}
+    
+    cota = data.get('cota')
+    if cota:
+        headers['X-Cota-Custo'] = str(cota['custo'])
+        headers['X-Cota-Usuario-Restante'] = str(cota['restante_usuario'])
+        headers['X-Cota-Usuario-Limite'] = str(cota['limite_usuario'])
+        if cota.get('restante_projeto') is not None:
+            headers['X-Cota-Projeto-Restante'] = str(cota['restante_projeto'])
+            headers['X-Cota-Projeto-Limite'] = str(cota['limite_projeto'])
+    
+    retry_after = data.get('retry_after') or (cota or {}).get('retry_after')
+    if retry_after is not None:
+        headers['Retry-After'] = str(retry_after)
+    return headers
+
+# ==================== MIDDLEWARE DE MÉTRICAS ====================
+
+@app.before_request
+def iniciar_medicao():
+    g.inicio_requisicao = time.perf_counter()
+
+
+@app.after_request
+def registrar_medicao(response):
+    inicio = g.pop('inicio_requisicao', None)
+    if inicio is not None:
+        rota = request.url_rule.rule if request.url_rule else "desconhecida"
+        metodo = request.method
+        _requisicoes_http.inc(rota=rota, metodo=metodo, status=response.status_code)
+        
+        def observar_duracao():
+            _duracao_http.observar(time.perf_counter() - inicio, rota=rota, metodo=metodo)
+        
+        if response.is_streamed:
+            # Streaming (SSE): a requisição só termina quando o stream é fechado
+            response.call_on_close(observar_duracao)
+        else:
+            observar_duracao()
+    return response
+
 # ==================== MIDDLEWARE DE AUTENTICAÇÃO ====================
 
 def require_auth(f):
@@ -97,7 +166,7 @@ def login():
 def validate_token():
     """Valida token JWT"""
     try:
-        usuario = usuario_dao.buscar_por_id(request.user_id)
+        usuario = usuario_dao.buscar_por_id(request.user_id, "publico")
         
         if usuario:
             return jsonify(helpers.create_response(
@@ -177,10 +246,14 @@ def buscar_chat(chat_id):
 @app.route('/api/chat/projeto/<int:projeto_id>', methods=['GET'])
 @require_auth
 def listar_chats_projeto(projeto_id):
-    """Lista chats de um projeto"""
+    """Lista chats de um projeto (?limit=&cursor=)"""
     try:
-        result = chat_controller.listar_chats_projeto(projeto_id)
-        return jsonify(result), 200
+        result = chat_controller.listar_chats_projeto(
+            projeto_id,
+            request.args.get('limit', type=int),
+            request.args.get('cursor')
+        )
+        return jsonify(result), _http_status(result)
         
     except Exception as e:
         logger.error(f"Erro ao listar chats: {e}")
@@ -190,11 +263,15 @@ def listar_chats_projeto(projeto_id):
 @app.route('/api/chat/<int:chat_id>/mensagens', methods=['GET'])
 @require_auth
 def listar_mensagens_chat(chat_id):
-    """Lista mensagens de um chat"""
+    """Lista mensagens de um chat (?limit=&cursor=&resumo=true)"""
     try:
-        limit = int(request.args.get('limit', 100))
-        result = chat_controller.listar_mensagens_chat(chat_id, limit)
-        return jsonify(result), 200
+        result = chat_controller.listar_mensagens_chat(
+            chat_id,
+            request.args.get('limit', type=int),
+            request.args.get('cursor'),
+            request.args.get('resumo', 'false').lower() == 'true'
+        )
+        return jsonify(result), _http_status(result)
         
     except Exception as e:
         logger.error(f"Erro ao listar mensagens: {e}")
@@ -233,16 +310,98 @@ def enviar_mensagem():
             chat_id, 
             request.user_id, 
             conteudo, 
-            usar_thinking
+            usar_thinking,
+            tipo_usuario=request.user_tipo
         )
         
-        return jsonify(result), 200 if result['success'] else 400
+        return jsonify(result), _http_status(result), _headers_ia(result)
         
     except Exception as e:
         logger.error(f"Erro ao enviar mensagem: {e}")
         return jsonify(helpers.create_response(False, "Erro interno do servidor")), 500
 
 
+@app.route('/api/ia/mensagem/stream', methods=['POST'])
+@require_auth
+def enviar_mensagem_stream():
+    """
+    Envia mensagem e recebe a resposta da IA via Server-Sent Events
+    
+    A geração roda em segundo plano enquanto a conexão recebe keep-alives.
+    Se o cliente desconectar (aba fechada, mensagem reenviada), a geração
+    é cancelada e a resposta não é persistida.
+    """
+    try:
+        data = request.get_json()
+        chat_id = data.get('chat_id')
+        conteudo = data.get('conteudo')
+        usar_thinking = data.get('usar_thinking', False)
+        
+        if not chat_id or not conteudo:
+            return jsonify(helpers.create_response(False, "chat_id e conteudo são obrigatórios")), 400
+        
+        # Limite atingido: responde 429 já, antes de abrir o stream
+        reserva, erro_rate, retry_after = api_monitor.reservar_requisicao()
+        if reserva is None:
+            result = gemini_controller.resposta_rate_limit(erro_rate, retry_after)
+            return jsonify(result), _http_status(result), _headers_ia(result)
+        
+        # A vaga reservada segue com a geração (que a confirma ou devolve)
+        cancelamento, futuro = gemini_controller.iniciar_processamento(
+            chat_id,
+            request.user_id,
+            conteudo,
+            usar_thinking,
+            tipo_usuario=request.user_tipo,
+            reserva=reserva
+        )
+        
+        def eventos():
+            try:
+                while True:
+                    try:
+                        result = futuro.result(timeout=settings.GERACAO_HEARTBEAT_SECONDS)
+                    except FuturoTimeoutError:
+                        # Falha ao escrever aqui indica que o cliente desconectou
+                        yield ": processando\n\n"
+                        continue
+                    
+                    yield f"event: resultado\ndata: {json.dumps(result)}\n\n"
+                    return
+            finally:
+                if not futuro.done():
+                    cancelamento.cancelar("Cliente desconectado")
+        
+        return Response(
+            eventos(),
+            mimetype='text/event-stream',
+            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+        )
+        
+    except Exception as e:
+        logger.error(f"Erro ao enviar mensagem (stream): {e}")
+        return jsonify(helpers.create_response(False, "Erro interno do servidor")), 500
+
+
+@app.route('/api/ia/cancelar', methods=['POST'])
+@require_auth
+def cancelar_geracao():
+    """Cancela a geração em andamento do usuário em um chat"""
+    try:
+        data = request.get_json()
+        chat_id = data.get('chat_id')
+        
+        if not chat_id:
+            return jsonify(helpers.create_response(False, "chat_id é obrigatório")), 400
+        
+        result = gemini_controller.cancelar_geracao(chat_id, request.user_id)
+        return jsonify(result), 200 if result['success'] else 404
+        
+    except Exception as e:
+        logger.error(f"Erro ao cancelar geração: {e}")
+        return jsonify(helpers.create_response(False, "Erro interno do servidor")), 500
+
+
 @app.route('/api/ia/nota-orientador', methods=['POST'])
 @require_auth
 def adicionar_nota_orientador():
@@ -325,7 +484,7 @@ def testar_contextos():
 def listar_projetos():
     """Lista projetos do usuário"""
     try:
-        usuario = usuario_dao.buscar_por_id(request.user_id)
+        usuario = usuario_dao.buscar_por_id(request.user_id, "publico")
         
         if not usuario:
             return jsonify(helpers.create_response(False, "Usuário não encontrado")), 404
@@ -381,7 +540,7 @@ def buscar_projeto(projeto_id):
 def meu_perfil():
     """Retorna perfil do usuário logado"""
     try:
-        usuario = usuario_dao.buscar_por_id(request.user_id)
+        usuario = usuario_dao.buscar_por_id(request.user_id, "publico")
         
         if usuario:
             return jsonify(helpers.create_response(
@@ -426,6 +585,23 @@ def sistema_status():
         return jsonify(helpers.create_response(False, "Erro interno do servidor")), 500
 
 
+@app.route('/api/admin/sistema/estatisticas', methods=['GET'])
+@require_admin
+def sistema_estatisticas():
+    """Estatísticas de uso da API por período (?dias=7)"""
+    try:
+        dias = request.args.get('dias', 7, type=int)
+        if dias < 1:
+            return jsonify(helpers.create_response(False, "dias deve ser maior que zero")), 400
+        
+        result = admin_controller.obter_estatisticas_uso(dias)
+        return jsonify(result), 200 if result['success'] else 500
+        
+    except Exception as e:
+        logger.error(f"Erro ao obter estatísticas: {e}")
+        return jsonify(helpers.create_response(False, "Erro interno do servidor")), 500
+
+
 @app.route('/api/admin/sistema/toggle', methods=['POST'])
 @require_admin
 def sistema_toggle():
@@ -447,6 +623,19 @@ def sistema_toggle():
         return jsonify(helpers.create_response(False, "Erro interno do servidor")), 500
 
 
+@app.route('/api/admin/referencias/recarregar', methods=['POST'])
+@require_admin
+def recarregar_referencias():
+    """Recarrega os tipos de usuário e de IA mantidos em memória"""
+    try:
+        result = admin_controller.recarregar_referencias()
+        return jsonify(result), 200 if result['success'] else 500
+        
+    except Exception as e:
+        logger.error(f"Erro ao recarregar referências: {e}")
+        return jsonify(helpers.create_response(False, "Erro interno do servidor")), 500
+
+
 # ==================== ROTAS DE HEALTH CHECK ====================
 
 @app.route('/api/health', methods=['GET'])
@@ -467,6 +656,20 @@ def health_check():
         return jsonify({"status": "error", "message": str(e)}), 500
 
 
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Métricas no formato texto do Prometheus (exige METRICS_TOKEN)"""
+    if not settings.METRICS_TOKEN:
+        # Sem token configurado o endpoint fica desligado, nunca aberto
+        return Response("Not Found\n", status=404, mimetype="text/plain")
+    
+    auth_header = request.headers.get('Authorization', '')
+    if not hmac.compare_digest(auth_header, f"Bearer {settings.METRICS_TOKEN}"):
+        return Response("Unauthorized\n", status=401, mimetype="text/plain")
+    
+    return Response(metricas.exportar(), mimetype="text/plain; version=0.0.4; charset=utf-8")
+
+
 # ==================== INICIALIZAÇÃO ====================
 
 if __name__ == '__main__':
@@ -491,6 +694,12 @@ if __name__ == '__main__':
         print("❌ Erro ao conectar com Supabase")
         exit(1)
     
+    # Carrega as tabelas de referência antes da primeira requisição
+    if tipos_usuario.carregar() and tipos_ia.carregar():
+        print("✅ Tabelas de referência carregadas")
+    else:
+        print("⚠️ Tabelas de referência não carregadas (nova tentativa no primeiro uso)")
+    
     print("\n🌐 Servidor rodando em:")
     print(f"   Local: http://127.0.0.1:{settings.PORT}")
     print(f"   Rede: http://{settings.HOST}:{settings.PORT}")
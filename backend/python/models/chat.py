@@ -20,6 +20,9 @@ class Chat:
     tipo_ia_nome: Optional[str] = None
     projeto_nome: Optional[str] = None
     mensagens: Optional[List[dict]] = None
+    total_mensagens: Optional[int] = None
+    ultima_mensagem_em: Optional[datetime] = None
+    ultima_atividade: Optional[datetime] = None
     
     def to_dict(self) -> dict:
         """Converte para dicionário"""
@@ -40,6 +43,11 @@ class Chat:
         if self.mensagens:
             data["mensagens"] = self.mensagens
         
+        if self.total_mensagens is not None:
+            data["total_mensagens"] = self.total_mensagens
+            data["ultima_mensagem_em"] = self._format_datetime(self.ultima_mensagem_em)
+            data["ultima_atividade"] = self._format_datetime(self.ultima_atividade)
+        
         return data
     
     def _format_datetime(self, dt) -> Optional[str]:
@@ -68,7 +76,10 @@ class Chat:
             data_criacao=data.get("data_criacao"),
             tipo_ia_nome=data.get("tipo_ia_nome"),
             projeto_nome=data.get("projeto_nome"),
-            mensagens=data.get("mensagens")
+            mensagens=data.get("mensagens"),
+            total_mensagens=data.get("total_mensagens"),
+            ultima_mensagem_em=data.get("ultima_mensagem_em"),
+            ultima_atividade=data.get("ultima_atividade")
         )
 
 
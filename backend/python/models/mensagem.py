@@ -16,10 +16,12 @@ class Mensagem:
     conteudo: str = ""
     e_nota_orientador: bool = False
     data_envio: Optional[datetime] = None
+    tokens: Optional[int] = None  # Estimativa de tokens da troca (só nas respostas da IA)
     
     # Campos extras (não persistidos)
     usuario_nome: Optional[str] = None
     arquivos: Optional[List[dict]] = None
+    previa: Optional[str] = None
     
     def to_dict(self) -> dict:
         """Converte para dicionário"""
@@ -32,12 +34,20 @@ class Mensagem:
             "data_envio": self._format_datetime(self.data_envio)
         }
         
+        if self.tokens is not None:
+            data["tokens"] = self.tokens
+        
         if self.usuario_nome:
             data["usuario_nome"] = self.usuario_nome
         
         if self.arquivos:
             data["arquivos"] = self.arquivos
         
+        if self.previa is not None:
+            # Lida pela projeção resumida: só a prévia do conteúdo veio do banco
+            del data["conteudo"]
+            data["previa"] = self.previa
+        
         return data
     
     def _format_datetime(self, dt) -> Optional[str]:
@@ -65,8 +75,10 @@ class Mensagem:
             conteudo=data.get("conteudo", ""),
             e_nota_orientador=data.get("e_nota_orientador", False),
             data_envio=data.get("data_envio"),
+            tokens=data.get("tokens"),
             usuario_nome=data.get("usuario_nome"),
-            arquivos=data.get("arquivos")
+            arquivos=data.get("arquivos"),
+            previa=data.get("previa")
         )
     
     def is_from_ia(self) -> bool:
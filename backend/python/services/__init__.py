@@ -3,11 +3,13 @@ from services.gemini_service import gemini_service
 from services.context_service import context_service
 from services.supabase_service import supabase_service
 from services.api_monitor_service import api_monitor
+from services.cancelamento_service import cancelamento_service
 
 __all__ = [
     'auth_service',
     'gemini_service',
     'context_service',
     'supabase_service',
-    'api_monitor'
+    'api_monitor',
+    'cancelamento_service'
 ]
\ No newline at end of file
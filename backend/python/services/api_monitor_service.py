@@ -1,217 +1,613 @@
 """
 Serviço de monitoramento de uso da API
 """
+import atexit
+import math
+import threading
+import time
 from datetime import datetime, timedelta
-from typing import Dict, Optional
+from typing import Dict, Optional, Tuple
 from config.settings import settings
-from config.database import db
+from dao.sistema_config_dao import SistemaConfigDAO
+from services.chaves_gemini_service import pool_chaves_gemini
+from utils.estado_compartilhado import criar_estado_compartilhado
+from utils.metricas import metricas, rotulos
+from utils.serie_temporal import SerieUso
 from utils.logger import logger
-import time
+
+_requisicoes_gemini = metricas.contador("apbia_gemini_requisicoes_total", "Requisições feitas ao Gemini")
+_tokens_gemini = metricas.contador("apbia_gemini_tokens_total", "Tokens estimados das respostas do Gemini")
+_erros_gemini = metricas.contador("apbia_gemini_erros_total", "Gerações que falharam")
+_cancelamentos_gemini = metricas.contador("apbia_gemini_cancelamentos_total", "Gerações canceladas")
+
+
+def _inicio_mes(agora: datetime) -> datetime:
+    return agora.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def _inicio_mes_seguinte(agora: datetime) -> datetime:
+    inicio = _inicio_mes(agora)
+    if inicio.month == 12:
+        return inicio.replace(year=inicio.year + 1, month=1)
+    return inicio.replace(month=inicio.month + 1)
+
+
+def _mes_referencia(agora: datetime) -> int:
+    """Mês do calendário como inteiro (ex.: 202610), guardado no estado compartilhado"""
+    return agora.year * 100 + agora.month
+
+
+class ReservaRequisicao:
+    """
+    Vaga na janela por minuto, ocupada na admissão da requisição
+
+    A reserva conta e registra numa única operação atômica do estado
+    compartilhado, então uma rajada simultânea (em qualquer worker) não passa
+    do limite. Se o Gemini não chegar a ser chamado ou a chamada falhar, a
+    vaga é devolvida com `liberar`.
+    """
+    
+    def __init__(self, estado, instante: float):
+        self._estado = estado
+        self._instante = instante
+        self._pendente = True
+        self._lock = threading.Lock()
+    
+    def _encerrar(self) -> bool:
+        with self._lock:
+            pendente, self._pendente = self._pendente, False
+            return pendente
+    
+    def confirmar(self):
+        """A requisição foi feita: a vaga fica ocupada até sair da janela"""
+        self._encerrar()
+    
+    def liberar(self):
+        """Devolve a vaga (sem efeito se já foi confirmada ou liberada)"""
+        if self._encerrar():
+            self._estado.liberar_evento('requisicoes', self._instante)
 
 
 class APIMonitorService:
     """Serviço para monitorar e controlar uso da API do Gemini"""
     
-    def __init__(self):
-        self.uso_atual = {
-            'requisicoes_total': 0,
-            'requisicoes_mes': 0,
-            'tokens_usados': 0,
-            'ultima_requisicao': None,
-            'requisicoes_por_minuto': [],
-            'sistema_ativo': True,
-            'throttling_ativo': False
-        }
+    CONTADORES = ('requisicoes_total', 'requisicoes_mes', 'requisicoes_canceladas', 'tokens_usados')
+    FLAGS = ('sistema_ativo', 'throttling_ativo', 'desativado_por_limite')
+    VALORES_INICIAIS = {
+        **{chave: 0 for chave in CONTADORES},
+        'sistema_ativo': 1,
+        'throttling_ativo': 0,
+        'desativado_por_limite': 0,
+        'ritmo_tat_ms': 0  # Próximo horário "teórico" de requisição no ritmo reduzido
+    }
+    PREVISAO_VALIDADE_SEGUNDOS = 10
+    
+    CHAVE_CONFIG = 'api_monitor_state'
+    
+    def __init__(self, estado=None, serie: Optional[SerieUso] = None,
+                 config_dao: Optional[SistemaConfigDAO] = None):
+        # Contadores, flags e janela por minuto compartilhados entre os workers
+        self.estado = estado or criar_estado_compartilhado(
+            settings.API_MONITOR_BACKEND,
+            settings.API_MONITOR_SQLITE_PATH
+        )
+        self.ultima_requisicao: Optional[str] = None
         
-        # Limites configuráveis
-        self.limite_requisicoes_minuto = settings.API_MAX_REQUESTS_PER_MINUTE
-        self.threshold_throttling = settings.API_RATE_LIMIT  # 80%
-        self.delay_throttling = settings.API_DELAY_SECONDS
+        # Série temporal de uso (minuto/hora/dia) para as estatísticas e a previsão
+        self.serie = serie or SerieUso(settings.API_SERIE_USO_PATH)
         
-        # Carrega estado persistente
+        # Onde o estado é persistido (tabela sistema_config)
+        self.config_dao = config_dao or SistemaConfigDAO()
+        
+        # Limites configuráveis (o limite por minuto escala com o pool de chaves)
+        self.limite_requisicoes_minuto = pool_chaves_gemini.limite_total_minuto()
+        self.limite_mensal = settings.API_LIMITE_MENSAL
+        
+        # Ritmo do orçamento mensal
+        self.orcamento_ate = settings.API_ORCAMENTO_ATE
+        self.janela_previsao = settings.API_PREVISAO_JANELA_HORAS * 3600
+        self.rajada_ritmo = settings.API_RITMO_RAJADA
+        self._previsao: Optional[Dict] = None
+        self._previsao_expira = 0.0
+        
+        # Persistência write-behind: alterações acumuladas e gravadas em lote
+        self.flush_intervalo = settings.API_MONITOR_FLUSH_SECONDS
+        self.flush_max_pendentes = settings.API_MONITOR_FLUSH_MAX_PENDENTES
+        self._alteracoes_pendentes = 0
+        self._lock_pendentes = threading.Lock()
+        self._lock_escrita = threading.Lock()
+        self._acordar_persistencia = threading.Event()
+        self._persistencia: Optional[threading.Thread] = None
+        self._encerrado = False
+        
+        # Carrega estado persistente (o que não estiver salvo começa zerado)
         self._carregar_estado()
+        self.estado.inicializar({**self.VALORES_INICIAIS, 'mes_referencia': _mes_referencia(datetime.now())})
+        
+        self._registrar_medidores()
     
-    def registrar_requisicao(self, tokens: int = 0):
-        """Registra uma nova requisição à API"""
+    def _registrar_medidores(self):
+        """Ocupação da janela de rate limit e do pool de chaves, lidas na coleta do /metrics"""
+        metricas.medidor(
+            "apbia_rate_limit_janela_requisicoes",
+            "Requisições no último minuto e limite em vigor",
+            funcao=lambda: {
+                rotulos(valor="ocupado"): self.estado.contar_eventos('requisicoes'),
+                rotulos(valor="limite"): self.limite_efetivo_minuto()
+            }
+        )
+        metricas.medidor(
+            "apbia_chave_requisicoes_ultimo_minuto",
+            "Requisições no último minuto por chave do pool",
+            funcao=lambda: {
+                rotulos(chave=chave['id']): chave['requisicoes_ultimo_minuto']
+                for chave in pool_chaves_gemini.obter_relatorio()
+            }
+        )
+        metricas.medidor(
+            "apbia_chave_em_cooldown",
+            "Chaves do pool fora de uso por erro de cota (1 = em cooldown)",
+            funcao=lambda: {
+                rotulos(chave=chave['id']): int(chave['em_cooldown'])
+                for chave in pool_chaves_gemini.obter_relatorio()
+            }
+        )
+    
+    def registrar_requisicao(self, tokens: int = 0, requisicoes: int = 1, latencia: Optional[float] = None,
+                             reserva: Optional[ReservaRequisicao] = None):
+        """
+        Registra uma nova requisição à API
+        
+        Args:
+            tokens: Tokens estimados da resposta
+            requisicoes: Requisições feitas ao Gemini (0 se a resposta veio de um micro-lote de outra)
+            latencia: Tempo de geração da resposta (segundos)
+            reserva: Vaga reservada na admissão (já conta uma requisição na janela)
+        """
         agora = datetime.now()
+        self._verificar_virada_mes(agora)
+        
+        # Incrementa contadores (cada incremento é atômico; não há lock global)
+        self.estado.incrementar('requisicoes_total', requisicoes)
+        requisicoes_mes = self.estado.incrementar('requisicoes_mes', requisicoes)
+        self.estado.incrementar('tokens_usados', tokens)
+        self.ultima_requisicao = agora.isoformat()
         
-        # Incrementa contadores
-        self.uso_atual['requisicoes_total'] += 1
-        self.uso_atual['requisicoes_mes'] += 1
-        self.uso_atual['tokens_usados'] += tokens
-        self.uso_atual['ultima_requisicao'] = agora.isoformat()
+        # Janela por minuto: a vaga da admissão cobre uma requisição; sem chamada ao Gemini ela é devolvida
+        excedentes = requisicoes
+        if reserva is not None:
+            if requisicoes:
+                reserva.confirmar()
+                excedentes -= 1
+            else:
+                reserva.liberar()
+        if excedentes > 0:
+            self.estado.registrar_evento('requisicoes', excedentes)
         
-        # Adiciona ao tracking de requisições por minuto
-        self.uso_atual['requisicoes_por_minuto'].append(agora)
+        self.serie.registrar(requisicoes=requisicoes, tokens=tokens, latencia=latencia)
+        _requisicoes_gemini.inc(requisicoes)
+        _tokens_gemini.inc(tokens)
         
-        # Remove requisições antigas (mais de 1 minuto)
-        um_minuto_atras = agora - timedelta(minutes=1)
-        self.uso_atual['requisicoes_por_minuto'] = [
-            req for req in self.uso_atual['requisicoes_por_minuto']
-            if isinstance(req, datetime) and req > um_minuto_atras
-        ]
+        # Ritmo e desligamento pelo limite mensal (só no caminho de escrita)
+        if requisicoes:
+            self._avancar_ritmo(requisicoes)
+        self._aplicar_limite_mensal(requisicoes_mes)
         
         # Salva estado
         self._salvar_estado()
         
-        logger.info(f"📊 Requisição registrada | Tokens: {tokens} | Total mês: {self.uso_atual['requisicoes_mes']}")
+        logger.info(f"📊 Requisição registrada | Tokens: {tokens} | Total mês: {requisicoes_mes}")
+    
+    def registrar_erro(self):
+        """Registra uma geração que falhou (para a taxa de erros)"""
+        self.serie.registrar(erros=1)
+        _erros_gemini.inc()
+    
+    def registrar_cancelamento(self, motivo: Optional[str] = None):
+        """Registra uma geração cancelada (não conta na cota mensal)"""
+        total = self.estado.incrementar('requisicoes_canceladas')
+        _cancelamentos_gemini.inc()
+        self._salvar_estado()
+        
+        logger.info(f"🛑 Geração cancelada registrada | Motivo: {motivo} | Total: {total}")
     
-    def verificar_rate_limit(self) -> tuple[bool, Optional[str]]:
+    def reservar_requisicao(self) -> Tuple[Optional[ReservaRequisicao], Optional[str], Optional[int]]:
         """
-        Verifica se pode fazer requisição
+        Admite uma requisição, reservando sua vaga na janela por minuto (sem esperar)
+        
+        A vaga é ocupada já na admissão, e não quando o Gemini responde: assim
+        as requisições de uma rajada não passam todas pela mesma contagem.
+        Além do limite por minuto, aplica o ritmo do orçamento mensal quando
+        a previsão indica que o saldo não dura até o fim do período. Quem
+        recebe a reserva deve confirmá-la (`registrar_requisicao`) ou liberá-la.
         
         Returns:
-            Tuple[pode_fazer_requisicao, mensagem_erro]
+            Tuple[reserva, mensagem_erro, retry_after_segundos]
+            (reserva é None quando a requisição não pode passar; retry_after
+            é None quando o sistema está desativado)
         """
-        # Verifica se sistema está ativo
-        if not self.uso_atual['sistema_ativo']:
-            return False, "Sistema está em manutenção. IA temporariamente desativada."
+        self._verificar_virada_mes()
         
-        # Verifica limite por minuto
-        agora = datetime.now()
-        um_minuto_atras = agora - timedelta(minutes=1)
+        # Verifica se sistema está ativo
+        if not self.estado.obter('sistema_ativo', 1):
+            return None, "Sistema está em manutenção. IA temporariamente desativada.", None
         
-        requisicoes_ultimo_minuto = len([
-            req for req in self.uso_atual['requisicoes_por_minuto']
-            if isinstance(req, datetime) and req > um_minuto_atras
-        ])
+        limite = self.limite_efetivo_minuto()
         
-        if requisicoes_ultimo_minuto >= self.limite_requisicoes_minuto:
-            return False, f"Limite de {self.limite_requisicoes_minuto} requisições por minuto atingido. Aguarde alguns segundos."
+        # Reserva a vaga no limite por minuto (contagem e registro atômicos)
+        instante = self.estado.reservar_evento('requisicoes', limite)
+        if instante is None:
+            retry_after = max(1, math.ceil(self.estado.segundos_ate_vaga('requisicoes', limite)))
+            return None, f"Limite de {limite} requisições por minuto atingido. Tente novamente em {retry_after}s.", retry_after
+        reserva = ReservaRequisicao(self.estado, instante)
         
-        # Aplica throttling se necessário
-        if self.uso_atual['throttling_ativo']:
-            logger.info(f"⏳ Throttling ativo - aguardando {self.delay_throttling}s")
-            time.sleep(self.delay_throttling)
+        # Verifica o ritmo do orçamento mensal
+        espera = self._segundos_ate_ritmo()
+        if espera > 0:
+            reserva.liberar()
+            retry_after = max(1, math.ceil(espera))
+            return None, f"Uso da IA em ritmo reduzido para o limite mensal durar até o fim do período. Tente novamente em {retry_after}s.", retry_after
         
-        return True, None
+        return reserva, None, None
+    
+    def limite_efetivo_minuto(self) -> int:
+        """Limite por minuto da janela (capacidade do pool de chaves)"""
+        return self.limite_requisicoes_minuto
     
-    def calcular_uso_percentual(self, limite_mensal: int = 1500) -> float:
+    def calcular_uso_percentual(self, limite_mensal: Optional[int] = None, requisicoes_mes: Optional[int] = None) -> float:
         """
-        Calcula percentual de uso em relação ao limite mensal
+        Calcula percentual de uso em relação ao limite mensal (somente leitura)
         
         Args:
-            limite_mensal: Limite de requisições por mês (default: 1500)
+            limite_mensal: Limite de requisições por mês (default: API_LIMITE_MENSAL)
+            requisicoes_mes: Valor já lido do contador (evita uma nova leitura)
         
         Returns:
             Percentual de uso (0-100)
         """
+        if limite_mensal is None:
+            limite_mensal = self.limite_mensal
         if limite_mensal == 0:
             return 0.0
         
-        percentual = (self.uso_atual['requisicoes_mes'] / limite_mensal) * 100
+        if requisicoes_mes is None:
+            requisicoes_mes = self.estado.obter('requisicoes_mes')
+        return (requisicoes_mes / limite_mensal) * 100
+    
+    def obter_previsao(self, agora: Optional[datetime] = None) -> Dict:
+        """
+        Previsão de consumo do orçamento mensal (somente leitura)
+        
+        Projeta o uso até o fim do mês pela taxa das últimas
+        API_PREVISAO_JANELA_HORAS, lida da série temporal. Se no ritmo atual
+        o saldo acabar antes do fim do período (fim do mês, ou o dia
+        API_ORCAMENTO_ATE, ex.: último dia da feira), propõe um intervalo
+        entre requisições que distribui o saldo até lá.
+        
+        Returns:
+            Uso, saldo, consumo previsto, data prevista de esgotamento e
+            intervalo_segundos (None quando o ritmo não precisa ser reduzido)
+        """
+        agora = agora or datetime.now()
+        fim_mes = _inicio_mes_seguinte(agora)
+        fim_periodo = self._fim_periodo_orcamento(agora, fim_mes)
+        
+        usado = self.estado.obter('requisicoes_mes')
+        restante = max(0, self.limite_mensal - usado)
         
-        # Ativa/desativa throttling baseado no percentual
-        if percentual >= self.threshold_throttling:
-            if not self.uso_atual['throttling_ativo']:
-                self.uso_atual['throttling_ativo'] = True
-                logger.warning(f"⚠️  Throttling ATIVADO - Uso em {percentual:.1f}%")
-                self._salvar_estado()
+        # Taxa recente (requisições por segundo), sem olhar para antes do início do mês
+        janela = max(60.0, min(self.janela_previsao, (agora - _inicio_mes(agora)).total_seconds()))
+        recentes = self.serie.estatisticas(janela, agora=agora.timestamp())['total_requisicoes']
+        taxa = recentes / janela
         
-        # Desativa sistema se atingir 100%
-        if percentual >= 100:
-            self.desativar_sistema("Limite mensal de API atingido")
+        previsto_mes = usado + taxa * (fim_mes - agora).total_seconds()
+        esgotamento = None
+        if taxa > 0 and previsto_mes > self.limite_mensal:
+            esgotamento = agora + timedelta(seconds=restante / taxa)
         
-        return percentual
+        # Ritmo: só quando a taxa atual esgotaria o saldo antes do fim do período
+        segundos_periodo = (fim_periodo - agora).total_seconds()
+        intervalo = None
+        if taxa * segundos_periodo > restante:
+            intervalo = segundos_periodo / max(restante, 1)
+        
+        return {
+            'limite_mensal': self.limite_mensal,
+            'usado': usado,
+            'restante': restante,
+            'uso_percentual': round(self.calcular_uso_percentual(requisicoes_mes=usado), 1),
+            'taxa_recente_hora': round(taxa * 3600, 2),
+            'consumo_previsto_mes': int(round(previsto_mes)),
+            'esgotamento_previsto': esgotamento.isoformat() if esgotamento else None,
+            'periodo_ate': fim_periodo.isoformat(),
+            'ritmo_reduzido': intervalo is not None,
+            'intervalo_segundos': round(intervalo, 1) if intervalo is not None else None,
+            'rajada': self.rajada_ritmo
+        }
+    
+    def _fim_periodo_orcamento(self, agora: datetime, fim_mes: datetime) -> datetime:
+        """Fim do período em que o saldo deve durar: API_ORCAMENTO_ATE (se neste mês) ou o fim do mês"""
+        if self.orcamento_ate:
+            try:
+                fim = datetime.fromisoformat(self.orcamento_ate)
+                if len(self.orcamento_ate) == 10:
+                    fim += timedelta(days=1)  # Só a data: vale até o fim do dia
+                if agora < fim < fim_mes:
+                    return fim
+            except ValueError:
+                logger.warning(f"⚠️  API_ORCAMENTO_ATE inválido: {self.orcamento_ate}")
+        return fim_mes
+    
+    def _previsao_atual(self) -> Dict:
+        """Previsão recalculada no máximo a cada PREVISAO_VALIDADE_SEGUNDOS"""
+        agora = time.monotonic()
+        if self._previsao is None or agora >= self._previsao_expira:
+            self._previsao = self.obter_previsao()
+            self._previsao_expira = agora + self.PREVISAO_VALIDADE_SEGUNDOS
+            self._sincronizar_throttling(self._previsao)
+        return self._previsao
+    
+    def _sincronizar_throttling(self, previsao: Dict):
+        """Mantém a flag throttling_ativo igual ao estado do ritmo (uma transição por vez)"""
+        if previsao['ritmo_reduzido'] and self.estado.trocar('throttling_ativo', 0, 1):
+            logger.warning(
+                f"⚠️  Ritmo REDUZIDO - previsão de {previsao['consumo_previsto_mes']} requisições no mês "
+                f"(limite {self.limite_mensal}); 1 requisição a cada {previsao['intervalo_segundos']}s"
+            )
+            self._salvar_estado(imediato=True)
+        elif not previsao['ritmo_reduzido'] and self.estado.trocar('throttling_ativo', 1, 0):
+            logger.info("✅ Ritmo normal - previsão dentro do limite mensal")
+            self._salvar_estado(imediato=True)
+    
+    def _segundos_ate_ritmo(self) -> float:
+        """
+        Espera até a próxima requisição caber no ritmo (0 se já cabe)
+        
+        Algoritmo GCRA: cada requisição empurra o horário teórico (TAT) em um
+        intervalo; passa quem chega até `rajada` intervalos antes dele.
+        """
+        previsao = self._previsao_atual()
+        if not previsao['ritmo_reduzido']:
+            return 0.0
+        
+        tolerancia_ms = self.rajada_ritmo * previsao['intervalo_segundos'] * 1000
+        tat_ms = self.estado.obter('ritmo_tat_ms')
+        return max(0.0, (tat_ms - tolerancia_ms - time.time() * 1000) / 1000)
+    
+    def _avancar_ritmo(self, requisicoes: int):
+        """Empurra o TAT pelas requisições feitas (troca condicional, sem lock global)"""
+        previsao = self._previsao_atual()
+        if not previsao['ritmo_reduzido']:
+            return
+        
+        incremento_ms = int(previsao['intervalo_segundos'] * 1000 * requisicoes)
+        while True:
+            tat_ms = self.estado.obter('ritmo_tat_ms')
+            novo_ms = max(tat_ms, int(time.time() * 1000)) + incremento_ms
+            if self.estado.trocar('ritmo_tat_ms', tat_ms, novo_ms):
+                return
+    
+    def _aplicar_limite_mensal(self, requisicoes_mes: int):
+        """
+        Desliga o sistema ao atingir o limite mensal
+        
+        Recebe o valor retornado pelo incremento atômico. A transição usa
+        troca condicional, então só uma thread (ou worker) a executa, loga e
+        grava. O sistema volta sozinho na virada do mês.
+        """
+        if requisicoes_mes >= self.limite_mensal and self.estado.trocar('sistema_ativo', 1, 0):
+            self.estado.definir('desativado_por_limite', 1)
+            logger.warning("❌ Sistema DESATIVADO: Limite mensal de API atingido")
+            self._salvar_estado(imediato=True)
+    
+    def _verificar_virada_mes(self, agora: Optional[datetime] = None):
+        """Zera o contador na virada do mês do calendário (uma vez, entre todos os workers)"""
+        atual = _mes_referencia(agora or datetime.now())
+        referencia = self.estado.obter('mes_referencia')
+        if referencia >= atual or not self.estado.trocar('mes_referencia', referencia, atual):
+            return
+        
+        self.resetar_contador_mensal()
+        if self.estado.trocar('desativado_por_limite', 1, 0):
+            self.estado.definir('sistema_ativo', 1)
+            self._salvar_estado(imediato=True)
+            logger.info("✅ Sistema REATIVADO - novo mês, limite mensal renovado")
     
     def ativar_sistema(self):
         """Ativa o sistema manualmente"""
-        self.uso_atual['sistema_ativo'] = True
-        self._salvar_estado()
+        self.estado.definir('sistema_ativo', 1)
+        self.estado.definir('desativado_por_limite', 0)
+        self._salvar_estado(imediato=True)
         logger.info("✅ Sistema ATIVADO manualmente")
     
     def desativar_sistema(self, motivo: str = "Desativado pelo administrador"):
         """Desativa o sistema manualmente"""
-        self.uso_atual['sistema_ativo'] = False
-        self._salvar_estado()
+        self.estado.definir('sistema_ativo', 0)
+        self._salvar_estado(imediato=True)
         logger.warning(f"❌ Sistema DESATIVADO: {motivo}")
     
     def resetar_contador_mensal(self):
         """Reseta contador mensal (executar no início de cada mês)"""
-        self.uso_atual['requisicoes_mes'] = 0
-        self.uso_atual['throttling_ativo'] = False
-        self._salvar_estado()
+        self.estado.definir('requisicoes_mes', 0)
+        self.estado.definir('throttling_ativo', 0)
+        self.estado.definir('ritmo_tat_ms', 0)
+        self._previsao = None
+        self._salvar_estado(imediato=True)
         logger.info("🔄 Contador mensal resetado")
     
+    @property
+    def uso_atual(self) -> Dict:
+        """Retrato consistente do estado compartilhado (uma leitura, sem efeitos colaterais)"""
+        valores = {**self.VALORES_INICIAIS, **self.estado.obter_varios(self.VALORES_INICIAIS)}
+        uso = {chave: valores[chave] for chave in self.CONTADORES}
+        uso['sistema_ativo'] = bool(valores['sistema_ativo'])
+        uso['throttling_ativo'] = bool(valores['throttling_ativo'])
+        uso['ultima_requisicao'] = self.ultima_requisicao
+        return uso
+    
     def obter_relatorio(self) -> Dict:
-        """Retorna relatório detalhado de uso"""
+        """Retorna relatório detalhado de uso (somente leitura)"""
         agora = datetime.now()
-        um_minuto_atras = agora - timedelta(minutes=1)
-        
-        requisicoes_ultimo_minuto = len([
-            req for req in self.uso_atual['requisicoes_por_minuto']
-            if isinstance(req, datetime) and req > um_minuto_atras
-        ])
+        uso = self.uso_atual
+        requisicoes_ultimo_minuto = self.estado.contar_eventos('requisicoes')
         
         return {
-            'sistema_ativo': self.uso_atual['sistema_ativo'],
-            'throttling_ativo': self.uso_atual['throttling_ativo'],
-            'requisicoes_total': self.uso_atual['requisicoes_total'],
-            'requisicoes_mes': self.uso_atual['requisicoes_mes'],
+            'sistema_ativo': uso['sistema_ativo'],
+            'throttling_ativo': uso['throttling_ativo'],
+            'requisicoes_total': uso['requisicoes_total'],
+            'requisicoes_mes': uso['requisicoes_mes'],
+            'requisicoes_canceladas': uso['requisicoes_canceladas'],
             'requisicoes_ultimo_minuto': requisicoes_ultimo_minuto,
-            'tokens_usados': self.uso_atual['tokens_usados'],
-            'ultima_requisicao': self.uso_atual['ultima_requisicao'],
+            'tokens_usados': uso['tokens_usados'],
+            'ultima_requisicao': uso['ultima_requisicao'],
             'limite_minuto': self.limite_requisicoes_minuto,
-            'uso_percentual': self.calcular_uso_percentual(),
+            'limite_efetivo_minuto': self.limite_efetivo_minuto(),
+            'limite_mensal': self.limite_mensal,
+            'uso_percentual': self.calcular_uso_percentual(requisicoes_mes=uso['requisicoes_mes']),
+            'previsao': self.obter_previsao(agora),
             'timestamp': agora.isoformat()
         }
     
     def obter_estatisticas_periodo(self, dias: int = 7) -> Dict:
-        """Retorna estatísticas de um período"""
-        # Por enquanto retorna stats básicas
-        # Pode ser expandido para buscar do banco de dados
+        """Retorna estatísticas dos últimos `dias` dias, a partir da série temporal de uso"""
+        estatisticas = self.serie.estatisticas(dias * 86400)
+        
         return {
             'periodo_dias': dias,
-            'media_requisicoes_dia': self.uso_atual['requisicoes_mes'] / 30,
-            'total_periodo': self.uso_atual['requisicoes_mes'],
-            'pico_requisicoes_minuto': max(len(self.uso_atual['requisicoes_por_minuto']), 1)
+            'media_requisicoes_dia': round(estatisticas['total_requisicoes'] / dias, 2) if dias else 0.0,
+            'total_periodo': estatisticas['total_requisicoes'],
+            **estatisticas
         }
     
     def _carregar_estado(self):
         """Carrega estado persistente do banco de dados"""
         try:
             # Tenta carregar estado salvo
-            result = db.client.table('sistema_config').select('*').eq('chave', 'api_monitor_state').execute()
+            valor = self.config_dao.ler(self.CHAVE_CONFIG)
             
-            if result.data:
+            if valor:
                 import json
-                estado_salvo = json.loads(result.data[0]['valor'])
+                estado_salvo = json.loads(valor)
                 
-                # Atualiza apenas campos persistentes
-                self.uso_atual['requisicoes_total'] = estado_salvo.get('requisicoes_total', 0)
-                self.uso_atual['requisicoes_mes'] = estado_salvo.get('requisicoes_mes', 0)
-                self.uso_atual['tokens_usados'] = estado_salvo.get('tokens_usados', 0)
-                self.uso_atual['sistema_ativo'] = estado_salvo.get('sistema_ativo', True)
-                self.uso_atual['throttling_ativo'] = estado_salvo.get('throttling_ativo', False)
+                # Atualiza apenas campos persistentes; se outro worker já
+                # iniciou o estado compartilhado, o valor dele prevalece
+                valores = {chave: int(estado_salvo.get(chave, 0)) for chave in self.CONTADORES}
+                valores['sistema_ativo'] = int(estado_salvo.get('sistema_ativo', True))
+                valores['throttling_ativo'] = int(estado_salvo.get('throttling_ativo', False))
+                valores['desativado_por_limite'] = int(estado_salvo.get('desativado_por_limite', False))
+                # Estados antigos não guardavam o mês: usa o da última gravação
+                mes = estado_salvo.get('mes_referencia')
+                if not mes and estado_salvo.get('ultima_atualizacao'):
+                    mes = _mes_referencia(datetime.fromisoformat(estado_salvo['ultima_atualizacao']))
+                if mes:
+                    valores['mes_referencia'] = int(mes)
+                self.estado.inicializar(valores)
                 
                 logger.info("📥 Estado do monitor carregado")
         except Exception as e:
             logger.warning(f"⚠️  Não foi possível carregar estado: {e}")
     
-    def _salvar_estado(self):
+    def _salvar_estado(self, imediato: bool = False):
+        """
+        Marca o estado como alterado (write-behind)
+        
+        Contadores são gravados em lote a cada API_MONITOR_FLUSH_SECONDS ou
+        a cada API_MONITOR_FLUSH_MAX_PENDENTES alterações, fora da requisição.
+        Mudanças de estado do sistema (imediato=True) são gravadas na hora.
+        Em caso de queda do processo, perde-se no máximo um lote.
+        """
+        self.iniciar_persistencia()
+        
+        with self._lock_pendentes:
+            self._alteracoes_pendentes += 1
+            lote_cheio = self._alteracoes_pendentes >= self.flush_max_pendentes
+        
+        if imediato:
+            self.salvar_pendentes()
+        elif lote_cheio:
+            self._acordar_persistencia.set()
+    
+    def salvar_pendentes(self):
+        """Grava agora as alterações pendentes (também chamado no encerramento)"""
+        with self._lock_pendentes:
+            pendentes = self._alteracoes_pendentes
+            self._alteracoes_pendentes = 0
+        
+        if not pendentes:
+            return
+        
+        if not self._persistir_estado():
+            # Mantém as alterações para a próxima tentativa
+            with self._lock_pendentes:
+                self._alteracoes_pendentes += pendentes
+    
+    def iniciar_persistencia(self):
+        """
+        Inicia a gravação em segundo plano e a do encerramento do processo
+        
+        Chamado na primeira alteração (uma vez): só importar o módulo não
+        cria a thread nem o hook de saída.
+        """
+        with self._lock_pendentes:
+            if self._persistencia is not None:
+                return
+            self._persistencia = threading.Thread(target=self._loop_persistencia, name="api-monitor-flush", daemon=True)
+        
+        self._persistencia.start()
+        atexit.register(self.encerrar)
+    
+    def encerrar(self):
+        """Grava o que estiver pendente e para a gravação em segundo plano"""
+        self._encerrado = True
+        self._acordar_persistencia.set()
+        self.salvar_pendentes()
+        self._salvar_serie()
+    
+    def _loop_persistencia(self):
+        """Grava as alterações pendentes periodicamente ou quando o lote enche"""
+        while True:
+            self._acordar_persistencia.wait(self.flush_intervalo)
+            self._acordar_persistencia.clear()
+            if self._encerrado:
+                return
+            self._verificar_virada_mes()
+            self.salvar_pendentes()
+            self._salvar_serie()
+    
+    def _salvar_serie(self):
+        """Grava em lote a série temporal de uso"""
+        try:
+            self.serie.salvar()
+        except Exception as e:
+            logger.warning(f"⚠️  Não foi possível salvar a série de uso: {e}")
+    
+    def _persistir_estado(self) -> bool:
         """Salva estado persistente no banco de dados"""
         try:
             import json
             
-            estado = {
-                'requisicoes_total': self.uso_atual['requisicoes_total'],
-                'requisicoes_mes': self.uso_atual['requisicoes_mes'],
-                'tokens_usados': self.uso_atual['tokens_usados'],
-                'sistema_ativo': self.uso_atual['sistema_ativo'],
-                'throttling_ativo': self.uso_atual['throttling_ativo'],
-                'ultima_atualizacao': datetime.now().isoformat()
-            }
-            
-            estado_json = json.dumps(estado)
+            # Uma gravação por vez, para um retrato antigo não sobrescrever um novo
+            with self._lock_escrita:
+                uso = self.uso_atual
+                estado = {
+                    'requisicoes_total': uso['requisicoes_total'],
+                    'requisicoes_mes': uso['requisicoes_mes'],
+                    'requisicoes_canceladas': uso['requisicoes_canceladas'],
+                    'tokens_usados': uso['tokens_usados'],
+                    'sistema_ativo': uso['sistema_ativo'],
+                    'throttling_ativo': uso['throttling_ativo'],
+                    'desativado_por_limite': bool(self.estado.obter('desativado_por_limite')),
+                    'mes_referencia': self.estado.obter('mes_referencia'),
+                    'ultima_atualizacao': datetime.now().isoformat()
+                }
+                
+                self.config_dao.gravar(self.CHAVE_CONFIG, json.dumps(estado))
             
-            # Upsert no banco
-            db.client.table('sistema_config').upsert({
-                'chave': 'api_monitor_state',
-                'valor': estado_json
-            }).execute()
+            return True
             
         except Exception as e:
             logger.warning(f"⚠️  Não foi possível salvar estado: {e}")
+            return False
 
 
 # Instância global
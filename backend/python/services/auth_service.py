@@ -2,7 +2,7 @@
 Serviço de Autenticação
 """
 from typing import Optional, Tuple, Dict
-from dao.usuario_dao import UsuarioDAO, TipoUsuarioDAO
+from dao.usuario_dao import UsuarioDAO, tipos_usuario
 from models.usuario import Usuario
 from utils.helpers import helpers
 from utils.validators import validators
@@ -14,7 +14,7 @@ class AuthService:
     
     def __init__(self):
         self.usuario_dao = UsuarioDAO()
-        self.tipo_usuario_dao = TipoUsuarioDAO()
+        self.tipo_usuario_dao = tipos_usuario
     
     def login(self, email: str, senha: str, bp: Optional[str] = None) -> Tuple[bool, Optional[Dict], Optional[str]]:
         """
@@ -81,9 +81,9 @@ class AuthService:
             if not payload:
                 return False, None, "Token inválido ou expirado"
             
-            # Verifica se usuário ainda existe
-            usuario = self.usuario_dao.buscar_por_id(payload['user_id'])
-            if not usuario:
+            # Verifica se usuário ainda existe; a leitura fica no mapa de
+            # identidade e as rotas que buscam o usuário logado não vão ao banco
+            if not self.usuario_dao.buscar_por_id(payload['user_id'], "publico"):
                 return False, None, "Usuário não encontrado"
             
             return True, payload, None
@@ -200,7 +200,7 @@ class AuthService:
     def verificar_permissao(self, usuario_id: int, tipo_requerido: str) -> bool:
         """Verifica se usuário tem permissão necessária"""
         try:
-            usuario = self.usuario_dao.buscar_por_id(usuario_id)
+            usuario = self.usuario_dao.buscar_por_id(usuario_id, "publico")
             if not usuario:
                 return False
             
@@ -0,0 +1,127 @@
+"""
+Serviço de cancelamento de gerações da IA em andamento
+"""
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
+from utils.logger import logger
+
+
+class Cancelamento:
+    """Sinal de cancelamento compartilhado entre a requisição e a geração da IA"""
+
+    def __init__(self, usuario_id: int, chat_id: int, pai: Optional['Cancelamento'] = None):
+        self.usuario_id = usuario_id
+        self.chat_id = chat_id
+        self.motivo: Optional[str] = None
+        self.pai = pai
+        self._evento = threading.Event()
+        self._ao_cancelar: List[Callable[[], None]] = []
+        self._filhos: List['Cancelamento'] = []
+        self._lock = threading.Lock()
+
+    @property
+    def cancelado(self) -> bool:
+        """Indica se a geração (ou a geração da qual ela faz parte) foi cancelada"""
+        if self.pai is not None and self.pai.cancelado:
+            self.motivo = self.motivo or self.pai.motivo
+            return True
+        return self._evento.is_set()
+
+    def derivar(self) -> 'Cancelamento':
+        """Cria um cancelamento filho, cancelado junto com este"""
+        filho = Cancelamento(self.usuario_id, self.chat_id, pai=self)
+        with self._lock:
+            if not self._evento.is_set():
+                self._filhos.append(filho)
+                return filho
+        filho.cancelar(self.motivo)
+        return filho
+
+    def ao_cancelar(self, funcao: Callable[[], None]):
+        """
+        Registra uma ação para o momento do cancelamento (ex.: cancelar a
+        chamada gRPC em andamento); se já estiver cancelado, executa na hora
+        """
+        with self._lock:
+            if not self._evento.is_set():
+                self._ao_cancelar.append(funcao)
+                return
+        funcao()
+
+    def cancelar(self, motivo: str = "Cancelado pelo usuário"):
+        """Marca a geração como cancelada (idempotente), junto com as derivadas"""
+        with self._lock:
+            if self._evento.is_set():
+                return
+            self.motivo = motivo
+            self._evento.set()
+            acoes, self._ao_cancelar = self._ao_cancelar, []
+            filhos, self._filhos = self._filhos, []
+
+        for funcao in acoes:
+            try:
+                funcao()
+            except Exception as e:
+                logger.warning(f"⚠️  Erro ao interromper geração cancelada: {e}")
+        for filho in filhos:
+            filho.cancelar(motivo)
+
+
+class CancelamentoService:
+    """Registro das gerações em andamento, uma por usuário e chat"""
+
+    def __init__(self):
+        self._ativos: Dict[Tuple[int, int], Cancelamento] = {}
+        self._lock = threading.Lock()
+
+    def registrar(self, usuario_id: int, chat_id: int) -> Cancelamento:
+        """
+        Registra uma nova geração para o usuário no chat
+
+        Se já houver uma geração em andamento para o mesmo usuário e chat
+        (mensagem reenviada), a anterior é cancelada.
+        """
+        cancelamento = Cancelamento(usuario_id, chat_id)
+
+        with self._lock:
+            anterior = self._ativos.get((usuario_id, chat_id))
+            self._ativos[(usuario_id, chat_id)] = cancelamento
+
+        if anterior:
+            anterior.cancelar("Mensagem reenviada")
+            logger.info(f"🛑 Geração anterior cancelada (reenvio) | Usuário {usuario_id} | Chat {chat_id}")
+
+        return cancelamento
+
+    def cancelar(self, usuario_id: int, chat_id: int, motivo: str = "Cancelado pelo usuário") -> bool:
+        """
+        Cancela a geração em andamento do usuário no chat
+
+        Returns:
+            True se havia uma geração para cancelar
+        """
+        with self._lock:
+            cancelamento = self._ativos.get((usuario_id, chat_id))
+
+        if not cancelamento or cancelamento.cancelado:
+            return False
+
+        cancelamento.cancelar(motivo)
+        logger.info(f"🛑 Geração cancelada: {motivo} | Usuário {usuario_id} | Chat {chat_id}")
+        return True
+
+    def finalizar(self, cancelamento: Cancelamento):
+        """Remove a geração do registro (se ainda for a atual)"""
+        chave = (cancelamento.usuario_id, cancelamento.chat_id)
+        with self._lock:
+            if self._ativos.get(chave) is cancelamento:
+                del self._ativos[chave]
+
+    def total_ativos(self) -> int:
+        """Quantidade de gerações em andamento"""
+        with self._lock:
+            return len(self._ativos)
+
+
+# Instância global
+cancelamento_service = CancelamentoService()
@@ -0,0 +1,155 @@
+"""
+Pool de chaves da API do Gemini com controle de uso por chave
+"""
+import time
+from typing import Dict, List, Optional
+from config.settings import settings
+from utils.estado_compartilhado import EstadoCompartilhado, criar_estado_compartilhado
+from utils.logger import logger
+
+
+class ChaveGemini:
+    """Chave da API; uso no último minuto e cooldown ficam no estado compartilhado"""
+
+    def __init__(self, indice: int, chave: str):
+        self.id = f"chave_{indice}"
+        self.chave = chave
+
+        # Nomes no estado compartilhado (janela e contadores de todos os workers)
+        self.evento_requisicoes = f"{self.id}:requisicoes"
+        self.contador_total = f"{self.id}:requisicoes_total"
+        self.contador_erros_cota = f"{self.id}:erros_cota"
+        self.contador_erros_servidor = f"{self.id}:erros_servidor"
+        self.contador_cooldown = f"{self.id}:cooldown_ate_ms"
+
+    @property
+    def chave_mascarada(self) -> str:
+        """Final da chave, para exibição"""
+        return f"...{self.chave[-4:]}"
+
+
+class PoolChavesGemini:
+    """
+    Seleciona a chave menos carregada e afasta chaves com erro de cota ou 5xx
+
+    As janelas por chave e os cooldowns ficam no estado compartilhado, então
+    o limite por chave vale para o conjunto dos workers. O cooldown é guardado
+    em relógio de parede (ms), comum a todos os processos.
+    """
+
+    def __init__(self, chaves: List[str], estado: Optional[EstadoCompartilhado] = None):
+        self.chaves = [ChaveGemini(i, chave) for i, chave in enumerate(chaves, 1)]
+        self.limite_por_chave = settings.API_MAX_REQUESTS_PER_MINUTE
+        self.cooldown_segundos = settings.API_KEY_COOLDOWN_SECONDS
+        self.cooldown_erro_servidor_segundos = settings.API_KEY_COOLDOWN_ERRO_SERVIDOR_SECONDS
+        self.estado = estado or criar_estado_compartilhado(
+            settings.API_MONITOR_BACKEND,
+            settings.API_MONITOR_SQLITE_PATH
+        )
+
+        logger.info(f"🔑 Pool do Gemini com {len(self.chaves)} chave(s)")
+
+    def __len__(self) -> int:
+        return len(self.chaves)
+
+    def _cooldowns(self) -> Dict[str, int]:
+        """Fim do cooldown de cada chave (ms); as que nunca entraram ficam de fora"""
+        return self.estado.obter_varios(chave.contador_cooldown for chave in self.chaves)
+
+    def adquirir(self) -> Optional[ChaveGemini]:
+        """
+        Reserva a chave disponível com menos requisições no último minuto
+
+        Returns:
+            A chave escolhida, ou None se todas estiverem no limite ou em cooldown
+        """
+        agora_ms = int(time.time() * 1000)
+        cooldowns = self._cooldowns()
+
+        disponiveis = [
+            (self.estado.contar_eventos(chave.evento_requisicoes), chave)
+            for chave in self.chaves
+            if cooldowns.get(chave.contador_cooldown, 0) <= agora_ms
+        ]
+        disponiveis.sort(key=lambda item: item[0])
+
+        for uso, chave in disponiveis:
+            if uso >= self.limite_por_chave:
+                break
+            # Outro worker pode ter ocupado a última vaga desde a contagem: quem decide é a reserva
+            if self.estado.reservar_evento(chave.evento_requisicoes, self.limite_por_chave) is not None:
+                self.estado.incrementar(chave.contador_total)
+                return chave
+
+        return None
+
+    def segundos_ate_chave_livre(self) -> float:
+        """Tempo até alguma chave sair do cooldown e ter vaga na janela (0 se já houver)"""
+        agora_ms = int(time.time() * 1000)
+        cooldowns = self._cooldowns()
+
+        esperas = [
+            max(
+                (cooldowns.get(chave.contador_cooldown, 0) - agora_ms) / 1000,
+                self.estado.segundos_ate_vaga(chave.evento_requisicoes, self.limite_por_chave)
+            )
+            for chave in self.chaves
+        ]
+        return max(0.0, min(esperas, default=0.0))
+
+    def _afastar(self, chave: ChaveGemini, segundos: float):
+        """Tira a chave do pool por `segundos` (sem encurtar um cooldown maior já em curso)"""
+        fim_ms = int((time.time() + segundos) * 1000)
+        self.estado.inicializar({chave.contador_cooldown: 0})
+        while True:
+            atual = self.estado.obter(chave.contador_cooldown)
+            if atual >= fim_ms or self.estado.trocar(chave.contador_cooldown, atual, fim_ms):
+                return
+
+    def registrar_erro_cota(self, chave: ChaveGemini):
+        """Tira a chave do pool até o fim do cooldown de cota"""
+        self.estado.incrementar(chave.contador_erros_cota)
+        self._afastar(chave, self.cooldown_segundos)
+
+        logger.warning(f"⚠️  Cota esgotada na {chave.id} ({chave.chave_mascarada}) - fora do pool por {self.cooldown_segundos}s")
+
+    def registrar_erro_servidor(self, chave: ChaveGemini):
+        """Tira a chave do pool por um cooldown curto após um erro 5xx"""
+        self.estado.incrementar(chave.contador_erros_servidor)
+        self._afastar(chave, self.cooldown_erro_servidor_segundos)
+
+        logger.warning(f"⚠️  Erro do servidor na {chave.id} ({chave.chave_mascarada}) - fora do pool por {self.cooldown_erro_servidor_segundos}s")
+
+    def limite_total_minuto(self) -> int:
+        """Capacidade agregada do pool por minuto"""
+        return self.limite_por_chave * len(self.chaves)
+
+    def obter_relatorio(self) -> List[Dict]:
+        """Uso por chave (sem expor as chaves)"""
+        agora_ms = int(time.time() * 1000)
+        contadores = self.estado.obter_varios(
+            nome
+            for chave in self.chaves
+            for nome in (chave.contador_total, chave.contador_erros_cota, chave.contador_erros_servidor,
+                         chave.contador_cooldown)
+        )
+
+        relatorio = []
+        for chave in self.chaves:
+            cooldown_ate_ms = contadores.get(chave.contador_cooldown, 0)
+            relatorio.append({
+                'id': chave.id,
+                'chave': chave.chave_mascarada,
+                'requisicoes_ultimo_minuto': self.estado.contar_eventos(chave.evento_requisicoes),
+                'limite_minuto': self.limite_por_chave,
+                'requisicoes_total': contadores.get(chave.contador_total, 0),
+                'erros_cota': contadores.get(chave.contador_erros_cota, 0),
+                'erros_servidor': contadores.get(chave.contador_erros_servidor, 0),
+                'em_cooldown': agora_ms < cooldown_ate_ms,
+                'cooldown_restante': max(0, round((cooldown_ate_ms - agora_ms) / 1000, 1))
+            })
+        return relatorio
+
+
+# Instância global
+pool_chaves_gemini = PoolChavesGemini(settings.get_gemini_api_keys())
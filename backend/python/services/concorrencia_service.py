@@ -0,0 +1,200 @@
+"""
+Limite adaptativo de chamadas simultâneas ao Gemini (AIMD guiado por latência e erros)
+"""
+import math
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional, Tuple, Type
+from google.api_core.exceptions import ServiceUnavailable, TooManyRequests
+from config.settings import settings
+from utils.logger import logger
+from utils.metricas import metricas, rotulos
+
+
+class CapacidadeEsgotadaError(Exception):
+    """Sem capacidade para chamar o Gemini agora (vagas de concorrência ou chaves do pool)"""
+
+    def __init__(self, limite: int, retry_after: int, mensagem: Optional[str] = None):
+        self.limite = limite
+        self.retry_after = retry_after
+        super().__init__(mensagem or f"Limite de {limite} chamadas simultâneas à IA atingido")
+
+
+class Vaga:
+    """Uma chamada em andamento; `valida=False` descarta a amostra de latência"""
+
+    def __init__(self, em_voo_ao_entrar: int, modo: str):
+        self.em_voo_ao_entrar = em_voo_ao_entrar
+        self.modo = modo
+        self.inicio = time.monotonic()
+        self.valida = True
+
+
+class LimiteConcorrencia:
+    """
+    Quantas chamadas ao Gemini podem estar em andamento ao mesmo tempo
+
+    O limite sobe devagar (+1 a cada `limite` chamadas bem-sucedidas com o
+    limite em uso) enquanto a latência recente fica perto da de referência,
+    e cai rápido: x0,8 quando a latência dispara e pela metade em erro de
+    sobrecarga (429/503). Depois de uma redução, novas reduções esperam uma
+    latência recente, para uma rajada de erros do mesmo pico não derrubar o
+    limite até o mínimo.
+
+    Cada modo de chamada (normal, thinking, lote...) tem as suas médias:
+    uma chamada de thinking lenta é comparada com as de thinking, e não com
+    a referência das respostas normais.
+
+    Sem vaga livre a chamada é recusada na hora (nenhuma thread da requisição
+    fica parada esperando): o cliente recebe 429 com Retry-After.
+    """
+
+    ALFA_RECENTE = 0.3  # Média móvel rápida (últimas chamadas)
+    ALFA_REFERENCIA = 0.02  # Média móvel lenta (o "normal" do serviço)
+    FATOR_LATENCIA = 0.8
+    FATOR_SOBRECARGA = 0.5
+
+    def __init__(self, inicial: float, minimo: float, maximo: float, tolerancia_latencia: float,
+                 erros_sobrecarga: Tuple[Type[BaseException], ...] = (TooManyRequests, ServiceUnavailable)):
+        self.limite = float(inicial)
+        self.minimo = float(minimo)
+        self.maximo = float(maximo)
+        self.tolerancia_latencia = tolerancia_latencia
+        self.erros_sobrecarga = erros_sobrecarga
+
+        self.em_voo = 0
+        # modo -> {"recente": média rápida, "referencia": média lenta}
+        self.latencias: Dict[str, Dict[str, float]] = {}
+        self._reducao_ate = 0.0
+
+        self.aumentos = 0
+        self.reducoes_latencia = 0
+        self.reducoes_sobrecarga = 0
+        self.rejeicoes = 0
+
+        self._lock = threading.Lock()
+
+    def adquirir(self, modo: str = "normal") -> Vaga:
+        """
+        Ocupa uma vaga, sem esperar
+
+        Args:
+            modo: Tipo de chamada, que define a latência de referência
+
+        Raises:
+            CapacidadeEsgotadaError: se todas as vagas estão ocupadas
+                (retry_after pela latência recente do modo)
+        """
+        with self._lock:
+            if self.em_voo >= int(self.limite):
+                self.rejeicoes += 1
+                retry_after = max(1, math.ceil(self._latencia_recente(modo)))
+                raise CapacidadeEsgotadaError(int(self.limite), retry_after)
+
+            vaga = Vaga(self.em_voo, modo)
+            self.em_voo += 1
+            return vaga
+
+    def liberar(self, vaga: Vaga, sobrecarga: bool = False):
+        """Devolve a vaga e ajusta o limite pela latência ou pelo erro da chamada"""
+        latencia = time.monotonic() - vaga.inicio
+
+        with self._lock:
+            self.em_voo -= 1
+            if sobrecarga:
+                self._reduzir(self.FATOR_SOBRECARGA, "sobrecarga", vaga.modo)
+            elif vaga.valida:
+                self._registrar_latencia(latencia, vaga.em_voo_ao_entrar, vaga.modo)
+
+    @contextmanager
+    def vaga(self, modo: str = "normal"):
+        """Ocupa uma vaga durante o bloco; erros de sobrecarga reduzem o limite"""
+        vaga = self.adquirir(modo)
+        sobrecarga = False
+        try:
+            yield vaga
+        except self.erros_sobrecarga:
+            sobrecarga = True
+            raise
+        except BaseException:
+            # Outros erros (prazo, cancelamento...) não dizem nada sobre a latência
+            vaga.valida = False
+            raise
+        finally:
+            self.liberar(vaga, sobrecarga)
+
+    def _latencia_recente(self, modo: str) -> float:
+        """Latência recente do modo (1s enquanto não há amostras)"""
+        medias = self.latencias.get(modo)
+        return medias["recente"] if medias else 1.0
+
+    def _registrar_latencia(self, latencia: float, em_voo_ao_entrar: int, modo: str):
+        """Atualiza as médias do modo e aplica o AIMD (chamar com o lock)"""
+        medias = self.latencias.get(modo)
+        if medias is None:
+            self.latencias[modo] = {"recente": latencia, "referencia": latencia}
+            return
+
+        medias["recente"] += self.ALFA_RECENTE * (latencia - medias["recente"])
+        medias["referencia"] += self.ALFA_REFERENCIA * (latencia - medias["referencia"])
+
+        if medias["recente"] > medias["referencia"] * self.tolerancia_latencia:
+            self._reduzir(self.FATOR_LATENCIA, "latência", modo)
+        elif em_voo_ao_entrar + 1 >= int(self.limite) and self.limite < self.maximo:
+            # Só cresce se o limite atual está sendo usado
+            self.limite = min(self.maximo, self.limite + 1 / self.limite)
+            self.aumentos += 1
+
+    def _reduzir(self, fator: float, motivo: str, modo: str):
+        """Redução multiplicativa, no máximo uma por latência recente do modo (chamar com o lock)"""
+        agora = time.monotonic()
+        if agora < self._reducao_ate:
+            return
+
+        anterior = self.limite
+        self.limite = max(self.minimo, self.limite * fator)
+        self._reducao_ate = agora + self._latencia_recente(modo)
+        if motivo == "sobrecarga":
+            self.reducoes_sobrecarga += 1
+        else:
+            self.reducoes_latencia += 1
+
+        if int(self.limite) != int(anterior):
+            logger.warning(f"📉 Concorrência do Gemini reduzida por {motivo}: {int(anterior)} → {int(self.limite)}")
+
+    def obter_relatorio(self) -> Dict:
+        """Limite atual, chamadas em andamento e ajustes feitos"""
+        with self._lock:
+            return {
+                'limite': int(self.limite),
+                'em_voo': self.em_voo,
+                'minimo': int(self.minimo),
+                'maximo': int(self.maximo),
+                'latencias': {
+                    modo: {'recente': round(medias["recente"], 3), 'referencia': round(medias["referencia"], 3)}
+                    for modo, medias in sorted(self.latencias.items())
+                },
+                'aumentos': self.aumentos,
+                'reducoes_latencia': self.reducoes_latencia,
+                'reducoes_sobrecarga': self.reducoes_sobrecarga,
+                'rejeicoes': self.rejeicoes
+            }
+
+
+# Instância global
+limite_gemini = LimiteConcorrencia(
+    inicial=settings.GEMINI_CONCORRENCIA_INICIAL,
+    minimo=settings.GEMINI_CONCORRENCIA_MIN,
+    maximo=settings.GEMINI_CONCORRENCIA_MAX,
+    tolerancia_latencia=settings.GEMINI_CONCORRENCIA_TOLERANCIA_LATENCIA
+)
+
+metricas.medidor(
+    "apbia_gemini_concorrencia",
+    "Limite adaptativo de chamadas simultâneas ao Gemini e chamadas em andamento",
+    funcao=lambda: {
+        rotulos(valor="limite"): int(limite_gemini.limite),
+        rotulos(valor="em_voo"): limite_gemini.em_voo
+    }
+)
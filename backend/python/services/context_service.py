@@ -6,6 +6,10 @@ from typing import List, Optional, Tuple
 from config.settings import settings
 from config.database import db
 from utils.logger import logger
+from utils.metricas import metricas
+from utils.prazo import verificar_prazo, PrazoEsgotadoError
+
+_consultas_cache = metricas.contador("apbia_cache_consultas_total", "Consultas a caches em memória por resultado")
 
 
 class ContextService:
@@ -50,10 +54,14 @@ class ContextService:
             
             # Verifica se já está em cache
             if 'todos' in self.contextos_cache and self.contextos_cache['todos']:
+                _consultas_cache.inc(cache="contextos", resultado="acerto")
                 logger.info(f"📦 Usando {len(self.contextos_cache['todos'])} contexto(s) do cache")
                 return True, self.contextos_cache['todos'], None
             
+            _consultas_cache.inc(cache="contextos", resultado="falha")
+            
             # Lista todos os arquivos no bucket - IMPORTANTE: usar path='' para raiz
+            verificar_prazo("contextos.listar")
             bucket = db.client.storage.from_(self.bucket_name)
             arquivos = bucket.list(path='')
             
@@ -73,6 +81,9 @@ class ContextService:
                 if nome.lower().endswith('.txt'):
                     logger.info(f"📄 Processando: {nome}")
                     
+                    # Não inicia um download que não cabe no prazo da requisição
+                    verificar_prazo(f"contextos.download:{nome}")
+                    
                     try:
                         # Download do arquivo - usar nome do arquivo diretamente
                         file_bytes = bucket.download(nome)
@@ -96,7 +107,11 @@ class ContextService:
                         else:
                             logger.warning(f"⚠️  Arquivo vazio: {nome}")
                             
+                    except PrazoEsgotadoError:
+                        raise
                     except Exception as e:
+                        # Download interrompido pelo fim do prazo: não segue com contextos parciais
+                        verificar_prazo(f"contextos.download:{nome}")
                         logger.warning(f"⚠️  Erro ao processar {nome}: {e}")
                         import traceback
                         logger.error(traceback.format_exc())
@@ -116,6 +131,8 @@ class ContextService:
             
             return True, contextos, None
             
+        except PrazoEsgotadoError:
+            raise
         except Exception as e:
             error_msg = f"Erro ao carregar contextos: {str(e)}"
             logger.error(f"❌ {error_msg}")
@@ -167,8 +184,10 @@ class ContextService:
         try:
             # Verifica cache
             if nome_arquivo in self.contextos_cache:
+                _consultas_cache.inc(cache="contextos", resultado="acerto")
                 logger.info(f"📦 Contexto recuperado do cache: {nome_arquivo}")
                 return True, self.contextos_cache[nome_arquivo], None
+            _consultas_cache.inc(cache="contextos", resultado="falha")
             
             # Carrega do Supabase
             bucket = db.client.storage.from_(self.bucket_name)
@@ -0,0 +1,188 @@
+"""
+Serviço de cotas por usuário e por projeto (token buckets)
+"""
+import math
+import time
+from typing import Callable, Dict, Optional, Tuple
+from config.settings import settings
+from utils.estado_compartilhado import EstadoCompartilhado, criar_estado_compartilhado
+from utils.logger import logger
+
+
+class BaldeFichas:
+    """
+    Token bucket guardado num único inteiro: o instante (ms) em que o balde fica cheio
+
+    Com um só valor, consumo e devolução são uma troca atômica no estado
+    compartilhado. Um instante já passado (ou 0, balde novo) é o balde cheio.
+    """
+
+    def __init__(self, capacidade: float, recarga_minuto: float):
+        if recarga_minuto <= 0:
+            raise ValueError("A recarga da cota por minuto deve ser positiva")
+        self.capacidade = capacidade
+        self.ms_por_ficha = 60000 / recarga_minuto
+
+    def fichas(self, cheio_em_ms: int, agora_ms: int) -> float:
+        """Fichas disponíveis em `agora_ms`"""
+        faltam = max(0, cheio_em_ms - agora_ms) / self.ms_por_ficha
+        return max(0.0, self.capacidade - faltam)
+
+    def consumir(self, cheio_em_ms: int, custo: float, agora_ms: int) -> int:
+        """Novo instante de cheio após gastar `custo` fichas (o mesmo, se não houver fichas)"""
+        if self.fichas(cheio_em_ms, agora_ms) < custo:
+            return cheio_em_ms
+        return max(cheio_em_ms, agora_ms) + round(custo * self.ms_por_ficha)
+
+    def devolver(self, cheio_em_ms: int, custo: float, agora_ms: int) -> int:
+        """Novo instante de cheio após devolver `custo` fichas (sem passar da capacidade)"""
+        if cheio_em_ms <= agora_ms:
+            return cheio_em_ms
+        return max(agora_ms, cheio_em_ms - round(custo * self.ms_por_ficha))
+
+    def segundos_para(self, cheio_em_ms: int, custo: float, agora_ms: int) -> float:
+        """Tempo até haver `custo` fichas (0 se já houver)"""
+        faltam = custo - self.fichas(cheio_em_ms, agora_ms)
+        return max(0.0, faltam * self.ms_por_ficha / 1000)
+
+
+class CotaService:
+    """
+    Cotas de uso da IA em duas camadas, acima do limite global da API
+
+    Cada usuário tem um balde conforme seu tipo (participante, orientador,
+    admin) e cada projeto tem um balde compartilhado pelos membros. Uma
+    mensagem só passa se houver fichas nos dois; o modo thinking custa mais.
+
+    Os baldes ficam no estado compartilhado (em relógio de parede), então a
+    cota vale para o conjunto dos workers e a devolução pode vir de qualquer um.
+    """
+
+    def __init__(self, estado: Optional[EstadoCompartilhado] = None):
+        self.cotas_por_tipo = settings.COTAS_POR_TIPO_USUARIO
+        self.cota_projeto = settings.COTA_PROJETO
+        self.custos = settings.COTA_CUSTO_POR_MODO
+        self.estado = estado or criar_estado_compartilhado(
+            settings.API_MONITOR_BACKEND,
+            settings.API_MONITOR_SQLITE_PATH
+        )
+
+    def custo(self, usar_thinking: bool = False) -> int:
+        """Fichas consumidas por uma mensagem no modo informado"""
+        return self.custos['thinking' if usar_thinking else 'normal']
+
+    def _balde_usuario(self, tipo_usuario: Optional[str]) -> BaldeFichas:
+        config = self.cotas_por_tipo.get(tipo_usuario, self.cotas_por_tipo['participante'])
+        return BaldeFichas(config['capacidade'], config['recarga_minuto'])
+
+    def _balde_projeto(self) -> BaldeFichas:
+        return BaldeFichas(self.cota_projeto['capacidade'], self.cota_projeto['recarga_minuto'])
+
+    @staticmethod
+    def _chave_usuario(usuario_id: int) -> str:
+        return f"cota_usuario_{usuario_id}:cheio_em_ms"
+
+    @staticmethod
+    def _chave_projeto(projeto_id: int) -> str:
+        return f"cota_projeto_{projeto_id}:cheio_em_ms"
+
+    def _atualizar(self, chave: str, calcular: Callable[[int], int]) -> Tuple[int, int]:
+        """
+        Aplica `calcular` ao balde com troca atômica, repetindo se outro worker mudou antes
+
+        Returns:
+            Tuple[anterior, atual] - iguais se nada mudou
+        """
+        self.estado.inicializar({chave: 0})
+        while True:
+            anterior = self.estado.obter(chave)
+            atual = calcular(anterior)
+            if atual == anterior or self.estado.trocar(chave, anterior, atual):
+                return anterior, atual
+
+    def consumir(self, usuario_id: int, tipo_usuario: Optional[str], projeto_id: Optional[int],
+                 usar_thinking: bool = False) -> Tuple[bool, Dict]:
+        """
+        Consome as fichas de uma mensagem do usuário e do projeto
+
+        Nada é consumido se qualquer um dos dois não tiver fichas suficientes.
+
+        Returns:
+            Tuple[permitido, cota] - cota traz o saldo restante, o custo e,
+            se negado, quem bloqueou e em quantos segundos tentar de novo
+        """
+        custo = self.custo(usar_thinking)
+        agora_ms = int(time.time() * 1000)
+
+        balde_usuario = self._balde_usuario(tipo_usuario)
+        chave_usuario = self._chave_usuario(usuario_id)
+        balde_projeto = self._balde_projeto() if projeto_id else None
+        chave_projeto = self._chave_projeto(projeto_id) if projeto_id else None
+
+        bloqueado_por = None
+        anterior, cheio_usuario = self._atualizar(
+            chave_usuario, lambda atual: balde_usuario.consumir(atual, custo, agora_ms)
+        )
+        cheio_projeto = None
+        if cheio_usuario == anterior:
+            bloqueado_por = 'usuario'
+            if chave_projeto:
+                cheio_projeto = self.estado.obter(chave_projeto)
+        elif chave_projeto:
+            anterior, cheio_projeto = self._atualizar(
+                chave_projeto, lambda atual: balde_projeto.consumir(atual, custo, agora_ms)
+            )
+            if cheio_projeto == anterior:
+                # O projeto barrou: as fichas do usuário voltam
+                bloqueado_por = 'projeto'
+                _, cheio_usuario = self._atualizar(
+                    chave_usuario, lambda atual: balde_usuario.devolver(atual, custo, agora_ms)
+                )
+
+        cota = {
+            'custo': custo,
+            'restante_usuario': int(balde_usuario.fichas(cheio_usuario, agora_ms)),
+            'limite_usuario': int(balde_usuario.capacidade),
+            'restante_projeto': int(balde_projeto.fichas(cheio_projeto, agora_ms)) if balde_projeto else None,
+            'limite_projeto': int(balde_projeto.capacidade) if balde_projeto else None
+        }
+
+        if bloqueado_por:
+            self.estado.incrementar(f"cotas:bloqueios_{bloqueado_por}")
+            espera = balde_usuario.segundos_para(cheio_usuario, custo, agora_ms)
+            if balde_projeto is not None:
+                espera = max(espera, balde_projeto.segundos_para(cheio_projeto, custo, agora_ms))
+            cota['bloqueado_por'] = bloqueado_por
+            cota['retry_after'] = math.ceil(espera)
+
+            logger.warning(f"🪣 Cota do {bloqueado_por} esgotada | Usuário {usuario_id} | Projeto {projeto_id}")
+            return False, cota
+
+        return True, cota
+
+    def devolver(self, usuario_id: int, tipo_usuario: Optional[str], projeto_id: Optional[int],
+                 usar_thinking: bool = False):
+        """Devolve as fichas de uma mensagem que não chegou a usar a IA"""
+        custo = self.custo(usar_thinking)
+        agora_ms = int(time.time() * 1000)
+
+        balde = self._balde_usuario(tipo_usuario)
+        self._atualizar(self._chave_usuario(usuario_id), lambda atual: balde.devolver(atual, custo, agora_ms))
+        if projeto_id:
+            balde = self._balde_projeto()
+            self._atualizar(self._chave_projeto(projeto_id), lambda atual: balde.devolver(atual, custo, agora_ms))
+
+    def obter_relatorio(self) -> Dict:
+        """Configuração e bloqueios das cotas (somados entre os workers)"""
+        bloqueios = self.estado.obter_varios(['cotas:bloqueios_usuario', 'cotas:bloqueios_projeto'])
+        return {
+            'por_tipo_usuario': self.cotas_por_tipo,
+            'projeto': self.cota_projeto,
+            'custos': self.custos,
+            'bloqueios_usuario': bloqueios.get('cotas:bloqueios_usuario', 0),
+            'bloqueios_projeto': bloqueios.get('cotas:bloqueios_projeto', 0)
+        }
+
+
+# Instância global
+cota_service = CotaService()
@@ -2,18 +2,30 @@
 Serviço de integração com Google Gemini AI
 CORRIGIDO: Agora usa corretamente os contextos TXT
 """
-import google.generativeai as genai
-from typing import Optional, List, Dict, Tuple
+import json
+import math
+import threading
+import time
+import grpc
+from google.ai import generativelanguage as glm
+from google.api_core import exceptions as google_exceptions, gapic_v1
+from google.api_core.exceptions import TooManyRequests, DeadlineExceeded, ServerError, ServiceUnavailable
+from typing import Optional, List, Dict, Tuple, Callable, Any
 from config.settings import settings
+from services.cancelamento_service import Cancelamento
+from services.chaves_gemini_service import pool_chaves_gemini
+from services.concorrencia_service import limite_gemini, CapacidadeEsgotadaError
+from services.hedge_service import hedge_service
 from utils.logger import logger
+from utils.prazo import prazo_atual, verificar_prazo, PrazoEsgotadoError
 
 
 class GeminiService:
     """Serviço para interação com o Gemini AI"""
     
     def __init__(self):
-        # Configura API
-        genai.configure(api_key=settings.GOOGLE_API_KEY)
+        # Cada chave do pool tem o seu cliente
+        self.pool = pool_chaves_gemini
         
         # Configurações de geração
         self.generation_config = {
@@ -31,22 +43,20 @@ class GeminiService:
             {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_MEDIUM_AND_ABOVE"},
         ]
         
-        self.model = None
+        self.system_instruction = None
+        self.clientes: Dict[str, glm.GenerativeServiceClient] = {}
         self._initialize_model()
     
     def _initialize_model(self):
-        """Inicializa o modelo Gemini"""
+        """Cria um cliente da API do Gemini para cada chave do pool"""
         try:
-            system_instruction = self._get_system_instruction()
+            self.system_instruction = {"parts": [{"text": self._get_system_instruction()}]}
             
-            self.model = genai.GenerativeModel(
-                model_name=settings.GEMINI_MODEL,
-                generation_config=self.generation_config,
-                safety_settings=self.safety_settings,
-                system_instruction=system_instruction
-            )
+            for chave in self.pool.chaves:
+                # A chave vai nas credenciais do canal de cada cliente
+                self.clientes[chave.id] = glm.GenerativeServiceClient(client_options={"api_key": chave.chave})
             
-            logger.info(f"✅ Modelo Gemini inicializado: {settings.GEMINI_MODEL}")
+            logger.info(f"✅ Modelo Gemini inicializado: {settings.GEMINI_MODEL} ({len(self.clientes)} chave(s))")
         except Exception as e:
             logger.error(f"❌ Erro ao inicializar Gemini: {e}")
             raise
@@ -81,9 +91,13 @@ IMPORTANTE:
 - Para perguntas complexas, pense cuidadosamente antes de responder"""
     
     def gerar_resposta(self, mensagem: str, contexto: Optional[List[str]] = None, 
-                      historico: Optional[List[Dict]] = None) -> Tuple[bool, Optional[str], Optional[str]]:
+                      historico: Optional[List[Dict]] = None,
+                      cancelamento: Optional[Cancelamento] = None) -> Tuple[bool, Optional[str], Optional[str]]:
         """
         Gera resposta usando o Gemini com contextos TXT
+        
+        Se um cancelamento for informado, a resposta é recebida em streaming
+        e a requisição ao Gemini é interrompida assim que ele for sinalizado.
         """
         try:
             logger.info(f"🤖 Gerando resposta para: {mensagem[:50]}...")
@@ -95,21 +109,26 @@ IMPORTANTE:
             if contexto:
                 logger.info(f"📚 Usando {len(contexto)} contexto(s) da Bragantec")
             
-            # Se tem histórico, usa chat
-            if historico:
-                chat = self.model.start_chat(history=self._format_historico(historico))
-                response = chat.send_message(prompt_completo)
-            else:
-                # Senão, gera resposta direta
-                response = self.model.generate_content(prompt_completo)
+            if cancelamento and cancelamento.cancelado:
+                return False, None, f"Geração cancelada: {cancelamento.motivo}"
             
-            resposta_texto = response.text
+            # Se tem histórico, ele vai antes da pergunta
+            requisicao = self._montar_requisicao(
+                prompt_completo,
+                historico=self._format_historico(historico) if historico else None
+            )
+            
+            resposta_texto = self._gerar(requisicao, cancelamento)
+            if resposta_texto is None:
+                return False, None, f"Geração cancelada: {cancelamento.motivo}"
             
             logger.info(f"✅ Resposta gerada ({len(resposta_texto)} caracteres)")
             logger.log_api_call("Gemini", self._estimate_tokens(prompt_completo + resposta_texto))
             
             return True, resposta_texto, None
             
+        except (PrazoEsgotadoError, CapacidadeEsgotadaError):
+            raise
         except Exception as e:
             error_msg = f"Erro ao gerar resposta: {str(e)}"
             logger.error(f"❌ {error_msg}")
@@ -117,7 +136,8 @@ IMPORTANTE:
             logger.error(traceback.format_exc())
             return False, None, error_msg
     
-    def gerar_resposta_com_thinking(self, mensagem: str, contexto: Optional[List[str]] = None) -> Tuple[bool, Optional[str], Optional[str]]:
+    def gerar_resposta_com_thinking(self, mensagem: str, contexto: Optional[List[str]] = None,
+                                    cancelamento: Optional[Cancelamento] = None) -> Tuple[bool, Optional[str], Optional[str]]:
         """
         Gera resposta com modo de pensamento profundo (thinking mode)
         """
@@ -137,45 +157,288 @@ Pergunta do estudante: {mensagem}"""
                 prompt_thinking += "\n=== FIM DO CONTEXTO ===\n\n"
                 prompt_thinking += "Use as informações do contexto para fundamentar sua resposta."
             
+            if cancelamento and cancelamento.cancelado:
+                return False, None, f"Geração cancelada: {cancelamento.motivo}"
+            
             # Gera com configuração para pensamento mais profundo
-            response = self.model.generate_content(
+            requisicao = self._montar_requisicao(
                 prompt_thinking,
                 generation_config={
-                    **self.generation_config,
                     "temperature": 0.9,  # Mais criatividade
                     "top_p": 0.98
                 }
             )
             
-            resposta_texto = response.text
+            resposta_texto = self._gerar(requisicao, cancelamento, modo="thinking")
+            if resposta_texto is None:
+                return False, None, f"Geração cancelada: {cancelamento.motivo}"
             
             logger.info(f"✅ Resposta com thinking gerada ({len(resposta_texto)} chars)")
             return True, resposta_texto, None
             
+        except (PrazoEsgotadoError, CapacidadeEsgotadaError):
+            raise
         except Exception as e:
             error_msg = f"Erro no thinking mode: {str(e)}"
             logger.error(f"❌ {error_msg}")
             return False, None, error_msg
     
-    def _build_prompt_com_contexto(self, mensagem: str, contexto: Optional[List[str]] = None) -> str:
+    def gerar_respostas_em_lote(self, perguntas: List[str], contexto: Optional[List[str]] = None
+                                ) -> Tuple[bool, Optional[List[str]], Optional[str]]:
         """
-        Constrói prompt completo com contextos da Bragantec
+        Responde várias perguntas independentes numa única chamada ao Gemini
+        
+        As respostas são pedidas em JSON, uma por pergunta, na mesma ordem.
+        
+        Returns:
+            Tuple[sucesso, respostas, erro] - falha se a resposta não puder
+            ser separada por pergunta (quem chamou deve responder uma a uma)
+        
+        Raises:
+            CapacidadeEsgotadaError, TooManyRequests, ServiceUnavailable: sem
+            capacidade ou cota para o lote (e, portanto, para as perguntas avulsas)
+        """
+        try:
+            logger.info(f"📦 Gerando {len(perguntas)} resposta(s) em lote")
+            
+            prompt = self._build_bloco_contexto(contexto)
+            prompt += (
+                "Responda às perguntas abaixo. Elas foram feitas por estudantes diferentes: "
+                "responda cada uma de forma independente, completa, clara, didática e encorajadora, "
+                "sem mencionar as outras perguntas.\n\n"
+            )
+            for i, pergunta in enumerate(perguntas, 1):
+                prompt += f"--- Pergunta {i} ---\n{pergunta}\n\n"
+            prompt += (
+                'Devolva apenas um JSON no formato {"respostas": [{"id": 1, "resposta": "..."}]}, '
+                f"com exatamente {len(perguntas)} resposta(s), uma para cada id de pergunta."
+            )
+            
+            requisicao = self._montar_requisicao(
+                prompt, generation_config={"response_mime_type": "application/json"}
+            )
+            texto = self._executar(lambda cliente: self._chamar(cliente, requisicao), modo="lote")
+            
+            respostas = self._separar_respostas_lote(texto, len(perguntas))
+            if respostas is None:
+                logger.warning("⚠️  Resposta em lote não pôde ser separada por pergunta")
+                return False, None, "Resposta em lote inválida"
+            
+            logger.log_api_call("Gemini", self._estimate_tokens(prompt + texto))
+            return True, respostas, None
+            
+        except (PrazoEsgotadoError, CapacidadeEsgotadaError, TooManyRequests, ServiceUnavailable):
+            # Sem capacidade ou cota: quem chamou não deve repetir pergunta a pergunta
+            raise
+        except Exception as e:
+            error_msg = f"Erro ao gerar respostas em lote: {str(e)}"
+            logger.error(f"❌ {error_msg}")
+            return False, None, error_msg
+    
+    def _separar_respostas_lote(self, texto: str, total: int) -> Optional[List[str]]:
+        """Extrai as respostas do JSON do lote, na ordem das perguntas (None se inválido)"""
+        try:
+            itens = json.loads(texto)["respostas"]
+            por_id = {int(item["id"]): item["resposta"] for item in itens}
+        except (ValueError, KeyError, TypeError):
+            return None
+        
+        respostas = [por_id.get(i) for i in range(1, total + 1)]
+        if any(not isinstance(r, str) or not r.strip() for r in respostas):
+            return None
+        return respostas
+    
+    def _montar_requisicao(self, prompt: str, historico: Optional[List[Dict]] = None,
+                           generation_config: Optional[Dict] = None) -> glm.GenerateContentRequest:
+        """
+        Monta a requisição ao Gemini com as instruções do sistema e as
+        configurações padrão (sobrescritas por `generation_config`)
+        """
+        return glm.GenerateContentRequest(
+            model=f"models/{settings.GEMINI_MODEL}",
+            contents=(historico or []) + [{"role": "user", "parts": [{"text": prompt}]}],
+            system_instruction=self.system_instruction,
+            generation_config={**self.generation_config, **(generation_config or {})},
+            safety_settings=self.safety_settings
+        )
+    
+    def _extrair_texto(self, resposta: glm.GenerateContentResponse) -> str:
+        """Texto do primeiro candidato de uma resposta (ou de um trecho do streaming)"""
+        if resposta.prompt_feedback.block_reason:
+            raise ValueError(f"Pergunta bloqueada pelo Gemini: {resposta.prompt_feedback.block_reason.name}")
+        if not resposta.candidates:
+            return ""
+        return "".join(parte.text for parte in resposta.candidates[0].content.parts)
+    
+    def _validar_texto(self, texto: str) -> str:
+        """Falha se o Gemini não devolveu texto (ex.: resposta bloqueada por segurança)"""
+        if not texto:
+            raise ValueError("O Gemini não retornou texto na resposta")
+        return texto
+    
+    def _chamar(self, cliente: glm.GenerativeServiceClient, requisicao: glm.GenerateContentRequest) -> str:
+        """Chamada simples (sem streaming), com timeout limitado ao prazo"""
+        resposta = cliente.generate_content(requisicao, **self._request_options())
+        return self._validar_texto(self._extrair_texto(resposta))
+    
+    def _gerar(self, requisicao: glm.GenerateContentRequest,
+               cancelamento: Optional[Cancelamento], modo: str = "normal") -> Optional[str]:
         """
-        prompt = ""
+        Executa a geração escolhendo o modo de chamada
         
-        # Adiciona contextos se existirem
-        if contexto and len(contexto) > 0:
-            prompt += "=== CONTEXTO: Cadernos de Resumos da Bragantec (Edições Anteriores) ===\n\n"
-            prompt += "Você tem acesso aos seguintes projetos e informações de edições passadas da Bragantec:\n\n"
+        - Com hedging ativo: streaming, com requisição duplicada se o primeiro token demorar
+        - Com cancelamento: streaming, interrompido se a geração for cancelada
+        - Sem nenhum dos dois: chamada simples
+        
+        O `modo` (normal, thinking) escolhe a latência de referência do
+        limite de concorrência.
+        
+        Returns:
+            O texto da resposta, ou None se a geração foi cancelada
+        """
+        if hedge_service.ativo:
+            if cancelamento is None:
+                cancelamento = Cancelamento(usuario_id=0, chat_id=0)
             
-            # Adiciona cada contexto separadamente
-            for i, ctx in enumerate(contexto, 1):
-                # Limita o tamanho de cada contexto para não exceder o limite do modelo
-                ctx_limitado = ctx[:15000] if len(ctx) > 15000 else ctx
-                prompt += f"--- Documento {i} ---\n{ctx_limitado}\n\n"
+            def tentativa(cancel_tentativa: Cancelamento, primeiro_token: threading.Event):
+                def chamada(cliente):
+                    inicio = time.monotonic()
+                    
+                    def primeiro_trecho():
+                        hedge_service.registrar_latencia(time.monotonic() - inicio)
+                        primeiro_token.set()
+                    
+                    trechos = self._abrir_stream(cliente, requisicao, cancel_tentativa)
+                    return self._consumir_stream(trechos, cancel_tentativa, primeiro_trecho)
+                
+                return self._executar(chamada, modo)
+            
+            texto = hedge_service.executar(tentativa, cancelamento)
+            return None if cancelamento.cancelado else texto
+        
+        if cancelamento is not None:
+            return self._executar(lambda cliente: self._consumir_stream(
+                self._abrir_stream(cliente, requisicao, cancelamento), cancelamento
+            ), modo)
+        
+        return self._executar(lambda cliente: self._chamar(cliente, requisicao), modo)
+    
+    def _executar(self, chamada: Callable[[glm.GenerativeServiceClient], Any],
+                  modo: str = "normal") -> Any:
+        """
+        Executa a chamada com a chave menos carregada do pool
+        
+        Se a chave retornar erro de cota ou 5xx, ela sai do pool (cooldown) e
+        a chamada é repetida com a próxima chave disponível. Cada tentativa
+        ocupa uma vaga do limite adaptativo de concorrência, cuja latência de
+        referência depende do modo (normal, thinking, lote...).
+        
+        Raises:
+            CapacidadeEsgotadaError: se todas as chaves estão no limite por
+                minuto ou em cooldown (retry_after até a primeira liberar)
+            ServerError: o último erro 5xx, se nenhuma chave respondeu
+        """
+        erro_servidor = None
+        
+        for _ in range(len(self.pool)):
+            verificar_prazo("gemini")
+            chave = self.pool.adquirir()
+            if chave is None:
+                break
             
-            prompt += "=== FIM DO CONTEXTO ===\n\n"
-            prompt += "Use as informações acima para inspirar e orientar o estudante, mencionando exemplos relevantes quando apropriado.\n\n"
+            try:
+                with limite_gemini.vaga(modo) as vaga:
+                    resposta = chamada(self.clientes[chave.id])
+                    # Geração cancelada no meio: a duração não é latência do serviço
+                    vaga.valida = resposta is not None
+                    return resposta
+            except TooManyRequests:
+                self.pool.registrar_erro_cota(chave)
+            except DeadlineExceeded:
+                # Timeout da chamada = prazo restante da requisição
+                prazo = prazo_atual()
+                if prazo is not None:
+                    raise PrazoEsgotadoError("gemini", prazo)
+                raise
+            except ServerError as e:
+                self.pool.registrar_erro_servidor(chave)
+                erro_servidor = e
+        
+        if erro_servidor:
+            raise erro_servidor
+        retry_after = max(1, math.ceil(self.pool.segundos_ate_chave_livre()))
+        raise CapacidadeEsgotadaError(
+            self.pool.limite_total_minuto(),
+            retry_after,
+            "Todas as chaves da API do Gemini estão no limite por minuto"
+        )
+    
+    def _request_options(self) -> Dict:
+        """Limita o timeout da chamada ao prazo restante da requisição"""
+        prazo = prazo_atual()
+        if prazo is None:
+            return {}
+        return {"timeout": max(prazo.restante(), 0.1)}
+    
+    def _abrir_stream(self, cliente: glm.GenerativeServiceClient, requisicao: glm.GenerateContentRequest,
+                      cancelamento: Cancelamento):
+        """
+        Abre a chamada gRPC em streaming sem esperar o primeiro trecho
+        
+        O método do cliente só retorna quando o primeiro trecho chega; pelo
+        transporte a chamada retorna na hora e fica ligada ao cancelamento,
+        que a interrompe no Gemini mesmo antes do primeiro token (ex.: a
+        tentativa perdedora de um hedge).
+        """
+        trechos = cliente.transport.stream_generate_content(
+            requisicao,
+            metadata=[gapic_v1.routing_header.to_grpc_metadata((("model", requisicao.model),))],
+            **self._request_options()
+        )
+        cancelamento.ao_cancelar(trechos.cancel)
+        return trechos
+    
+    def _consumir_stream(self, trechos, cancelamento: Cancelamento,
+                         primeiro_trecho: Optional[Callable[[], None]] = None) -> Optional[str]:
+        """
+        Consome uma resposta em streaming, abortando se a geração for cancelada
+        
+        Args:
+            trechos: Chamada aberta por `_abrir_stream`
+            cancelamento: Cancelamento da geração
+            primeiro_trecho: Chamada ao receber o primeiro trecho
+        
+        Returns:
+            O texto completo, ou None se a geração foi cancelada
+        """
+        partes = []
+        try:
+            for trecho in trechos:
+                if primeiro_trecho is not None and not partes:
+                    primeiro_trecho()
+                verificar_prazo("gemini.stream")
+                if cancelamento.cancelado:
+                    # Cancela a chamada gRPC subjacente para o Gemini parar de gerar
+                    trechos.cancel()
+                    logger.info(f"🛑 Geração interrompida: {cancelamento.motivo}")
+                    return None
+                partes.append(self._extrair_texto(trecho))
+        except grpc.RpcError as e:
+            if cancelamento.cancelado:
+                logger.info(f"🛑 Geração interrompida: {cancelamento.motivo}")
+                return None
+            # Mesmos erros do cliente (TooManyRequests, DeadlineExceeded...)
+            raise google_exceptions.from_grpc_error(e) from e
+        except PrazoEsgotadoError:
+            trechos.cancel()
+            raise
+        return self._validar_texto("".join(partes))
+    
+    def _build_prompt_com_contexto(self, mensagem: str, contexto: Optional[List[str]] = None) -> str:
+        """
+        Constrói prompt completo com contextos da Bragantec
+        """
+        prompt = self._build_bloco_contexto(contexto)
         
         # Adiciona a pergunta do usuário
         prompt += f"Pergunta do estudante:\n{mensagem}\n\n"
@@ -183,6 +446,24 @@ Pergunta do estudante: {mensagem}"""
         
         return prompt
     
+    def _build_bloco_contexto(self, contexto: Optional[List[str]] = None) -> str:
+        """Bloco de contexto da Bragantec que antecede a(s) pergunta(s)"""
+        if not contexto:
+            return ""
+        
+        bloco = "=== CONTEXTO: Cadernos de Resumos da Bragantec (Edições Anteriores) ===\n\n"
+        bloco += "Você tem acesso aos seguintes projetos e informações de edições passadas da Bragantec:\n\n"
+        
+        # Adiciona cada contexto separadamente
+        for i, ctx in enumerate(contexto, 1):
+            # Limita o tamanho de cada contexto para não exceder o limite do modelo
+            ctx_limitado = ctx[:15000] if len(ctx) > 15000 else ctx
+            bloco += f"--- Documento {i} ---\n{ctx_limitado}\n\n"
+        
+        bloco += "=== FIM DO CONTEXTO ===\n\n"
+        bloco += "Use as informações acima para inspirar e orientar o estudante, mencionando exemplos relevantes quando apropriado.\n\n"
+        return bloco
+    
     def _format_contexto(self, contexto: List[str]) -> str:
         """Formata lista de contextos"""
         resultado = ""
@@ -201,7 +482,7 @@ Pergunta do estudante: {mensagem}"""
             
             formatted.append({
                 "role": role,
-                "parts": [msg.get("conteudo", "")]
+                "parts": [{"text": msg.get("conteudo", "")}]
             })
         
         return formatted
@@ -223,10 +504,11 @@ Pergunta sobre o documento:
 
 Responda com base no conteúdo do documento acima:"""
             
-            response = self.model.generate_content(prompt)
+            requisicao = self._montar_requisicao(prompt)
+            texto = self._executar(lambda cliente: self._chamar(cliente, requisicao), modo="documento")
             
             logger.info(f"✅ Documento TXT processado")
-            return True, response.text, None
+            return True, texto, None
             
         except Exception as e:
             return False, None, str(e)
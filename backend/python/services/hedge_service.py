@@ -0,0 +1,170 @@
+"""
+Serviço de requisições "hedged" ao Gemini para reduzir a latência de cauda
+"""
+import threading
+from collections import deque
+from contextvars import copy_context
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Any, Callable, Dict, Optional
+from config.settings import settings
+from services.api_monitor_service import api_monitor
+from services.cancelamento_service import Cancelamento
+from utils.logger import logger
+from utils.prazo import prazo_atual
+
+
+# Uma tentativa recebe seu próprio cancelamento (que deve interromper a chamada em
+# andamento, mesmo antes do primeiro token) e o evento a sinalizar no primeiro token
+Tentativa = Callable[[Cancelamento, threading.Event], Any]
+
+
+class HedgeService:
+    """
+    Dispara uma requisição duplicada quando o primeiro token demora mais que
+    o percentil configurado das latências recentes, e fica com a que
+    responder primeiro
+    """
+
+    def __init__(self):
+        self.ativo = settings.GEMINI_HEDGE_ATIVO
+        self.percentil = settings.GEMINI_HEDGE_PERCENTIL
+        self.max_extra = settings.GEMINI_HEDGE_MAX_EXTRA
+        self.min_amostras = settings.GEMINI_HEDGE_MIN_AMOSTRAS
+
+        # Latências até o primeiro token (segundos) das chamadas recentes
+        self.latencias = deque(maxlen=settings.GEMINI_HEDGE_JANELA)
+
+        self.chamadas = 0
+        self.hedges_disparados = 0
+        self.hedges_vencedores = 0
+
+        self._lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(
+            max_workers=settings.GERACAO_MAX_WORKERS * 2,
+            thread_name_prefix="hedge"
+        )
+
+    def registrar_latencia(self, segundos: float):
+        """Registra a latência até o primeiro token de uma chamada"""
+        with self._lock:
+            self.latencias.append(segundos)
+
+    def calcular_limiar(self) -> Optional[float]:
+        """
+        Percentil das latências recentes até o primeiro token
+
+        Returns:
+            Limiar em segundos, ou None se ainda não há amostras suficientes
+        """
+        with self._lock:
+            if len(self.latencias) < self.min_amostras:
+                return None
+            ordenadas = sorted(self.latencias)
+
+        indice = min(len(ordenadas) - 1, int(len(ordenadas) * self.percentil / 100))
+        return ordenadas[indice]
+
+    def _pode_disparar(self) -> bool:
+        """Respeita o teto de requisições extras (fração das chamadas)"""
+        with self._lock:
+            if self.hedges_disparados + 1 > self.max_extra * self.chamadas:
+                return False
+            self.hedges_disparados += 1
+            return True
+
+    def executar(self, tentativa: Tentativa, cancelamento: Cancelamento) -> Any:
+        """
+        Executa a tentativa principal e, se necessário, uma duplicada
+
+        Args:
+            tentativa: Função que faz a chamada ao Gemini (em streaming)
+            cancelamento: Cancelamento da geração (cancela todas as tentativas)
+
+        Returns:
+            O resultado da tentativa vencedora
+        """
+        with self._lock:
+            self.chamadas += 1
+
+        limiar = self.calcular_limiar() if self.ativo else None
+
+        cancel_principal = cancelamento.derivar()
+        primeiro_token_principal = threading.Event()
+        # Cada tentativa roda com uma cópia do contexto (prazo da requisição)
+        principal = self.executor.submit(copy_context().run, tentativa, cancel_principal, primeiro_token_principal)
+
+        # Sem limiar ainda ou primeiro token dentro do esperado: segue só com a principal
+        if limiar is None or primeiro_token_principal.wait(limiar) or principal.done():
+            return principal.result()
+
+        # Não dispara a duplicada se não há tempo para ela terminar
+        prazo = prazo_atual()
+        if prazo is not None and prazo.restante() <= limiar:
+            return principal.result()
+
+        if not self._pode_disparar():
+            return principal.result()
+
+        logger.info(f"🏁 Hedge disparado: primeiro token acima de {limiar:.2f}s (p{self.percentil})")
+
+        # A duplicada também consome cota da API
+        api_monitor.registrar_requisicao()
+
+        cancel_hedge = cancelamento.derivar()
+        primeiro_token_hedge = threading.Event()
+        hedge = self.executor.submit(copy_context().run, tentativa, cancel_hedge, primeiro_token_hedge)
+
+        pendentes = {principal, hedge}
+        while pendentes:
+            # Vence quem produzir o primeiro token (ou terminar) antes
+            if primeiro_token_principal.is_set() or primeiro_token_hedge.is_set():
+                break
+            concluidos, pendentes = wait(pendentes, timeout=0.05, return_when=FIRST_COMPLETED)
+            if any(f.exception() is None for f in concluidos):
+                break
+
+        hedge_venceu = primeiro_token_hedge.is_set() and not primeiro_token_principal.is_set()
+        if principal.done() and principal.exception() is not None:
+            hedge_venceu = True
+
+        vencedor, perdedor, cancel_perdedor = (
+            (hedge, principal, cancel_principal) if hedge_venceu
+            else (principal, hedge, cancel_hedge)
+        )
+        # Interrompe a chamada do perdedor no Gemini, libera a vaga e o worker
+        cancel_perdedor.cancelar("Hedge perdedor")
+
+        if hedge_venceu:
+            with self._lock:
+                self.hedges_vencedores += 1
+            logger.info("🏁 Hedge venceu a requisição original")
+
+        try:
+            return vencedor.result()
+        except Exception:
+            # O vencedor falhou depois do primeiro token; tenta aproveitar o outro
+            if perdedor.done() and perdedor.exception() is None and perdedor.result() is not None:
+                return perdedor.result()
+            raise
+
+    def obter_relatorio(self) -> Dict:
+        """Estatísticas de hedging"""
+        limiar = self.calcular_limiar()
+
+        with self._lock:
+            return {
+                'ativo': self.ativo,
+                'percentil': self.percentil,
+                'limiar_segundos': round(limiar, 3) if limiar is not None else None,
+                'amostras': len(self.latencias),
+                'chamadas': self.chamadas,
+                'hedges_disparados': self.hedges_disparados,
+                'hedges_vencedores': self.hedges_vencedores,
+                'taxa_disparo': round(self.hedges_disparados / self.chamadas, 4) if self.chamadas else 0.0,
+                'taxa_vitoria': round(self.hedges_vencedores / self.hedges_disparados, 4) if self.hedges_disparados else 0.0,
+                'max_extra': self.max_extra
+            }
+
+
+# Instância global
+hedge_service = HedgeService()
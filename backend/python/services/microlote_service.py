@@ -0,0 +1,197 @@
+"""
+Serviço de micro-lotes: junta perguntas curtas e independentes numa só chamada ao Gemini
+"""
+import threading
+from typing import Dict, List, Optional, Tuple
+from google.api_core.exceptions import ServiceUnavailable, TooManyRequests
+from config.settings import settings
+from services.cancelamento_service import Cancelamento
+from services.concorrencia_service import CapacidadeEsgotadaError
+from services.gemini_service import gemini_service
+from utils.logger import logger
+from utils.prazo import verificar_prazo
+
+
+# Falhas do lote por falta de capacidade ou de cota: perguntar uma a uma só
+# multiplicaria as requisições que o Gemini (ou o limite local) está recusando
+ERROS_CAPACIDADE = (CapacidadeEsgotadaError, TooManyRequests, ServiceUnavailable)
+
+
+class _Pedido:
+    """Pergunta aguardando a resposta do lote"""
+
+    def __init__(self, pergunta: str):
+        self.pergunta = pergunta
+        self.resposta: Optional[str] = None
+        self.requisicoes_api = 0
+        self.concluido = threading.Event()
+
+
+class _Lote:
+    """Perguntas que compartilham o mesmo contexto e serão enviadas juntas"""
+
+    def __init__(self):
+        self.pedidos: List[_Pedido] = []
+        self.cheio = threading.Event()
+        self.erro: Optional[Exception] = None  # Erro de capacidade, repassado a todos
+
+
+class MicroloteService:
+    """
+    Agrupa por alguns milissegundos perguntas curtas, sem histórico e no modo
+    normal, de usuários diferentes, e as responde com uma única requisição
+
+    O primeiro a chegar conduz o lote: espera a janela (ou o lote encher),
+    faz a chamada e distribui as respostas. Se a resposta não puder ser
+    separada por pergunta, cada um responde a sua individualmente; se faltou
+    capacidade ou cota, todos recebem o erro.
+    """
+
+    def __init__(self):
+        self.ativo = settings.GEMINI_MICROLOTE_ATIVO
+        self.janela = settings.GEMINI_MICROLOTE_JANELA_MS / 1000
+        self.max_perguntas = settings.GEMINI_MICROLOTE_MAX_PERGUNTAS
+        self.max_caracteres = settings.GEMINI_MICROLOTE_MAX_CARACTERES
+
+        self._abertos: Dict[int, _Lote] = {}
+        self._lock = threading.Lock()
+
+        # Último contexto visto e o seu hash (o contexto costuma ser a mesma
+        # lista do cache de contextos, com vários KB de texto)
+        self._contexto_chave: Optional[Tuple[List[str], int]] = None
+
+        self.lotes_enviados = 0
+        self.perguntas_agrupadas = 0
+        self.requisicoes_economizadas = 0
+        self.fallbacks = 0
+
+    def elegivel(self, mensagem: str, historico: Optional[List[Dict]] = None) -> bool:
+        """Verifica se a pergunta pode ir num lote (curta e sem histórico)"""
+        return self.ativo and not historico and len(mensagem) <= self.max_caracteres
+
+    def responder(self, mensagem: str, contexto: Optional[List[str]] = None,
+                  cancelamento: Optional[Cancelamento] = None) -> Tuple[bool, Optional[str], Optional[str], int]:
+        """
+        Responde a pergunta, agrupando-a com outras que chegarem na janela
+
+        Returns:
+            Tuple[sucesso, resposta, erro, requisicoes_api] - requisicoes_api é
+            quantas requisições ao Gemini esta chamada fez (0 se a resposta
+            veio no lote conduzido por outra)
+        """
+        chave = self._chave(contexto)
+        pedido = _Pedido(mensagem)
+
+        with self._lock:
+            lote = self._abertos.get(chave)
+            condutor = lote is None
+            if condutor:
+                lote = _Lote()
+                self._abertos[chave] = lote
+
+            lote.pedidos.append(pedido)
+            if len(lote.pedidos) >= self.max_perguntas:
+                # Lote cheio: novas perguntas abrem outro
+                del self._abertos[chave]
+                lote.cheio.set()
+
+        if condutor:
+            self._conduzir(chave, lote, contexto, pedido, cancelamento)
+        else:
+            while not pedido.concluido.wait(0.1):
+                verificar_prazo("microlote")
+                if cancelamento and cancelamento.cancelado:
+                    return False, None, f"Geração cancelada: {cancelamento.motivo}", 0
+
+        if cancelamento and cancelamento.cancelado:
+            return False, None, f"Geração cancelada: {cancelamento.motivo}", pedido.requisicoes_api
+
+        if pedido.resposta is not None:
+            return True, pedido.resposta, None, pedido.requisicoes_api
+
+        if isinstance(lote.erro, CapacidadeEsgotadaError):
+            raise CapacidadeEsgotadaError(lote.erro.limite, lote.erro.retry_after, str(lote.erro))
+        if lote.erro is not None:
+            return False, None, f"Erro ao gerar respostas em lote: {lote.erro}", pedido.requisicoes_api
+
+        # Sem resposta do lote: pergunta individual
+        if len(lote.pedidos) > 1:
+            with self._lock:
+                self.fallbacks += 1
+
+        sucesso, resposta, erro = gemini_service.gerar_resposta(mensagem, contexto, None, cancelamento)
+        return sucesso, resposta, erro, pedido.requisicoes_api + 1
+
+    def _chave(self, contexto: Optional[List[str]]) -> int:
+        """Chave dos lotes com esse contexto (calculada uma vez por lista de contexto)"""
+        if not contexto:
+            return 0
+
+        with self._lock:
+            if self._contexto_chave is not None and self._contexto_chave[0] is contexto:
+                return self._contexto_chave[1]
+
+        chave = hash(tuple(contexto))
+        with self._lock:
+            self._contexto_chave = (contexto, chave)
+        return chave
+
+    def _conduzir(self, chave: int, lote: _Lote, contexto: Optional[List[str]],
+                  pedido_condutor: _Pedido, cancelamento: Optional[Cancelamento]):
+        """Espera a janela, envia o lote e distribui as respostas"""
+        try:
+            lote.cheio.wait(self.janela)
+
+            with self._lock:
+                if self._abertos.get(chave) is lote:
+                    del self._abertos[chave]
+                # Condutor cancelado durante a janela: a pergunta dele sai, as demais seguem
+                if cancelamento and cancelamento.cancelado:
+                    lote.pedidos.remove(pedido_condutor)
+
+            # Ninguém mais no lote: quem sobrou segue com a chamada normal
+            if len(lote.pedidos) <= 1:
+                return
+
+            lote.pedidos[0].requisicoes_api = 1
+            try:
+                sucesso, respostas, erro = gemini_service.gerar_respostas_em_lote(
+                    [p.pergunta for p in lote.pedidos], contexto
+                )
+            except ERROS_CAPACIDADE as e:
+                lote.erro = e
+                logger.warning(f"⚠️  Lote de {len(lote.pedidos)} pergunta(s) sem capacidade ({e}) - sem respostas individuais")
+                return
+
+            with self._lock:
+                self.lotes_enviados += 1
+                self.perguntas_agrupadas += len(lote.pedidos)
+
+            if sucesso:
+                with self._lock:
+                    self.requisicoes_economizadas += len(lote.pedidos) - 1
+                for pedido, resposta in zip(lote.pedidos, respostas):
+                    pedido.resposta = resposta
+                logger.info(f"📦 Lote de {len(lote.pedidos)} pergunta(s) respondido com 1 requisição")
+            else:
+                logger.warning(f"⚠️  Lote de {len(lote.pedidos)} pergunta(s) falhou ({erro}) - respondendo individualmente")
+        finally:
+            for pedido in lote.pedidos:
+                pedido.concluido.set()
+
+    def obter_relatorio(self) -> Dict:
+        """Estatísticas dos micro-lotes"""
+        with self._lock:
+            return {
+                'ativo': self.ativo,
+                'janela_ms': int(self.janela * 1000),
+                'max_perguntas': self.max_perguntas,
+                'lotes_enviados': self.lotes_enviados,
+                'perguntas_agrupadas': self.perguntas_agrupadas,
+                'requisicoes_economizadas': self.requisicoes_economizadas,
+                'fallbacks': self.fallbacks
+            }
+
+
+# Instância global
+microlote_service = MicroloteService()
@@ -0,0 +1,162 @@
+"""
+Cache em memória com validade (TTL) e descarte dos menos usados (LRU)
+"""
+import copy
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional, Set, Tuple
+from utils.metricas import metricas, rotulos
+
+
+# Mesma métrica do cache de contextos, com o rótulo `cache` distinguindo cada um
+_consultas = metricas.contador("apbia_cache_consultas_total", "Consultas a caches em memória por resultado")
+_invalidacoes = metricas.contador(
+    "apbia_cache_invalidacoes_total", "Itens removidos dos caches de leitura por escritas"
+)
+_caches: Dict[str, 'CacheLRU'] = {}
+
+
+class CacheLRU:
+    """
+    Até `max_itens` valores, cada um válido por `ttl` segundos
+
+    Ler um item o torna o mais recente; ao passar do tamanho, sai o usado há
+    mais tempo. Itens podem pertencer a um grupo (ex.: todas as projeções de
+    um mesmo registro), invalidado de uma vez.
+
+    Uma leitura do banco que começou antes de uma invalidação não pode repor
+    o valor antigo: quem preenche o cache pega `versao()` antes de consultar
+    e a repassa a `definir`, que descarta o valor se houve invalidação no
+    meio-tempo.
+
+    O cache é compartilhado por requisições e threads: `definir` guarda uma
+    cópia e `obter` entrega outra, então alterar o valor recebido não muda o
+    que os demais leem.
+    """
+
+    def __init__(self, nome: str, ttl: float, max_itens: int,
+                 relogio: Callable[[], float] = time.monotonic):
+        self.nome = nome
+        self.ttl = ttl
+        self.max_itens = max_itens
+        self._relogio = relogio
+
+        # chave -> (expira_em, grupo, valor), do menos para o mais recente
+        self._itens: 'OrderedDict[Hashable, Tuple[float, Hashable, Any]]' = OrderedDict()
+        self._grupos: Dict[Hashable, Set[Hashable]] = {}
+        self._versao = 0  # Cresce a cada invalidação
+        self._lock = threading.Lock()
+
+        self.acertos = 0
+        self.falhas = 0
+        self.descartes = 0
+
+    def obter(self, chave: Hashable) -> Optional[Any]:
+        """Cópia do valor em cache, ou None se ausente ou vencido"""
+        with self._lock:
+            item = self._itens.get(chave)
+            if item is not None and item[0] <= self._relogio():
+                self._remover(chave)
+                item = None
+
+            if item is None:
+                self.falhas += 1
+            else:
+                self._itens.move_to_end(chave)
+                self.acertos += 1
+
+        _consultas.inc(cache=self.nome, resultado="acerto" if item is not None else "falha")
+        return copy.deepcopy(item[2]) if item is not None else None
+
+    def versao(self) -> int:
+        """Marca a ser passada a `definir` por quem lê do banco para preencher o cache"""
+        return self._versao
+
+    def definir(self, chave: Hashable, valor: Any, grupo: Hashable = None, versao: Optional[int] = None):
+        """Guarda uma cópia do valor, descartando os menos usados se passar de `max_itens`"""
+        valor = copy.deepcopy(valor)
+        with self._lock:
+            if versao is not None and versao != self._versao:
+                # Houve escrita durante a leitura: o valor pode já estar velho
+                return
+            if chave in self._itens:
+                self._remover(chave)
+            self._itens[chave] = (self._relogio() + self.ttl, grupo, valor)
+            self._grupos.setdefault(grupo, set()).add(chave)
+
+            while len(self._itens) > self.max_itens:
+                self._remover(next(iter(self._itens)))
+                self.descartes += 1
+
+    def invalidar_grupo(self, grupo: Hashable):
+        """Remove todos os itens do grupo"""
+        with self._lock:
+            self._versao += 1
+            chaves = list(self._grupos.get(grupo, ()))
+            for chave in chaves:
+                self._remover(chave)
+
+        if chaves:
+            _invalidacoes.inc(len(chaves), cache=self.nome)
+
+    def limpar(self):
+        """Remove todos os itens"""
+        with self._lock:
+            self._versao += 1
+            quantidade = len(self._itens)
+            self._itens.clear()
+            self._grupos.clear()
+
+        if quantidade:
+            _invalidacoes.inc(quantidade, cache=self.nome)
+
+    def _remover(self, chave: Hashable):
+        """Tira o item e o seu registro no grupo (chamar com o lock)"""
+        _, grupo, _ = self._itens.pop(chave)
+        chaves = self._grupos.get(grupo)
+        if chaves is not None:
+            chaves.discard(chave)
+            if not chaves:
+                del self._grupos[grupo]
+
+    def __len__(self) -> int:
+        return len(self._itens)
+
+    def obter_relatorio(self) -> Dict:
+        """Tamanho, configuração e taxa de acerto"""
+        with self._lock:
+            consultas = self.acertos + self.falhas
+            return {
+                'itens': len(self._itens),
+                'max_itens': self.max_itens,
+                'ttl_segundos': self.ttl,
+                'acertos': self.acertos,
+                'falhas': self.falhas,
+                'taxa_acerto': round(self.acertos / consultas, 4) if consultas else 0.0,
+                'descartes': self.descartes
+            }
+
+
+def registrar_cache(nome: str, ttl: float, max_itens: int) -> CacheLRU:
+    """Cria (ou reaproveita) o cache com esse nome, compartilhado no processo"""
+    if nome not in _caches:
+        _caches[nome] = CacheLRU(nome, ttl, max_itens)
+    return _caches[nome]
+
+
+def obter_cache(nome: str) -> Optional[CacheLRU]:
+    """Cache registrado com esse nome (None se não houver)"""
+    return _caches.get(nome)
+
+
+def relatorio_caches() -> Dict[str, Dict]:
+    """Relatório de todos os caches registrados"""
+    return {nome: cache.obter_relatorio() for nome, cache in sorted(_caches.items())}
+
+
+metricas.medidor(
+    "apbia_cache_itens",
+    "Itens guardados em cada cache de leitura",
+    funcao=lambda: {rotulos(cache=nome): len(cache) for nome, cache in list(_caches.items())}
+)
@@ -0,0 +1,287 @@
+"""
+Estado compartilhado (contadores e janelas de eventos) entre processos do servidor
+"""
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Dict, Iterable, Optional
+from utils.janela_deslizante import JanelaDeslizante
+
+
+class EstadoCompartilhado(ABC):
+    """
+    Contadores inteiros e contagem de eventos no último minuto
+
+    Todas as operações são atômicas. Implementações: em memória (um processo)
+    e SQLite em modo WAL (vários workers na mesma máquina).
+    """
+
+    JANELA_SEGUNDOS = 60
+
+    @abstractmethod
+    def incrementar(self, chave: str, quantidade: int = 1) -> int:
+        """Soma `quantidade` ao contador e retorna o novo valor"""
+
+    @abstractmethod
+    def obter(self, chave: str, padrao: int = 0) -> int:
+        """Valor atual do contador"""
+
+    @abstractmethod
+    def obter_varios(self, chaves: Iterable[str]) -> Dict[str, int]:
+        """Retrato consistente de vários contadores (os inexistentes ficam de fora)"""
+
+    @abstractmethod
+    def definir(self, chave: str, valor: int):
+        """Substitui o valor do contador"""
+
+    @abstractmethod
+    def trocar(self, chave: str, esperado: int, novo: int) -> bool:
+        """Define `novo` só se o valor atual for `esperado`; retorna se trocou"""
+
+    @abstractmethod
+    def inicializar(self, valores: Dict[str, int]):
+        """Define os contadores que ainda não existem (os existentes são mantidos)"""
+
+    @abstractmethod
+    def registrar_evento(self, chave: str, quantidade: int = 1):
+        """Registra eventos na janela do último minuto"""
+
+    @abstractmethod
+    def reservar_evento(self, chave: str, limite: int, quantidade: int = 1) -> Optional[float]:
+        """
+        Registra eventos só se a janela ficar com no máximo `limite`
+
+        Contagem e registro são uma única operação atômica: numa rajada
+        simultânea (em qualquer worker) passam no máximo `limite`. Retorna o
+        instante do registro, para `liberar_evento`, ou None se não coube.
+        """
+
+    @abstractmethod
+    def liberar_evento(self, chave: str, instante: float, quantidade: int = 1):
+        """Desfaz uma reserva feita em `instante` (nada, se já saiu da janela)"""
+
+    @abstractmethod
+    def contar_eventos(self, chave: str) -> int:
+        """Eventos registrados no último minuto"""
+
+    @abstractmethod
+    def segundos_ate_vaga(self, chave: str, limite: int) -> float:
+        """Tempo até a janela ter menos de `limite` eventos (0 se já tiver)"""
+
+
+class EstadoMemoria(EstadoCompartilhado):
+    """Estado local do processo (um único worker)"""
+
+    def __init__(self):
+        self._contadores: Dict[str, int] = {}
+        self._janelas: Dict[str, JanelaDeslizante] = {}
+        self._lock = threading.Lock()
+
+    def incrementar(self, chave: str, quantidade: int = 1) -> int:
+        with self._lock:
+            self._contadores[chave] = self._contadores.get(chave, 0) + quantidade
+            return self._contadores[chave]
+
+    def obter(self, chave: str, padrao: int = 0) -> int:
+        with self._lock:
+            return self._contadores.get(chave, padrao)
+
+    def obter_varios(self, chaves: Iterable[str]) -> Dict[str, int]:
+        with self._lock:
+            return {chave: self._contadores[chave] for chave in chaves if chave in self._contadores}
+
+    def definir(self, chave: str, valor: int):
+        with self._lock:
+            self._contadores[chave] = valor
+
+    def trocar(self, chave: str, esperado: int, novo: int) -> bool:
+        with self._lock:
+            if self._contadores.get(chave) != esperado:
+                return False
+            self._contadores[chave] = novo
+            return True
+
+    def inicializar(self, valores: Dict[str, int]):
+        with self._lock:
+            for chave, valor in valores.items():
+                self._contadores.setdefault(chave, valor)
+
+    def _janela(self, chave: str) -> JanelaDeslizante:
+        with self._lock:
+            if chave not in self._janelas:
+                self._janelas[chave] = JanelaDeslizante(segundos=self.JANELA_SEGUNDOS, baldes=self.JANELA_SEGUNDOS)
+            return self._janelas[chave]
+
+    def registrar_evento(self, chave: str, quantidade: int = 1):
+        self._janela(chave).registrar(quantidade)
+
+    def reservar_evento(self, chave: str, limite: int, quantidade: int = 1) -> Optional[float]:
+        agora = time.monotonic()
+        if self._janela(chave).registrar_se_couber(limite, quantidade, agora=agora):
+            return agora
+        return None
+
+    def liberar_evento(self, chave: str, instante: float, quantidade: int = 1):
+        self._janela(chave).descontar(quantidade, instante)
+
+    def contar_eventos(self, chave: str) -> int:
+        return self._janela(chave).contar()
+
+    def segundos_ate_vaga(self, chave: str, limite: int) -> float:
+        return self._janela(chave).segundos_ate_vaga(limite)
+
+
+class EstadoSQLite(EstadoCompartilhado):
+    """
+    Estado num arquivo SQLite local em modo WAL, compartilhado pelos workers
+
+    Eventos ficam em baldes de 1 segundo (relógio de parede, comum a todos os
+    processos); baldes fora da janela são apagados periodicamente.
+    """
+
+    def __init__(self, caminho: Path):
+        self.caminho = Path(caminho)
+        self.caminho.parent.mkdir(parents=True, exist_ok=True)
+        self._local = threading.local()
+        self._ultima_limpeza = 0
+
+        conexao = self._conexao()
+        conexao.execute("PRAGMA journal_mode=WAL")
+        conexao.execute(
+            "CREATE TABLE IF NOT EXISTS contadores (chave TEXT PRIMARY KEY, valor INTEGER NOT NULL)"
+        )
+        conexao.execute(
+            "CREATE TABLE IF NOT EXISTS eventos ("
+            "chave TEXT NOT NULL, balde INTEGER NOT NULL, quantidade INTEGER NOT NULL, "
+            "PRIMARY KEY (chave, balde))"
+        )
+
+    def _conexao(self) -> sqlite3.Connection:
+        """Uma conexão por thread (autocommit: cada comando é atômico)"""
+        conexao = getattr(self._local, "conexao", None)
+        if conexao is None:
+            conexao = sqlite3.connect(self.caminho, timeout=5, isolation_level=None)
+            conexao.execute("PRAGMA synchronous=NORMAL")
+            self._local.conexao = conexao
+        return conexao
+
+    def incrementar(self, chave: str, quantidade: int = 1) -> int:
+        linha = self._conexao().execute(
+            "INSERT INTO contadores (chave, valor) VALUES (?, ?) "
+            "ON CONFLICT(chave) DO UPDATE SET valor = valor + excluded.valor "
+            "RETURNING valor",
+            (chave, quantidade)
+        ).fetchone()
+        return linha[0]
+
+    def obter(self, chave: str, padrao: int = 0) -> int:
+        linha = self._conexao().execute(
+            "SELECT valor FROM contadores WHERE chave = ?", (chave,)
+        ).fetchone()
+        return linha[0] if linha else padrao
+
+    def obter_varios(self, chaves: Iterable[str]) -> Dict[str, int]:
+        chaves = list(chaves)
+        # Uma única consulta: todos os valores vêm do mesmo retrato do banco
+        linhas = self._conexao().execute(
+            f"SELECT chave, valor FROM contadores WHERE chave IN ({','.join('?' * len(chaves))})",
+            chaves
+        ).fetchall()
+        return dict(linhas)
+
+    def definir(self, chave: str, valor: int):
+        self._conexao().execute(
+            "INSERT INTO contadores (chave, valor) VALUES (?, ?) "
+            "ON CONFLICT(chave) DO UPDATE SET valor = excluded.valor",
+            (chave, valor)
+        )
+
+    def trocar(self, chave: str, esperado: int, novo: int) -> bool:
+        cursor = self._conexao().execute(
+            "UPDATE contadores SET valor = ? WHERE chave = ? AND valor = ?",
+            (novo, chave, esperado)
+        )
+        return cursor.rowcount == 1
+
+    def inicializar(self, valores: Dict[str, int]):
+        self._conexao().executemany(
+            "INSERT OR IGNORE INTO contadores (chave, valor) VALUES (?, ?)",
+            list(valores.items())
+        )
+
+    def _inserir_evento(self, conexao: sqlite3.Connection, chave: str, balde: int, quantidade: int):
+        conexao.execute(
+            "INSERT INTO eventos (chave, balde, quantidade) VALUES (?, ?, ?) "
+            "ON CONFLICT(chave, balde) DO UPDATE SET quantidade = quantidade + excluded.quantidade",
+            (chave, balde, quantidade)
+        )
+
+        if balde - self._ultima_limpeza >= self.JANELA_SEGUNDOS:
+            self._ultima_limpeza = balde
+            conexao.execute("DELETE FROM eventos WHERE balde <= ?", (balde - self.JANELA_SEGUNDOS,))
+
+    def _somar_eventos(self, conexao: sqlite3.Connection, chave: str, agora: int) -> int:
+        linha = conexao.execute(
+            "SELECT COALESCE(SUM(quantidade), 0) FROM eventos WHERE chave = ? AND balde > ?",
+            (chave, agora - self.JANELA_SEGUNDOS)
+        ).fetchone()
+        return linha[0]
+
+    def registrar_evento(self, chave: str, quantidade: int = 1):
+        self._inserir_evento(self._conexao(), chave, int(time.time()), quantidade)
+
+    def reservar_evento(self, chave: str, limite: int, quantidade: int = 1) -> Optional[float]:
+        agora = int(time.time())
+        conexao = self._conexao()
+
+        # BEGIN IMMEDIATE trava a escrita antes da contagem: nenhum outro
+        # worker registra entre a soma e a inserção
+        conexao.execute("BEGIN IMMEDIATE")
+        try:
+            coube = self._somar_eventos(conexao, chave, agora) + quantidade <= limite
+            if coube:
+                self._inserir_evento(conexao, chave, agora, quantidade)
+            conexao.execute("COMMIT")
+        except Exception:
+            conexao.execute("ROLLBACK")
+            raise
+
+        return float(agora) if coube else None
+
+    def liberar_evento(self, chave: str, instante: float, quantidade: int = 1):
+        self._conexao().execute(
+            "UPDATE eventos SET quantidade = MAX(0, quantidade - ?) WHERE chave = ? AND balde = ?",
+            (quantidade, chave, int(instante))
+        )
+
+    def contar_eventos(self, chave: str) -> int:
+        return self._somar_eventos(self._conexao(), chave, int(time.time()))
+
+    def segundos_ate_vaga(self, chave: str, limite: int) -> float:
+        agora = time.time()
+        baldes = self._conexao().execute(
+            "SELECT balde, quantidade FROM eventos WHERE chave = ? AND balde > ? ORDER BY balde",
+            (chave, int(agora) - self.JANELA_SEGUNDOS)
+        ).fetchall()
+
+        excedente = sum(quantidade for _, quantidade in baldes) - limite + 1
+        if excedente <= 0:
+            return 0.0
+
+        for balde, quantidade in baldes:
+            excedente -= quantidade
+            if excedente <= 0:
+                # O balde sai da janela 60s depois do seu início
+                return max(0.0, balde + self.JANELA_SEGUNDOS - agora)
+        return float(self.JANELA_SEGUNDOS)
+
+
+def criar_estado_compartilhado(backend: str, caminho_sqlite: Path) -> EstadoCompartilhado:
+    """Cria o estado conforme API_MONITOR_BACKEND ('memoria' ou 'sqlite')"""
+    if backend == "sqlite":
+        return EstadoSQLite(caminho_sqlite)
+    if backend == "memoria":
+        return EstadoMemoria()
+    raise ValueError(f"Backend de estado desconhecido: {backend}")
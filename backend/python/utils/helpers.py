@@ -1,13 +1,16 @@
 """
 Funções auxiliares para o sistema APBIA
 """
+import base64
 import hashlib
+import json
 import secrets
 import bcrypt
 from datetime import datetime, timedelta
 import jwt
+from dateutil.parser import isoparse
 from config.settings import settings
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List, Tuple
 
 
 class Helpers:
@@ -110,6 +113,50 @@ class Helpers:
             return text
         return text[:max_length - len(suffix)] + suffix
     
+    @staticmethod
+    def encode_cursor(posicao: Tuple[Any, int], direcao: str) -> str:
+        """Cursor opaco de paginação: posição (valor de ordem, id) e direção"""
+        bruto = json.dumps({"p": list(posicao), "d": direcao}, separators=(",", ":"))
+        return base64.urlsafe_b64encode(bruto.encode()).decode().rstrip("=")
+    
+    @staticmethod
+    def decode_cursor(cursor: str) -> Optional[Tuple[str, Tuple[str, int]]]:
+        """
+        Decodifica um cursor; None se for inválido
+        
+        O cursor vem do cliente: o valor de ordem (sempre um timestamp nas
+        listagens paginadas) é validado e devolvido normalizado em ISO 8601.
+        `isoparse` aceita frações de segundo de qualquer tamanho, como as do
+        Postgres (o `fromisoformat` do Python 3.10 só aceita 3 ou 6 dígitos).
+        """
+        try:
+            bruto = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+            dados = json.loads(bruto)
+            valor, id = dados["p"]
+            if dados["d"] not in ("antes", "depois") or not isinstance(id, int) or not isinstance(valor, str):
+                return None
+            return dados["d"], (isoparse(valor).isoformat(), id)
+        except (ValueError, TypeError, KeyError):
+            return None
+    
+    @staticmethod
+    def page_cursors(posicoes: List[Tuple[Any, int]], ha_mais: bool, direcao: Optional[str]) -> Dict[str, Optional[str]]:
+        """
+        Cursores das páginas vizinhas ("antes" e "depois")
+        
+        `posicoes` são as dos itens da página em ordem crescente; a página
+        pedida com cursor sempre tem vizinha do lado de onde veio.
+        """
+        if not posicoes:
+            return {"antes": None, "depois": None}
+        
+        ha_antes = ha_mais if direcao != "depois" else True
+        ha_depois = ha_mais if direcao == "depois" else direcao == "antes"
+        return {
+            "antes": Helpers.encode_cursor(posicoes[0], "antes") if ha_antes else None,
+            "depois": Helpers.encode_cursor(posicoes[-1], "depois") if ha_depois else None
+        }
+    
     @staticmethod
     def create_response(success: bool, message: str, data: Any = None, error: str = None) -> Dict:
         """Cria resposta padronizada da API"""
@@ -0,0 +1,115 @@
+"""
+Janela deslizante de contagem de eventos com custo O(1) e memória fixa
+"""
+import threading
+import time
+from typing import Callable, Optional
+
+
+class JanelaDeslizante:
+    """
+    Conta eventos nos últimos `segundos`, agrupados em baldes circulares
+
+    Cada balde cobre `segundos / baldes` segundos. Registrar e contar só
+    zeram os baldes que saíram da janela desde a última chamada (no máximo
+    `baldes`), então o custo não depende de quantos eventos houve. A
+    precisão é de um balde.
+    """
+
+    def __init__(self, segundos: float = 60.0, baldes: int = 60,
+                 relogio: Callable[[], float] = time.monotonic):
+        self.segundos = segundos
+        self.baldes = baldes
+        self.largura = segundos / baldes
+        self._relogio = relogio
+
+        self._contagens = [0] * baldes
+        self._total = 0
+        self._balde_atual = int(relogio() // self.largura)
+        self._lock = threading.Lock()
+
+    def _avancar(self, agora: float):
+        """Descarta os baldes que saíram da janela (chamar com o lock)"""
+        balde = int(agora // self.largura)
+        passados = balde - self._balde_atual
+        if passados <= 0:
+            return
+
+        if passados >= self.baldes:
+            self._contagens = [0] * self.baldes
+            self._total = 0
+        else:
+            for i in range(self._balde_atual + 1, balde + 1):
+                indice = i % self.baldes
+                self._total -= self._contagens[indice]
+                self._contagens[indice] = 0
+
+        self._balde_atual = balde
+
+    def registrar(self, quantidade: int = 1, agora: Optional[float] = None):
+        """Registra `quantidade` eventos no instante atual"""
+        agora = self._relogio() if agora is None else agora
+        with self._lock:
+            self._avancar(agora)
+            self._contagens[self._balde_atual % self.baldes] += quantidade
+            self._total += quantidade
+
+    def registrar_se_couber(self, limite: int, quantidade: int = 1, agora: Optional[float] = None) -> bool:
+        """Registra `quantidade` eventos só se a janela ficar com no máximo `limite`"""
+        agora = self._relogio() if agora is None else agora
+        with self._lock:
+            self._avancar(agora)
+            if self._total + quantidade > limite:
+                return False
+            self._contagens[self._balde_atual % self.baldes] += quantidade
+            self._total += quantidade
+            return True
+
+    def descontar(self, quantidade: int, instante: float, agora: Optional[float] = None):
+        """Retira eventos registrados em `instante` (nada, se o balde já saiu da janela)"""
+        agora = self._relogio() if agora is None else agora
+        with self._lock:
+            self._avancar(agora)
+            balde = int(instante // self.largura)
+            if balde <= self._balde_atual - self.baldes or balde > self._balde_atual:
+                return
+            indice = balde % self.baldes
+            retirados = min(quantidade, self._contagens[indice])
+            self._contagens[indice] -= retirados
+            self._total -= retirados
+
+    def contar(self, agora: Optional[float] = None) -> int:
+        """Eventos dentro da janela"""
+        agora = self._relogio() if agora is None else agora
+        with self._lock:
+            self._avancar(agora)
+            return self._total
+
+    def segundos_ate_vaga(self, limite: int, agora: Optional[float] = None) -> float:
+        """
+        Tempo até a janela ter menos de `limite` eventos (0 se já tiver)
+
+        Percorre os baldes do mais antigo ao mais novo até que os que
+        saíram liberem espaço; custo limitado ao número de baldes.
+        """
+        agora = self._relogio() if agora is None else agora
+        with self._lock:
+            self._avancar(agora)
+            excedente = self._total - limite + 1
+            if excedente <= 0:
+                return 0.0
+
+            primeiro = self._balde_atual - self.baldes + 1
+            for balde in range(primeiro, self._balde_atual + 1):
+                excedente -= self._contagens[balde % self.baldes]
+                if excedente <= 0:
+                    # O balde sai da janela quando começa o balde `balde + baldes`
+                    return max(0.0, (balde + self.baldes) * self.largura - agora)
+
+            return self.segundos
+
+    def limpar(self):
+        """Zera a janela"""
+        with self._lock:
+            self._contagens = [0] * self.baldes
+            self._total = 0
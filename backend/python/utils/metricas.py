@@ -0,0 +1,177 @@
+"""
+Registro de métricas no formato de exposição do Prometheus
+"""
+import bisect
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
+
+
+# Limites padrão (segundos) dos histogramas de latência
+LIMITES_LATENCIA = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120)
+
+Rotulos = Tuple[Tuple[str, str], ...]
+
+
+def _rotulos(valores: Dict[str, object]) -> Rotulos:
+    return tuple(sorted((chave, str(valor)) for chave, valor in valores.items()))
+
+
+def _escapar(valor: str) -> str:
+    return valor.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _formatar_rotulos(rotulos: Rotulos, extra: Optional[Tuple[str, str]] = None) -> str:
+    pares = list(rotulos) + ([extra] if extra else [])
+    if not pares:
+        return ""
+    return "{" + ",".join(f'{chave}="{_escapar(valor)}"' for chave, valor in pares) + "}"
+
+
+def _formatar_valor(valor: float) -> str:
+    if valor == float("inf"):
+        return "+Inf"
+    return repr(float(valor)) if not float(valor).is_integer() else str(int(valor))
+
+
+class Contador:
+    """Valor que só cresce (ex.: requisições, tokens)"""
+
+    tipo = "counter"
+
+    def __init__(self, nome: str, ajuda: str):
+        self.nome = nome
+        self.ajuda = ajuda
+        self._valores: Dict[Rotulos, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, quantidade: float = 1, **rotulos):
+        chave = _rotulos(rotulos)
+        with self._lock:
+            self._valores[chave] = self._valores.get(chave, 0) + quantidade
+
+    def valor(self, **rotulos) -> float:
+        with self._lock:
+            return self._valores.get(_rotulos(rotulos), 0)
+
+    def amostras(self) -> List[str]:
+        with self._lock:
+            itens = list(self._valores.items())
+        return [f"{self.nome}{_formatar_rotulos(r)} {_formatar_valor(v)}" for r, v in itens]
+
+
+class Medidor:
+    """Valor instantâneo, definido diretamente ou lido de uma função na coleta"""
+
+    tipo = "gauge"
+
+    def __init__(self, nome: str, ajuda: str, funcao: Optional[Callable[[], Dict[Rotulos, float]]] = None):
+        self.nome = nome
+        self.ajuda = ajuda
+        self.funcao = funcao
+        self._valores: Dict[Rotulos, float] = {}
+        self._lock = threading.Lock()
+
+    def definir(self, valor: float, **rotulos):
+        with self._lock:
+            self._valores[_rotulos(rotulos)] = valor
+
+    def amostras(self) -> List[str]:
+        if self.funcao is not None:
+            itens = list(self.funcao().items())
+        else:
+            with self._lock:
+                itens = list(self._valores.items())
+        return [f"{self.nome}{_formatar_rotulos(r)} {_formatar_valor(v)}" for r, v in itens]
+
+
+class Histograma:
+    """Distribuição de valores (ex.: latências) em faixas cumulativas"""
+
+    tipo = "histogram"
+
+    def __init__(self, nome: str, ajuda: str, limites: Tuple[float, ...] = LIMITES_LATENCIA):
+        self.nome = nome
+        self.ajuda = ajuda
+        self.limites = tuple(sorted(limites)) + (float("inf"),)
+        # rótulos -> (contagem por faixa, soma, total)
+        self._series: Dict[Rotulos, Tuple[List[int], List[float]]] = {}
+        self._lock = threading.Lock()
+
+    def observar(self, valor: float, **rotulos):
+        chave = _rotulos(rotulos)
+        faixa = bisect.bisect_left(self.limites, valor)
+        with self._lock:
+            serie = self._series.get(chave)
+            if serie is None:
+                serie = ([0] * len(self.limites), [0.0, 0])
+                self._series[chave] = serie
+            serie[0][faixa] += 1
+            serie[1][0] += valor
+            serie[1][1] += 1
+
+    def amostras(self) -> List[str]:
+        with self._lock:
+            series = [(r, list(contagens), list(soma_total)) for r, (contagens, soma_total) in self._series.items()]
+
+        linhas = []
+        for rotulos, contagens, (soma, total) in series:
+            acumulado = 0
+            for limite, contagem in zip(self.limites, contagens):
+                acumulado += contagem
+                le = ("le", _formatar_valor(limite))
+                linhas.append(f"{self.nome}_bucket{_formatar_rotulos(rotulos, le)} {acumulado}")
+            linhas.append(f"{self.nome}_sum{_formatar_rotulos(rotulos)} {_formatar_valor(soma)}")
+            linhas.append(f"{self.nome}_count{_formatar_rotulos(rotulos)} {int(total)}")
+        return linhas
+
+
+class RegistroMetricas:
+    """Registro central; cada métrica é criada uma vez e reaproveitada pelo nome"""
+
+    def __init__(self):
+        self._metricas: Dict[str, object] = {}
+        self._lock = threading.Lock()
+
+    def _obter(self, classe, nome: str, ajuda: str, **kwargs):
+        with self._lock:
+            metrica = self._metricas.get(nome)
+            if metrica is None:
+                metrica = classe(nome, ajuda, **kwargs)
+                self._metricas[nome] = metrica
+            return metrica
+
+    def contador(self, nome: str, ajuda: str = "") -> Contador:
+        return self._obter(Contador, nome, ajuda)
+
+    def medidor(self, nome: str, ajuda: str = "",
+                funcao: Optional[Callable[[], Dict[Rotulos, float]]] = None) -> Medidor:
+        return self._obter(Medidor, nome, ajuda, funcao=funcao)
+
+    def histograma(self, nome: str, ajuda: str = "", limites: Tuple[float, ...] = LIMITES_LATENCIA) -> Histograma:
+        return self._obter(Histograma, nome, ajuda, limites=limites)
+
+    def exportar(self) -> str:
+        """Todas as métricas no formato texto do Prometheus"""
+        with self._lock:
+            metricas = sorted(self._metricas.values(), key=lambda m: m.nome)
+
+        linhas = []
+        for metrica in metricas:
+            try:
+                amostras = metrica.amostras()
+            except Exception:
+                # Um medidor com falha não derruba a coleta das demais
+                continue
+            linhas.append(f"# HELP {metrica.nome} {metrica.ajuda}")
+            linhas.append(f"# TYPE {metrica.nome} {metrica.tipo}")
+            linhas.extend(amostras)
+        return "\n".join(linhas) + "\n"
+
+
+def rotulos(**valores) -> Rotulos:
+    """Chave de rótulos para medidores calculados por função"""
+    return _rotulos(valores)
+
+
+# Instância global
+metricas = RegistroMetricas()
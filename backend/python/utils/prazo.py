@@ -0,0 +1,124 @@
+"""
+Prazo (deadline) de ponta a ponta para o processamento de uma requisição
+"""
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar, Token
+from typing import List, Optional, Tuple
+from utils.logger import logger
+from utils.metricas import metricas
+
+
+class PrazoEsgotadoError(Exception):
+    """Levantada quando o tempo total da requisição se esgota"""
+
+    def __init__(self, etapa: str, prazo: 'Prazo'):
+        self.etapa = etapa
+        self.prazo = prazo
+        super().__init__(f"Prazo de {prazo.segundos:.0f}s esgotado na etapa '{etapa}'")
+
+
+class Prazo:
+    """Orçamento de tempo de uma requisição, com o tempo gasto em cada etapa"""
+
+    def __init__(self, segundos: float, nome: str = "requisicao", operacao: str = "requisicao"):
+        self.nome = nome
+        self.operacao = operacao  # Rótulo das métricas de etapa (baixa cardinalidade)
+        self.segundos = segundos
+        self.inicio = time.monotonic()
+        self.limite = self.inicio + segundos
+        self.etapas: List[Tuple[str, float]] = []
+
+    def restante(self) -> float:
+        """Segundos restantes (nunca negativo)"""
+        return max(0.0, self.limite - time.monotonic())
+
+    def expirado(self) -> bool:
+        """Verifica se o prazo já acabou"""
+        return time.monotonic() >= self.limite
+
+    def verificar(self, etapa: str):
+        """Levanta PrazoEsgotadoError se o prazo acabou antes/durante a etapa"""
+        if self.expirado():
+            logger.warning(f"⏰ Prazo esgotado em '{etapa}' ({self.nome}) | {self.resumo()}")
+            raise PrazoEsgotadoError(etapa, self)
+
+    @contextmanager
+    def etapa(self, nome: str, verificar: bool = True):
+        """
+        Mede uma etapa e falha cedo se não houver mais tempo para ela
+
+        Com verificar=False a etapa só é medida (para trabalho que precisa
+        terminar mesmo com o prazo esgotado).
+        """
+        if verificar:
+            self.verificar(nome)
+        inicio = time.monotonic()
+        try:
+            yield self
+        finally:
+            duracao = time.monotonic() - inicio
+            self.etapas.append((nome, duracao))
+            _duracao_etapas.observar(duracao, operacao=self.operacao, etapa=nome)
+        if verificar:
+            self.verificar(nome)
+
+    def resumo(self) -> str:
+        """Tempo gasto por etapa, para logs"""
+        partes = [f"{nome}={duracao:.2f}s" for nome, duracao in self.etapas]
+        total = time.monotonic() - self.inicio
+        return f"{', '.join(partes) or 'nenhuma etapa concluída'} | total={total:.2f}s/{self.segundos:.0f}s"
+
+    def etapas_dict(self) -> dict:
+        """Tempo gasto por etapa, para respostas da API"""
+        return {nome: round(duracao, 3) for nome, duracao in self.etapas}
+
+    def ativar(self) -> Token:
+        """Torna este o prazo atual do contexto (ver prazo_atual)"""
+        return _prazo_atual.set(self)
+
+    @staticmethod
+    def desativar(token: Token):
+        """Restaura o prazo anterior do contexto"""
+        _prazo_atual.reset(token)
+
+
+_duracao_etapas = metricas.histograma(
+    "apbia_etapa_duracao_segundos",
+    "Duração de cada etapa do processamento (ex.: processar_mensagem)"
+)
+
+_prazo_atual: ContextVar[Optional[Prazo]] = ContextVar("prazo_atual", default=None)
+
+
+def prazo_atual() -> Optional[Prazo]:
+    """Prazo da requisição em andamento no contexto atual, se houver"""
+    return _prazo_atual.get()
+
+
+def verificar_prazo(etapa: str):
+    """Falha cedo se o prazo da requisição atual já acabou"""
+    prazo = _prazo_atual.get()
+    if prazo is not None:
+        prazo.verificar(etapa)
+
+
+def limitar_requisicao_http(requisicao):
+    """
+    Hook de requisição do httpx: a chamada não passa do prazo atual
+
+    Cada fase (conexão, leitura, escrita, pool) fica limitada ao que resta
+    do prazo, então uma consulta ou download travado termina junto com ele.
+    Sem tempo restante nem chega a enviar a requisição.
+    """
+    prazo = _prazo_atual.get()
+    if prazo is None:
+        return
+
+    prazo.verificar(f"http:{requisicao.url.path}")
+    restante = prazo.restante()
+    timeout = dict(requisicao.extensions.get("timeout") or {})
+    for fase in ("connect", "read", "write", "pool"):
+        atual = timeout.get(fase)
+        timeout[fase] = restante if atual is None else min(atual, restante)
+    requisicao.extensions["timeout"] = timeout
@@ -0,0 +1,254 @@
+"""
+Série temporal de uso da API em arrays compactos (minuto, hora e dia)
+"""
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Dict, Optional
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows: sem trava entre processos
+    fcntl = None
+
+
+# Limites superiores (segundos) das faixas do histograma de latência; a última é aberta
+FAIXAS_LATENCIA = np.array([0.25, 0.5, 1, 2, 3, 5, 7.5, 10, 15, 20, 30, 45, 60, 90, 120, np.inf])
+
+
+def deslocamento_local(instante: float) -> int:
+    """Diferença (segundos) do horário local para UTC no instante dado, com horário de verão"""
+    return time.localtime(instante).tm_gmtoff
+
+
+class Resolucao:
+    """Baldes circulares de uma resolução (ex.: 2 dias de minutos)"""
+
+    def __init__(self, nome: str, segundos: int, tamanho: int):
+        self.nome = nome
+        self.segundos = segundos
+        self.tamanho = tamanho
+
+        # Período (índice absoluto) guardado em cada posição; -1 = vazio
+        self.periodos = np.full(tamanho, -1, dtype=np.int64)
+        self.requisicoes = np.zeros(tamanho, dtype=np.int64)
+        self.tokens = np.zeros(tamanho, dtype=np.int64)
+        self.erros = np.zeros(tamanho, dtype=np.int64)
+        self.latencias = np.zeros((tamanho, len(FAIXAS_LATENCIA)), dtype=np.int32)
+
+    def vazia_como(self) -> 'Resolucao':
+        return Resolucao(self.nome, self.segundos, self.tamanho)
+
+    def posicao(self, periodo: int) -> Optional[int]:
+        """
+        Posição do período, zerando o balde se ele guardava um período antigo
+
+        Returns:
+            None se o período já saiu da retenção (o balde guarda um mais novo)
+        """
+        i = periodo % self.tamanho
+        if self.periodos[i] > periodo:
+            return None
+        if self.periodos[i] != periodo:
+            self.periodos[i] = periodo
+            self.requisicoes[i] = 0
+            self.tokens[i] = 0
+            self.erros[i] = 0
+            self.latencias[i] = 0
+        return i
+
+    def mesclar(self, outra: 'Resolucao'):
+        """Soma os baldes de `outra` (mesma posição e período); períodos mais novos substituem"""
+        mesmo = self.periodos == outra.periodos
+        novo = outra.periodos > self.periodos
+
+        self.requisicoes = np.where(mesmo, self.requisicoes + outra.requisicoes, np.where(novo, outra.requisicoes, self.requisicoes))
+        self.tokens = np.where(mesmo, self.tokens + outra.tokens, np.where(novo, outra.tokens, self.tokens))
+        self.erros = np.where(mesmo, self.erros + outra.erros, np.where(novo, outra.erros, self.erros))
+        self.latencias = np.where(
+            mesmo[:, None], self.latencias + outra.latencias,
+            np.where(novo[:, None], outra.latencias, self.latencias)
+        ).astype(np.int32)
+        self.periodos = np.maximum(self.periodos, outra.periodos)
+
+    def mascara(self, inicio: float, fim: float) -> np.ndarray:
+        """Baldes cujo período está em [inicio, fim]"""
+        return (self.periodos >= int(inicio // self.segundos)) & (self.periodos <= int(fim // self.segundos))
+
+    def para_dict(self) -> Dict[str, np.ndarray]:
+        return {
+            f"{self.nome}_periodos": self.periodos,
+            f"{self.nome}_requisicoes": self.requisicoes,
+            f"{self.nome}_tokens": self.tokens,
+            f"{self.nome}_erros": self.erros,
+            f"{self.nome}_latencias": self.latencias
+        }
+
+    def carregar_dict(self, dados) -> bool:
+        if f"{self.nome}_periodos" not in dados or len(dados[f"{self.nome}_periodos"]) != self.tamanho:
+            return False
+        self.periodos = dados[f"{self.nome}_periodos"].copy()
+        self.requisicoes = dados[f"{self.nome}_requisicoes"].copy()
+        self.tokens = dados[f"{self.nome}_tokens"].copy()
+        self.erros = dados[f"{self.nome}_erros"].copy()
+        self.latencias = dados[f"{self.nome}_latencias"].copy()
+        return True
+
+
+class SerieUso:
+    """
+    Uso da API por minuto (2 dias), hora (90 dias) e dia (2 anos)
+
+    Cada evento entra nas três resoluções; consultas usam a mais fina que
+    cobre o período e agregam com numpy. A persistência grava só o que
+    mudou desde a última gravação, somando ao arquivo sob trava, para que
+    vários workers compartilhem a mesma série.
+    """
+
+    def __init__(self, caminho: Optional[Path] = None,
+                 fuso: Callable[[float], int] = deslocamento_local):
+        self.caminho = Path(caminho) if caminho else None
+        # Horário local: os baldes de dia seguem o calendário do servidor. O
+        # deslocamento é calculado a cada instante, então uma troca de horário
+        # de verão não desalinha os baldes até o próximo reinício
+        self.fuso = fuso
+
+        self.resolucoes = [
+            Resolucao("minuto", 60, 2 * 24 * 60),
+            Resolucao("hora", 3600, 90 * 24),
+            Resolucao("dia", 86400, 2 * 366)
+        ]
+        # Alterações ainda não gravadas no arquivo
+        self._pendentes = [r.vazia_como() for r in self.resolucoes]
+        self._lock = threading.Lock()
+
+        self._carregar()
+
+    def registrar(self, requisicoes: int = 0, tokens: int = 0, erros: int = 0,
+                  latencia: Optional[float] = None, agora: Optional[float] = None):
+        """Soma um evento de uso aos baldes do instante atual"""
+        instante = self._local(time.time() if agora is None else agora)
+        faixa = int(np.searchsorted(FAIXAS_LATENCIA, latencia)) if latencia is not None else None
+
+        with self._lock:
+            for resolucao in (*self.resolucoes, *self._pendentes):
+                i = resolucao.posicao(int(instante // resolucao.segundos))
+                if i is None:
+                    continue
+                resolucao.requisicoes[i] += requisicoes
+                resolucao.tokens[i] += tokens
+                resolucao.erros[i] += erros
+                if faixa is not None:
+                    resolucao.latencias[i, faixa] += 1
+
+    def estatisticas(self, segundos: float, agora: Optional[float] = None) -> Dict:
+        """
+        Agrega o uso dos últimos `segundos`
+
+        Returns:
+            Totais, picos por minuto/hora/dia (None onde a resolução não
+            serve ao período) e percentis de latência
+        """
+        agora = time.time() if agora is None else agora
+        fim = self._local(agora)
+        inicio = self._local(agora - segundos)
+
+        with self._lock:
+            # Resolução mais fina que ainda guarda o período inteiro
+            base = next(
+                (r for r in self.resolucoes if r.tamanho * r.segundos >= segundos),
+                self.resolucoes[-1]
+            )
+            mascara = base.mascara(inicio, fim)
+            requisicoes = int(base.requisicoes[mascara].sum())
+            tokens = int(base.tokens[mascara].sum())
+            erros = int(base.erros[mascara].sum())
+            histograma = base.latencias[mascara].sum(axis=0)
+
+            # Picos só nas resoluções que cabem no período e ainda guardam o
+            # período inteiro (None nas demais: um pico parcial enganaria)
+            picos = {}
+            for resolucao in self.resolucoes:
+                chave = f"pico_requisicoes_{resolucao.nome}"
+                if resolucao.segundos > segundos or resolucao.tamanho * resolucao.segundos < segundos:
+                    picos[chave] = None
+                    continue
+                mascara_r = resolucao.mascara(inicio, fim)
+                picos[chave] = int(resolucao.requisicoes[mascara_r].max()) if mascara_r.any() else 0
+
+        return {
+            'resolucao': base.nome,
+            'total_requisicoes': requisicoes,
+            'total_tokens': tokens,
+            'total_erros': erros,
+            'taxa_erro': round(erros / requisicoes, 4) if requisicoes else 0.0,
+            **picos,
+            'latencia_segundos': {
+                'p50': self._percentil(histograma, 50),
+                'p95': self._percentil(histograma, 95),
+                'p99': self._percentil(histograma, 99),
+                'amostras': int(histograma.sum())
+            }
+        }
+
+    def _local(self, instante: float) -> float:
+        """Instante (UTC) convertido para a linha do tempo local dos baldes"""
+        return instante + self.fuso(instante)
+
+    @staticmethod
+    def _percentil(histograma: np.ndarray, percentil: float) -> Optional[float]:
+        """Percentil aproximado pelo limite superior da faixa do histograma"""
+        total = histograma.sum()
+        if total == 0:
+            return None
+        faixa = int(np.searchsorted(np.cumsum(histograma), total * percentil / 100))
+        limite = FAIXAS_LATENCIA[min(faixa, len(FAIXAS_LATENCIA) - 1)]
+        return float(limite) if np.isfinite(limite) else float(FAIXAS_LATENCIA[-2])
+
+    def salvar(self):
+        """Grava as alterações pendentes, somando-as ao que outros processos gravaram"""
+        if self.caminho is None:
+            return
+
+        with self._lock:
+            pendentes = self._pendentes
+            self._pendentes = [r.vazia_como() for r in self.resolucoes]
+
+        if all((p.periodos < 0).all() for p in pendentes):
+            return
+
+        self.caminho.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.caminho.with_suffix(".lock"), "w") as trava:
+            if fcntl:
+                fcntl.flock(trava, fcntl.LOCK_EX)
+
+            gravadas = [r.vazia_como() for r in self.resolucoes]
+            if self.caminho.exists():
+                with np.load(self.caminho) as dados:
+                    for resolucao in gravadas:
+                        resolucao.carregar_dict(dados)
+
+            for gravada, pendente in zip(gravadas, pendentes):
+                gravada.mesclar(pendente)
+
+            temporario = self.caminho.with_suffix(".tmp.npz")
+            np.savez_compressed(temporario, **{k: v for r in gravadas for k, v in r.para_dict().items()})
+            os.replace(temporario, self.caminho)
+
+        # A visão local passa a ser a série completa (+ o que chegou durante a gravação)
+        with self._lock:
+            for gravada, pendente in zip(gravadas, self._pendentes):
+                gravada.mesclar(pendente)
+            self.resolucoes = gravadas
+
+    def _carregar(self):
+        """Carrega a série gravada (se houver)"""
+        if self.caminho is None or not self.caminho.exists():
+            return
+
+        with np.load(self.caminho) as dados:
+            for resolucao in self.resolucoes:
+                resolucao.carregar_dict(dados)
@@ -28,4 +28,50 @@ BEGIN
   INNER JOIN orientadores_projetos op ON u.id = op.orientador_id
   WHERE op.projeto_id = p_projeto_id;
 END;
-$$ LANGUAGE plpgsql;
\ No newline at end of file
+$$ LANGUAGE plpgsql;
+
+-- Índice para contar mensagens e achar a última de cada chat sem ler a tabela
+CREATE INDEX IF NOT EXISTS idx_mensagens_chat_data ON mensagens(chat_id, data_envio DESC);
+
+-- Índice da paginação de chats de um projeto por (data_criacao, id)
+CREATE INDEX IF NOT EXISTS idx_chats_projeto_criacao ON chats(projeto_id, data_criacao DESC, id DESC);
+
+-- Chats com total de mensagens e última atividade (listagens numa única consulta)
+CREATE OR REPLACE VIEW chats_resumo WITH (security_invoker = true) AS
+SELECT
+  c.*,
+  r.total_mensagens,
+  r.ultima_mensagem_em,
+  COALESCE(r.ultima_mensagem_em, c.data_criacao) AS ultima_atividade
+FROM chats c
+CROSS JOIN LATERAL (
+  SELECT COUNT(*) AS total_mensagens, MAX(m.data_envio) AS ultima_mensagem_em
+  FROM mensagens m
+  WHERE m.chat_id = c.id
+) r;
+
+-- Prévia do conteúdo da mensagem (coluna calculada: select=id,previa)
+CREATE OR REPLACE FUNCTION previa(mensagens)
+RETURNS text AS $$
+  SELECT left($1.conteudo, 200);
+$$ LANGUAGE sql STABLE;
+
+-- Estimativa de tokens da troca, gravada na resposta da IA
+ALTER TABLE mensagens ADD COLUMN IF NOT EXISTS tokens integer;
+
+-- Grava pergunta e resposta numa única transação (as duas ou nenhuma)
+CREATE OR REPLACE FUNCTION salvar_troca(
+  p_chat_id bigint,
+  p_usuario_id bigint,
+  p_pergunta text,
+  p_pergunta_em timestamptz,
+  p_resposta text,
+  p_tokens integer
+)
+RETURNS SETOF mensagens AS $$
+  INSERT INTO mensagens (chat_id, usuario_id, conteudo, e_nota_orientador, data_envio, tokens)
+  VALUES
+    (p_chat_id, p_usuario_id, p_pergunta, false, p_pergunta_em, NULL),
+    (p_chat_id, NULL, p_resposta, false, clock_timestamp(), p_tokens)
+  RETURNING *;
+$$ LANGUAGE sql VOLATILE;
@@ -29,6 +29,7 @@ CREATE TABLE public.mensagens (
   conteudo text NOT NULL,
   e_nota_orientador boolean DEFAULT false,
   data_envio timestamp with time zone DEFAULT CURRENT_TIMESTAMP,
+  tokens integer,
   CONSTRAINT mensagens_pkey PRIMARY KEY (id),
   CONSTRAINT mensagens_chat_id_fkey FOREIGN KEY (chat_id) REFERENCES public.chats(id),
   CONSTRAINT mensagens_usuario_id_fkey FOREIGN KEY (usuario_id) REFERENCES public.usuarios(id)
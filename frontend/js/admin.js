@@ -223,13 +223,21 @@ async function carregarStatusAPI() {
                             <div class="w-full bg-gray-200 rounded-full h-2">
                                 <div class="bg-purple-600 h-2 rounded-full" style="width: ${Math.min(status.uso_percentual || 0, 100)}%"></div>
                             </div>
-                            <p class="text-xs text-gray-500 mt-1">${(status.uso_percentual || 0).toFixed(1)}% do limite mensal</p>
+                            <p class="text-xs text-gray-500 mt-1">${(status.uso_percentual || 0).toFixed(1)}% do limite mensal${status.limite_mensal ? ` (${status.limite_mensal} requisições)` : ''}</p>
                         </div>
+                        ${status.previsao ? `
+                            <div class="text-sm text-gray-600 space-y-1">
+                                <p>Previsão para o mês: <span class="font-semibold">${status.previsao.consumo_previsto_mes}</span> requisições (${status.previsao.taxa_recente_hora}/h nas últimas 24h)</p>
+                                ${status.previsao.esgotamento_previsto ? `
+                                    <p>No ritmo atual, o limite acaba em <span class="font-semibold">${formatDate(status.previsao.esgotamento_previsto)}</span></p>
+                                ` : ''}
+                            </div>
+                        ` : ''}
                         ${status.throttling_ativo ? `
                             <div class="bg-yellow-50 border border-yellow-200 rounded p-3">
                                 <p class="text-sm text-yellow-800">
                                     <i class="fas fa-exclamation-triangle mr-1"></i>
-                                    Throttling ativo - Sistema operando com delay
+                                    Ritmo reduzido - 1 requisição a cada ${status.previsao?.intervalo_segundos ?? '?'}s para o limite durar até ${status.previsao ? formatDate(status.previsao.periodo_ate) : 'o fim do mês'}
                                 </p>
                             </div>
                         ` : ''}
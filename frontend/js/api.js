@@ -3,6 +3,26 @@
  */
 
 const API_BASE_URL = 'http://localhost:5000/api';
+const MAX_TENTATIVAS_RATE_LIMIT = 3;
+
+/**
+ * Espera antes de tentar de novo, conforme as dicas de backoff do servidor
+ */
+function esperarBackoff(backoff, tentativa, signal) {
+    const base = backoff.base_segundos * Math.pow(backoff.fator, tentativa);
+    let segundos = Math.min(base, backoff.max_segundos);
+    if (backoff.jitter) {
+        segundos += Math.random() * backoff.base_segundos;
+    }
+
+    return new Promise((resolve, reject) => {
+        const timer = setTimeout(resolve, segundos * 1000);
+        signal.addEventListener('abort', () => {
+            clearTimeout(timer);
+            reject(new DOMException('Aborted', 'AbortError'));
+        }, { once: true });
+    });
+}
 
 /**
  * Classe para fazer requisições à API
@@ -10,6 +30,7 @@ const API_BASE_URL = 'http://localhost:5000/api';
 class APIClient {
     constructor(baseURL = API_BASE_URL) {
         this.baseURL = baseURL;
+        this.geracaoAtual = null;
     }
 
     /**
@@ -150,12 +171,14 @@ class APIClient {
         return this.get(`/chat/${chatId}?incluir_mensagens=${incluirMensagens}`);
     }
 
-    async listarChatsProjeto(projetoId) {
-        return this.get(`/chat/projeto/${projetoId}`);
+    async listarChatsProjeto(projetoId, cursor = null) {
+        const query = cursor ? `?cursor=${encodeURIComponent(cursor)}` : '';
+        return this.get(`/chat/projeto/${projetoId}${query}`);
     }
 
-    async listarMensagensChat(chatId, limit = 100) {
-        return this.get(`/chat/${chatId}/mensagens?limit=${limit}`);
+    async listarMensagensChat(chatId, limit = 100, cursor = null) {
+        const query = cursor ? `&cursor=${encodeURIComponent(cursor)}` : '';
+        return this.get(`/chat/${chatId}/mensagens?limit=${limit}${query}`);
     }
 
     async deletarChat(chatId) {
@@ -164,12 +187,85 @@ class APIClient {
 
     // ==================== IA ====================
 
+    /**
+     * Envia mensagem pela rota com streaming (Server-Sent Events)
+     * Abortar a conexão (reenvio, aba fechada) cancela a geração no servidor
+     */
     async enviarMensagem(chatId, conteudo, usarThinking = false) {
-        return this.post('/ia/mensagem', { 
-            chat_id: chatId, 
-            conteudo, 
-            usar_thinking: usarThinking 
-        });
+        // Mensagem reenviada: desiste da geração anterior
+        if (this.geracaoAtual) {
+            this.geracaoAtual.abort();
+        }
+
+        const controller = new AbortController();
+        this.geracaoAtual = controller;
+
+        try {
+            let response;
+
+            // Limite por minuto atingido (429): espera o Retry-After, com backoff exponencial e jitter
+            for (let tentativa = 0; ; tentativa++) {
+                response = await fetch(`${this.baseURL}/ia/mensagem/stream`, {
+                    method: 'POST',
+                    headers: this.getHeaders(),
+                    body: JSON.stringify({
+                        chat_id: chatId,
+                        conteudo,
+                        usar_thinking: usarThinking
+                    }),
+                    signal: controller.signal
+                });
+
+                if (response.status !== 429 || tentativa >= MAX_TENTATIVAS_RATE_LIMIT) break;
+
+                const data = await response.clone().json();
+                if (data.error !== 'Rate limit exceeded' || !data.data || !data.data.backoff) break;
+
+                await esperarBackoff(data.data.backoff, tentativa, controller.signal);
+            }
+
+            if (!response.ok) {
+                const data = await response.json();
+                throw new Error(data.message || 'Erro na requisição');
+            }
+
+            // Lê os eventos até chegar o resultado (as demais linhas são keep-alives)
+            const reader = response.body.getReader();
+            const decoder = new TextDecoder();
+            let buffer = '';
+
+            while (true) {
+                const { done, value } = await reader.read();
+                if (done) break;
+
+                buffer += decoder.decode(value, { stream: true });
+                const eventos = buffer.split('\n\n');
+                buffer = eventos.pop();
+
+                for (const evento of eventos) {
+                    if (evento.startsWith('event: resultado')) {
+                        const linhaDados = evento.split('\n').find(l => l.startsWith('data: '));
+                        return JSON.parse(linhaDados.slice(6));
+                    }
+                }
+            }
+
+            throw new Error('Conexão encerrada sem resposta');
+        } catch (error) {
+            console.error('Erro ao enviar mensagem:', error);
+            throw error;
+        } finally {
+            if (this.geracaoAtual === controller) {
+                this.geracaoAtual = null;
+            }
+        }
+    }
+
+    async cancelarGeracao(chatId) {
+        if (this.geracaoAtual) {
+            this.geracaoAtual.abort();
+        }
+        return this.post('/ia/cancelar', { chat_id: chatId });
     }
 
     async adicionarNotaOrientador(mensagemId, nota) {
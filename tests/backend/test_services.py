@@ -0,0 +1,1542 @@
+"""
+Testes dos serviços do backend
+
+Executar a partir da raiz do projeto: python -m pytest tests/backend
+"""
+import json
+import os
+import re
+import sys
+import threading
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', '..', 'backend', 'python'))
+
+from config.settings import settings  # noqa: E402,F401 - inicializa os pacotes na ordem da aplicação
+from services.concorrencia_service import CapacidadeEsgotadaError, LimiteConcorrencia  # noqa: E402
+from utils.estado_compartilhado import EstadoMemoria, EstadoSQLite  # noqa: E402
+from utils.janela_deslizante import JanelaDeslizante  # noqa: E402
+
+
+class RelogioFalso:
+    """Relógio monotônico controlado pelo teste"""
+
+    def __init__(self, inicio: float = 1000.0):
+        self.agora = inicio
+
+    def __call__(self) -> float:
+        return self.agora
+
+
+# ==================== JANELA DESLIZANTE ====================
+
+def test_janela_conta_apenas_o_ultimo_minuto():
+    relogio = RelogioFalso()
+    janela = JanelaDeslizante(segundos=60, baldes=60, relogio=relogio)
+
+    janela.registrar()
+    relogio.agora += 30
+    janela.registrar(2)
+    assert janela.contar() == 3
+
+    relogio.agora += 31
+    assert janela.contar() == 2
+
+    relogio.agora += 120
+    assert janela.contar() == 0
+
+
+def _custo_por_operacao(requisicoes_por_minuto: int, operacoes: int = 20000) -> float:
+    """Tempo médio de registrar + contar com a janela já carregada"""
+    relogio = RelogioFalso()
+    janela = JanelaDeslizante(segundos=60, baldes=60, relogio=relogio)
+    passo = 60 / requisicoes_por_minuto
+
+    # Enche a janela com um minuto de requisições
+    for _ in range(requisicoes_por_minuto):
+        relogio.agora += passo
+        janela.registrar()
+
+    inicio = time.perf_counter()
+    for _ in range(operacoes):
+        relogio.agora += passo
+        janela.registrar()
+        janela.contar()
+    return (time.perf_counter() - inicio) / operacoes
+
+
+def test_janela_custo_constante_com_milhares_de_requisicoes():
+    """Micro-benchmark: o custo por requisição não cresce com a carga"""
+    custo_baixo = _custo_por_operacao(100)
+    custo_alto = _custo_por_operacao(100000)
+
+    # 1000x mais carga: um custo proporcional ao tamanho da janela passaria de 3x com folga
+    razao = custo_alto / custo_baixo
+    assert razao < 3, f"100 req/min: {custo_baixo * 1e6:.2f}µs | 100000 req/min: {custo_alto * 1e6:.2f}µs"
+
+
+# ==================== MONITOR DA API ====================
+
+class ConfigFalsa:
+    """Imita o SistemaConfigDAO em memória e guarda cada gravação"""
+
+    def __init__(self, valores=None):
+        self.valores = dict(valores or {})
+        self.gravacoes = []
+        self.falhar = False
+
+    def ler(self, chave):
+        return self.valores.get(chave)
+
+    def gravar(self, chave, valor):
+        if self.falhar:
+            raise ConnectionError("banco indisponível")
+        self.valores[chave] = valor
+        self.gravacoes.append(json.loads(valor))
+
+
+def _monitor_sem_banco(estado, config_dao=None):
+    """Monitor com o estado informado e sem leitura/gravação no Supabase"""
+    from services.api_monitor_service import APIMonitorService
+    from utils.serie_temporal import SerieUso
+
+    return APIMonitorService(estado=estado, serie=SerieUso(), config_dao=config_dao or ConfigFalsa())
+
+
+def _esperar(condicao, segundos=2.0):
+    """Espera a condição ficar verdadeira (trabalho de uma thread de fundo)"""
+    limite = time.monotonic() + segundos
+    while not condicao():
+        if time.monotonic() > limite:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def test_monitor_so_inicia_a_persistencia_na_primeira_alteracao(monkeypatch):
+    modulo = sys.modules["services.api_monitor_service"]
+    hooks = []
+    monkeypatch.setattr(modulo.atexit, "register", hooks.append)
+    config = ConfigFalsa({"api_monitor_state": json.dumps({"requisicoes_total": 7, "requisicoes_mes": 3})})
+
+    monitor = _monitor_sem_banco(EstadoMemoria(), config)
+    assert monitor.uso_atual['requisicoes_total'] == 7
+    assert hooks == [] and monitor._persistencia is None
+
+    monitor.registrar_cancelamento()
+    assert hooks == [monitor.encerrar]
+    monitor.registrar_cancelamento()
+    assert hooks == [monitor.encerrar]
+    monitor.encerrar()
+
+
+def test_monitor_grava_quando_o_lote_enche_e_no_intervalo(monkeypatch):
+    modulo = sys.modules["services.api_monitor_service"]
+    monkeypatch.setattr(modulo.atexit, "register", lambda funcao: None)
+    config = ConfigFalsa()
+    monitor = _monitor_sem_banco(EstadoMemoria(), config)
+    monitor.flush_max_pendentes = 3
+    monitor.flush_intervalo = 60
+
+    # Abaixo do lote nada é gravado; a 3ª alteração acorda a thread
+    monitor.registrar_requisicao(tokens=1)
+    monitor.registrar_requisicao(tokens=1)
+    assert not _esperar(lambda: config.gravacoes, 0.2)
+    monitor.registrar_requisicao(tokens=1)
+    assert _esperar(lambda: len(config.gravacoes) == 1)
+    assert config.gravacoes[-1]['requisicoes_total'] == 3
+
+    # Com o lote longe de encher, o intervalo é que grava
+    monitor.flush_intervalo = 0.05
+    monitor._acordar_persistencia.set()  # Recomeça a espera já com o novo intervalo
+    monitor.registrar_requisicao(tokens=1)
+    assert _esperar(lambda: config.gravacoes[-1]['requisicoes_total'] == 4)
+    monitor.encerrar()
+
+
+def test_monitor_grava_na_hora_e_no_encerramento(monkeypatch):
+    modulo = sys.modules["services.api_monitor_service"]
+    hooks = []
+    monkeypatch.setattr(modulo.atexit, "register", hooks.append)
+    config = ConfigFalsa()
+    monitor = _monitor_sem_banco(EstadoMemoria(), config)
+    monitor.flush_intervalo = 60
+
+    # Mudança de estado do sistema: gravada antes de retornar
+    monitor.desativar_sistema()
+    assert len(config.gravacoes) == 1 and config.gravacoes[0]['sistema_ativo'] is False
+
+    # Falha na gravação: as alterações ficam pendentes para a próxima
+    config.falhar = True
+    monitor.registrar_requisicao(tokens=5)
+    monitor.salvar_pendentes()
+    assert monitor._alteracoes_pendentes == 1
+
+    # O hook de saída grava o que ficou pendente e para a thread
+    config.falhar = False
+    hooks[0]()
+    assert config.gravacoes[-1]['tokens_usados'] == 5
+    assert monitor._alteracoes_pendentes == 0
+    monitor._persistencia.join(2)
+    assert not monitor._persistencia.is_alive()
+
+
+@pytest.mark.parametrize("backend", ["memoria", "sqlite"])
+def test_monitor_nao_perde_incrementos_com_leituras_concorrentes(backend, tmp_path):
+    """Stress: escritas e relatórios simultâneos em várias threads"""
+    estado = EstadoMemoria() if backend == "memoria" else EstadoSQLite(tmp_path / "estado.db")
+    monitor = _monitor_sem_banco(estado)
+    monitor.limite_requisicoes_minuto = 10 ** 6
+
+    threads_escrita, por_thread = 8, 250
+    parar = threading.Event()
+    erros = []
+
+    def escrever():
+        for _ in range(por_thread):
+            monitor.registrar_requisicao(tokens=3)
+
+    def ler():
+        while not parar.is_set():
+            try:
+                relatorio = monitor.obter_relatorio()
+                assert relatorio['tokens_usados'] <= 3 * relatorio['requisicoes_total'] + 3 * threads_escrita
+            except Exception as e:  # noqa: BLE001 - reportado na thread principal
+                erros.append(e)
+                return
+
+    leitores = [threading.Thread(target=ler) for _ in range(2)]
+    escritores = [threading.Thread(target=escrever) for _ in range(threads_escrita)]
+    for thread in leitores + escritores:
+        thread.start()
+    for thread in escritores:
+        thread.join()
+    parar.set()
+    for thread in leitores:
+        thread.join()
+
+    total = threads_escrita * por_thread
+    uso = monitor.uso_atual
+    assert not erros
+    assert uso['requisicoes_total'] == total
+    assert uso['requisicoes_mes'] == total
+    assert uso['tokens_usados'] == 3 * total
+    assert estado.contar_eventos('requisicoes') == total
+
+
+def test_relatorio_nao_altera_o_estado():
+    monitor = _monitor_sem_banco(EstadoMemoria())
+    monitor.estado.definir('requisicoes_mes', 1500)
+
+    relatorio = monitor.obter_relatorio()
+    assert relatorio['uso_percentual'] == 100
+    assert monitor.uso_atual['sistema_ativo'] is True
+    assert monitor.uso_atual['throttling_ativo'] is False
+
+    # O limite é aplicado no caminho de escrita, uma única vez
+    monitor.registrar_requisicao()
+    assert monitor.uso_atual['sistema_ativo'] is False
+    assert monitor.uso_atual['throttling_ativo'] is True
+
+
+def test_virada_do_mes_zera_contador_e_reativa_o_sistema():
+    monitor = _monitor_sem_banco(EstadoMemoria())
+    monitor.estado.definir('mes_referencia', 202001)
+    monitor.estado.definir('requisicoes_mes', monitor.limite_mensal)
+    monitor.estado.definir('sistema_ativo', 0)
+    monitor.estado.definir('desativado_por_limite', 1)
+
+    reserva, _, _ = monitor.reservar_requisicao()
+
+    assert reserva is not None
+    assert monitor.uso_atual['requisicoes_mes'] == 0
+    assert monitor.estado.obter('mes_referencia') > 202001
+
+
+def test_ritmo_reduzido_quando_a_previsao_passa_do_orcamento():
+    monitor = _monitor_sem_banco(EstadoMemoria())
+    monitor.limite_mensal = 1000
+    monitor.rajada_ritmo = 3
+    monitor.estado.definir('requisicoes_mes', 900)
+    monitor.serie.registrar(requisicoes=900)  # Todo o uso do mês agora: vai faltar saldo
+
+    previsao = monitor.obter_previsao()
+    assert previsao['ritmo_reduzido']
+    assert previsao['consumo_previsto_mes'] > 1000
+    assert previsao['esgotamento_previsto'] is not None
+
+    # Passam a rajada + 1; a seguinte espera cerca de um intervalo
+    for _ in range(monitor.rajada_ritmo + 1):
+        reserva, _, _ = monitor.reservar_requisicao()
+        assert reserva is not None
+        monitor.registrar_requisicao(reserva=reserva)
+    reserva, _, retry_after = monitor.reservar_requisicao()
+    assert reserva is None
+    assert retry_after >= previsao['intervalo_segundos'] * 0.9
+    assert monitor.uso_atual['throttling_ativo'] is True
+
+
+def _reserva_livre(estado=None):
+    """Vaga no rate limit reservada num estado à parte (para testes do controller)"""
+    from services.api_monitor_service import ReservaRequisicao
+
+    estado = estado or EstadoMemoria()
+    return ReservaRequisicao(estado, estado.reservar_evento('requisicoes', 10 ** 6))
+
+
+@pytest.mark.parametrize("backend", ["memoria", "sqlite"])
+def test_rajada_simultanea_nao_passa_do_limite_por_minuto(backend, tmp_path):
+    """A vaga é reservada na admissão: requisições concorrentes não passam pela mesma contagem"""
+    estado = EstadoMemoria() if backend == "memoria" else EstadoSQLite(tmp_path / "estado.db")
+    # Dois "workers" com o mesmo estado compartilhado
+    monitores = [_monitor_sem_banco(estado), _monitor_sem_banco(estado)]
+    for monitor in monitores:
+        monitor.limite_requisicoes_minuto = 10
+
+    inicio = threading.Barrier(16)
+    admitidas = []
+
+    def admitir(monitor):
+        inicio.wait()
+        reserva, _, _ = monitor.reservar_requisicao()
+        if reserva is not None:
+            admitidas.append(reserva)
+
+    threads = [threading.Thread(target=admitir, args=(monitores[i % 2],)) for i in range(16)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(admitidas) == 10
+    assert estado.contar_eventos('requisicoes') == 10
+
+
+def test_reserva_liberada_devolve_a_vaga_e_confirmada_nao_conta_duas_vezes():
+    monitor = _monitor_sem_banco(EstadoMemoria())
+    monitor.limite_requisicoes_minuto = 2
+
+    primeira, _, _ = monitor.reservar_requisicao()
+    segunda, _, _ = monitor.reservar_requisicao()
+    reserva, _, retry_after = monitor.reservar_requisicao()
+    assert reserva is None and retry_after >= 1
+
+    # Chamada ao Gemini falhou: a vaga volta (liberar de novo não devolve outra)
+    segunda.liberar()
+    segunda.liberar()
+    assert monitor.estado.contar_eventos('requisicoes') == 1
+
+    # Requisição feita: a vaga da admissão é a que conta na janela
+    monitor.registrar_requisicao(reserva=primeira)
+    primeira.liberar()
+    assert monitor.estado.contar_eventos('requisicoes') == 1
+    assert monitor.uso_atual['requisicoes_total'] == 1
+
+
+# ==================== POOL DE CHAVES ====================
+
+def _pool(chaves=("chave-a", "chave-b", "chave-c"), limite=5, estado=None):
+    from services.chaves_gemini_service import PoolChavesGemini
+
+    pool = PoolChavesGemini(list(chaves), estado=estado or EstadoMemoria())
+    pool.limite_por_chave = limite
+    return pool
+
+
+def test_pool_escolhe_a_chave_menos_carregada():
+    pool = _pool()
+    pool.estado.registrar_evento(pool.chaves[0].evento_requisicoes, 3)
+    pool.estado.registrar_evento(pool.chaves[1].evento_requisicoes, 1)
+
+    assert pool.adquirir().id == "chave_3"
+    assert pool.adquirir().id in ("chave_2", "chave_3")
+
+    # Enchendo o pool, a carga fica igual entre as chaves
+    while pool.adquirir() is not None:
+        pass
+    uso = {chave['id']: chave['requisicoes_ultimo_minuto'] for chave in pool.obter_relatorio()}
+    assert uso == {"chave_1": 5, "chave_2": 5, "chave_3": 5}
+
+
+def test_pool_afasta_a_chave_apos_429_e_5xx(monkeypatch):
+    modulo = sys.modules["services.chaves_gemini_service"]
+    relogio = RelogioFalso(1_700_000_000.0)
+    monkeypatch.setattr(modulo.time, "time", relogio)
+    pool = _pool(chaves=("chave-a", "chave-b"), limite=100)
+    cota, servidor = pool.chaves
+
+    pool.registrar_erro_cota(cota)
+    pool.registrar_erro_servidor(servidor)
+    assert pool.adquirir() is None
+    assert pool.segundos_ate_chave_livre() == pytest.approx(pool.cooldown_erro_servidor_segundos)
+
+    # O cooldown de 5xx é curto; o de cota não é encurtado por um 5xx depois dele
+    relogio.agora += pool.cooldown_erro_servidor_segundos
+    pool.registrar_erro_servidor(cota)
+    assert {pool.adquirir().id for _ in range(5)} == {"chave_2"}
+
+    relogio.agora += pool.cooldown_segundos
+    assert pool.adquirir().id == "chave_1"
+    relatorio = {chave['id']: chave for chave in pool.obter_relatorio()}
+    assert relatorio['chave_1']['erros_cota'] == 1 and relatorio['chave_1']['erros_servidor'] == 1
+    assert not relatorio['chave_1']['em_cooldown']
+
+
+def test_gemini_repete_com_outra_chave_e_recusa_com_429_sem_chave(monkeypatch):
+    from google.api_core.exceptions import TooManyRequests
+    from services.gemini_service import gemini_service
+
+    pool = _pool(chaves=("chave-a", "chave-b"), limite=2)
+    monkeypatch.setattr(gemini_service, "pool", pool)
+    monkeypatch.setattr(gemini_service, "clientes", {"chave_1": "cliente_a", "chave_2": "cliente_b"})
+    usados = []
+
+    def chamada(cliente):
+        usados.append(cliente)
+        if cliente == "cliente_a":
+            raise TooManyRequests("cota da chave esgotada")
+        return "ok"
+
+    # A primeira chave devolve 429: sai do pool e a chamada vai para a outra
+    assert gemini_service._executar(chamada) == "ok"
+    assert usados == ["cliente_a", "cliente_b"]
+    assert gemini_service._executar(chamada) == "ok"
+
+    # Única chave fora de cooldown no limite por minuto: 429 com o tempo até liberar
+    with pytest.raises(CapacidadeEsgotadaError) as erro:
+        gemini_service._executar(chamada)
+    assert 1 <= erro.value.retry_after <= 60
+    assert erro.value.limite == 4
+    with pytest.raises(CapacidadeEsgotadaError):
+        gemini_service.gerar_resposta("Oi", [], [])
+
+
+def test_janelas_por_chave_compartilhadas_entre_workers(tmp_path):
+    from services.chaves_gemini_service import PoolChavesGemini
+
+    estado = EstadoSQLite(tmp_path / "estado.db")
+    pools = [PoolChavesGemini(["chave-a", "chave-b"], estado=estado) for _ in range(2)]
+    for pool in pools:
+        pool.limite_por_chave = 2
+
+    # Quatro vagas no total (2 chaves x 2), somando os dois workers
+    adquiridas = [pools[i % 2].adquirir() for i in range(5)]
+    assert [chave is not None for chave in adquiridas] == [True] * 4 + [False]
+
+    pools[0].registrar_erro_cota(pools[0].chaves[0])
+    relatorio = {chave['id']: chave for chave in pools[1].obter_relatorio()}
+    assert relatorio['chave_1']['em_cooldown']
+    assert relatorio['chave_1']['requisicoes_ultimo_minuto'] == 2
+    assert relatorio['chave_2']['requisicoes_total'] == 2
+
+
+# ==================== SÉRIE TEMPORAL ====================
+
+DIA = 86400
+MEIO_DIA = DIA * 19675 + 12 * 3600
+
+
+def _serie(caminho=None):
+    from utils.serie_temporal import SerieUso
+
+    # Baldes de dia em UTC, independente do fuso da máquina
+    return SerieUso(caminho, fuso=lambda instante: 0)
+
+
+def test_serie_agrega_totais_picos_e_latencias():
+    serie = _serie()
+    for _ in range(3):
+        serie.registrar(requisicoes=1, tokens=100, latencia=0.4, agora=MEIO_DIA - 30)
+    serie.registrar(requisicoes=1, tokens=50, erros=1, latencia=8, agora=MEIO_DIA - 2 * 3600)
+    serie.registrar(requisicoes=5, agora=MEIO_DIA - 3 * DIA)
+
+    estatisticas = serie.estatisticas(DIA, agora=MEIO_DIA)
+    assert estatisticas['resolucao'] == "minuto"
+    assert (estatisticas['total_requisicoes'], estatisticas['total_tokens'], estatisticas['total_erros']) == (4, 350, 1)
+    assert estatisticas['pico_requisicoes_minuto'] == 3
+    assert estatisticas['pico_requisicoes_hora'] == 3
+    assert estatisticas['pico_requisicoes_dia'] == 4
+    assert estatisticas['latencia_segundos']['p50'] == 0.5
+    assert estatisticas['latencia_segundos']['p99'] == 10
+
+    estatisticas = serie.estatisticas(7 * DIA, agora=MEIO_DIA)
+    assert estatisticas['resolucao'] == "hora"
+    assert estatisticas['total_requisicoes'] == 9
+    assert estatisticas['pico_requisicoes_minuto'] is None  # Os minutos guardam só 2 dias
+    assert estatisticas['pico_requisicoes_hora'] == 5
+    assert estatisticas['pico_requisicoes_dia'] == 5
+
+
+def test_resolucao_mescla_somando_o_mesmo_periodo_e_trocando_os_antigos():
+    from utils.serie_temporal import Resolucao
+
+    local = Resolucao("minuto", 60, 4)
+    gravada = local.vazia_como()
+    local.requisicoes[local.posicao(10)] += 2
+    gravada.requisicoes[gravada.posicao(10)] += 3  # Mesmo período: soma
+    local.requisicoes[local.posicao(5)] += 7
+    gravada.requisicoes[gravada.posicao(9)] += 1  # Mesma posição, período mais novo: substitui
+    gravada.requisicoes[gravada.posicao(4)] += 4
+
+    local.mesclar(gravada)
+
+    assert list(local.periodos) == [4, 9, 10, -1]
+    assert list(local.requisicoes) == [4, 1, 5, 0]
+
+
+def test_serie_gravada_soma_o_uso_de_varios_processos(tmp_path):
+    caminho = tmp_path / "serie_uso.npz"
+    worker_1, worker_2 = _serie(caminho), _serie(caminho)
+    worker_1.registrar(requisicoes=2, tokens=10, agora=MEIO_DIA)
+    worker_2.registrar(requisicoes=3, tokens=20, agora=MEIO_DIA)
+
+    worker_1.salvar()
+    worker_2.salvar()
+    worker_1.salvar()  # Sem alterações pendentes: não soma de novo
+
+    assert worker_2.estatisticas(3600, agora=MEIO_DIA)['total_requisicoes'] == 5
+    assert _serie(caminho).estatisticas(3600, agora=MEIO_DIA)['total_tokens'] == 30
+
+
+def test_serie_acompanha_o_horario_de_verao():
+    from utils.serie_temporal import SerieUso
+
+    fuso_original = os.environ.get("TZ")
+    os.environ["TZ"] = "Europe/Lisbon"  # UTC+0 no inverno, UTC+1 no verão
+    time.tzset()
+    try:
+        serie = SerieUso()
+        # 23:30 no horário local, no inverno (23:30 UTC) e no verão (22:30 UTC)
+        inverno = DIA * 19737 + 23 * 3600 + 1800  # 15/01/2024
+        verao = DIA * 19905 + 22 * 3600 + 1800  # 01/07/2024
+        serie.registrar(requisicoes=1, agora=inverno)
+        serie.registrar(requisicoes=2, agora=verao)
+    finally:
+        if fuso_original is None:
+            del os.environ["TZ"]
+        else:
+            os.environ["TZ"] = fuso_original
+        time.tzset()
+
+    # Cada evento fica no seu dia e na sua hora locais, seja qual for o horário do início
+    dias = serie.resolucoes[2]
+    assert sorted(int(p) for p in dias.periodos if p >= 0) == [19737, 19905]
+    horas = serie.resolucoes[1]
+    assert sorted(int(p) % 24 for p in horas.periodos if p >= 0) == [23, 23]
+
+
+# ==================== CONCORRÊNCIA ADAPTATIVA ====================
+
+class ErroSobrecarga(Exception):
+    pass
+
+
+def _limite(inicial=4, maximo=8):
+    return LimiteConcorrencia(inicial=inicial, minimo=1, maximo=maximo, tolerancia_latencia=2.0,
+                              erros_sobrecarga=(ErroSobrecarga,))
+
+
+def _chamada(limite, latencia, modo="normal"):
+    vaga = limite.adquirir(modo)
+    vaga.inicio -= latencia
+    limite.liberar(vaga)
+
+
+def test_concorrencia_sobe_com_latencia_estavel_e_o_limite_em_uso():
+    limite = _limite()
+    ocupadas = [limite.adquirir() for _ in range(3)]  # 3 de 4 em uso
+
+    for _ in range(40):
+        _chamada(limite, 0.5)
+
+    assert limite.obter_relatorio()['limite'] > 4
+    for vaga in ocupadas:
+        limite.liberar(vaga)
+
+
+def test_concorrencia_cai_pela_metade_em_sobrecarga_e_rejeita_sem_vaga():
+    limite = _limite(inicial=8)
+    _chamada(limite, 0.5)
+
+    with pytest.raises(ErroSobrecarga):
+        with limite.vaga():
+            raise ErroSobrecarga()
+    assert limite.obter_relatorio()['limite'] == 4
+
+    # Uma rajada de erros do mesmo pico não reduz de novo
+    with pytest.raises(ErroSobrecarga):
+        with limite.vaga():
+            raise ErroSobrecarga()
+    assert limite.obter_relatorio()['limite'] == 4
+
+    ocupadas = [limite.adquirir() for _ in range(4)]
+    with pytest.raises(CapacidadeEsgotadaError):
+        limite.adquirir()
+    for vaga in ocupadas:
+        limite.liberar(vaga)
+
+
+def test_concorrencia_cai_quando_a_latencia_dispara():
+    limite = _limite(inicial=8)
+    for _ in range(20):
+        _chamada(limite, 0.5)
+
+    for _ in range(5):
+        _chamada(limite, 5.0)
+
+    relatorio = limite.obter_relatorio()
+    assert relatorio['limite'] < 8
+    assert relatorio['reducoes_latencia'] >= 1
+
+
+def _cliente_autenticado(monkeypatch, usuario_id=503, tipo_usuario="participante"):
+    """Cliente de teste do Flask com um token aceito sem consultar o banco"""
+    import main
+
+    monkeypatch.setattr(
+        main.auth_service, "validar_token",
+        lambda token: (True, {'user_id': usuario_id, 'tipo_usuario': tipo_usuario}, None)
+    )
+    return main.app.test_client(), {'Authorization': 'Bearer teste'}
+
+
+def test_rota_recusa_na_hora_com_429_e_retry_after_sem_vaga(monkeypatch):
+    import controllers.gemini_controller  # noqa: F401
+    modulo = sys.modules["controllers.gemini_controller"]
+    from models.chat import Chat
+
+    limite = _limite(inicial=2)
+    ocupadas = [limite.adquirir() for _ in range(2)]
+
+    def gerar_resposta(mensagem, contexto, historico, cancelamento):
+        with limite.vaga():
+            return True, "nunca chega aqui", None
+
+    monkeypatch.setattr(modulo.api_monitor, "reservar_requisicao", lambda: (_reserva_livre(), None, None))
+    monkeypatch.setattr(modulo.gemini_controller.chat_dao, "buscar_por_id", lambda id: Chat(id=id, projeto_id=79))
+    monkeypatch.setattr(modulo.context_service, "carregar_todos_contextos", lambda: (True, [], None))
+    monkeypatch.setattr(modulo.gemini_controller.mensagem_dao, "listar_por_chat", lambda chat_id, limit: [])
+    monkeypatch.setattr(modulo.gemini_service, "gerar_resposta", gerar_resposta)
+    cliente, headers = _cliente_autenticado(monkeypatch)
+
+    inicio = time.monotonic()
+    resposta = cliente.post('/api/ia/mensagem', json={'chat_id': 3, 'conteudo': 'Oi'}, headers=headers)
+
+    # Sem vaga: nenhuma espera na thread da requisição
+    assert time.monotonic() - inicio < 1
+    assert resposta.status_code == 429
+    assert resposta.headers['Retry-After'] == "1"
+    assert resposta.get_json()['data']['retry_after'] == 1
+    assert limite.obter_relatorio()['rejeicoes'] == 1
+    for vaga in ocupadas:
+        limite.liberar(vaga)
+
+
+def test_concorrencia_compara_latencia_com_a_referencia_do_mesmo_modo():
+    limite = _limite(inicial=8)
+    for _ in range(20):
+        _chamada(limite, 0.5)
+
+    # Thinking é sempre mais lento, mas não indica serviço degradado
+    for _ in range(5):
+        _chamada(limite, 20.0, modo="thinking")
+
+    relatorio = limite.obter_relatorio()
+    assert relatorio['limite'] == 8
+    assert relatorio['reducoes_latencia'] == 0
+    assert relatorio['latencias']['thinking']['referencia'] > relatorio['latencias']['normal']['referencia']
+
+
+# ==================== PRAZO ====================
+
+def test_prazo_por_endpoint_e_modo():
+    assert settings.get_prazo("mensagem") == settings.PRAZOS_SECONDS["mensagem"]
+    assert settings.get_prazo("mensagem", "thinking") == settings.PRAZOS_SECONDS["mensagem:thinking"]
+    assert settings.get_prazo("regenerar", "thinking") == settings.PRAZOS_SECONDS["regenerar"]
+    assert settings.get_prazo("inexistente") == settings.PRAZO_PADRAO_SECONDS
+
+
+def test_prazo_mede_as_etapas_e_falha_na_que_estourou():
+    from utils.prazo import Prazo, PrazoEsgotadoError
+
+    prazo = Prazo(0.05, operacao="teste")
+    with prazo.etapa("rapida"):
+        pass
+
+    with pytest.raises(PrazoEsgotadoError) as erro:
+        with prazo.etapa("lenta"):
+            time.sleep(0.08)
+    assert erro.value.etapa == "lenta"
+
+    # Sem tempo, a etapa seguinte nem começa; com verificar=False só é medida
+    executou = []
+    with pytest.raises(PrazoEsgotadoError):
+        with prazo.etapa("seguinte"):
+            executou.append("seguinte")
+    with prazo.etapa("gravar", verificar=False):
+        executou.append("gravar")
+
+    assert executou == ["gravar"]
+    assert list(prazo.etapas_dict()) == ["rapida", "lenta", "gravar"]
+    assert prazo.etapas_dict()["lenta"] >= 0.08
+
+
+def test_prazo_limita_a_chamada_http_ao_tempo_restante():
+    """Uma consulta travada termina junto com o prazo, e não no timeout do cliente"""
+    import socket
+    import httpx
+    from utils.prazo import Prazo, PrazoEsgotadoError, limitar_requisicao_http
+
+    servidor = socket.socket()
+    servidor.bind(("127.0.0.1", 0))
+    servidor.listen()  # Aceita a conexão e nunca responde
+    cliente = httpx.Client(timeout=120, event_hooks={'request': [limitar_requisicao_http]})
+    url = f"http://127.0.0.1:{servidor.getsockname()[1]}/rest/v1/chats"
+
+    prazo = Prazo(0.2)
+    token = prazo.ativar()
+    try:
+        inicio = time.monotonic()
+        with pytest.raises(httpx.TimeoutException):
+            cliente.get(url)
+        assert time.monotonic() - inicio < 2
+
+        # Prazo já esgotado: a requisição nem é enviada
+        with pytest.raises(PrazoEsgotadoError):
+            cliente.get(url)
+    finally:
+        Prazo.desativar(token)
+        cliente.close()
+        servidor.close()
+
+
+def test_prazo_esgotado_responde_504_com_a_etapa(monkeypatch):
+    import main
+    import controllers.gemini_controller  # noqa: F401
+    modulo = sys.modules["controllers.gemini_controller"]
+    from models.chat import Chat
+
+    def carregar_contextos_lento():
+        time.sleep(0.1)
+        return True, [], None
+
+    monkeypatch.setitem(settings.PRAZOS_SECONDS, "mensagem", 0.05)
+    monkeypatch.setattr(modulo.api_monitor, "reservar_requisicao", lambda: (_reserva_livre(), None, None))
+    monkeypatch.setattr(modulo.gemini_controller.chat_dao, "buscar_por_id", lambda id: Chat(id=id, projeto_id=80))
+    monkeypatch.setattr(modulo.context_service, "carregar_todos_contextos", carregar_contextos_lento)
+    cliente, headers = _cliente_autenticado(monkeypatch)
+
+    resposta = cliente.post('/api/ia/mensagem', json={'chat_id': 4, 'conteudo': 'Oi'}, headers=headers)
+
+    assert resposta.status_code == 504
+    assert resposta.get_json()['data']['etapa'] == "carregar_contextos"
+    assert main._http_status({'success': False, 'error': "Deadline exceeded"}) == 504
+
+
+# ==================== CANCELAMENTO ====================
+
+def test_cancelamento_propaga_aos_derivados_e_interrompe_o_stream():
+    from google.ai import generativelanguage as glm
+    from services.cancelamento_service import Cancelamento
+    from services.gemini_service import gemini_service
+
+    geracao = Cancelamento(usuario_id=1, chat_id=1)
+    tentativa = geracao.derivar()
+    interrompidas = []
+    tentativa.ao_cancelar(lambda: interrompidas.append("rpc"))
+
+    class ChamadaFalsa:
+        canceladas = 0
+
+        def __iter__(self):
+            yield glm.GenerateContentResponse(candidates=[{"content": {"parts": [{"text": "Olá"}]}}])
+            geracao.cancelar("Cliente desconectado")
+            yield glm.GenerateContentResponse(candidates=[{"content": {"parts": [{"text": " mundo"}]}}])
+
+        def cancel(self):
+            self.canceladas += 1
+
+    chamada = ChamadaFalsa()
+    assert gemini_service._consumir_stream(chamada, tentativa) is None
+
+    assert tentativa.cancelado and tentativa.motivo == "Cliente desconectado"
+    assert interrompidas == ["rpc"]  # A chamada gRPC é cancelada pelo derivado
+    assert chamada.canceladas == 1
+    assert geracao.derivar().cancelado  # Derivado de um cancelamento já sinalizado
+
+
+def test_so_a_rota_em_streaming_repassa_o_cancelamento_ao_gemini(monkeypatch):
+    import controllers.gemini_controller  # noqa: F401
+    modulo = sys.modules["controllers.gemini_controller"]
+    from services.cancelamento_service import Cancelamento
+    from models.chat import Chat
+
+    controller = modulo.GeminiController()
+    recebidos = []
+
+    def gerar_resposta(mensagem, contexto, historico, cancelamento):
+        recebidos.append(cancelamento)
+        return False, None, "Falha simulada"
+
+    monkeypatch.setattr(modulo.api_monitor, "reservar_requisicao", lambda: (_reserva_livre(), None, None))
+    monkeypatch.setattr(modulo.api_monitor, "registrar_erro", lambda *a, **k: None)
+    monkeypatch.setattr(controller.chat_dao, "buscar_por_id", lambda id: Chat(id=id, projeto_id=78))
+    monkeypatch.setattr(modulo.context_service, "carregar_todos_contextos", lambda: (True, [], None))
+    monkeypatch.setattr(controller.mensagem_dao, "listar_por_chat", lambda chat_id, limit: [])
+    monkeypatch.setattr(modulo.gemini_service, "gerar_resposta", gerar_resposta)
+
+    controller.processar_mensagem(2, 502, "Oi", tipo_usuario="participante")
+    stream = Cancelamento(usuario_id=502, chat_id=2)
+    controller.processar_mensagem(2, 502, "Oi", cancelamento=stream, tipo_usuario="participante")
+
+    # Rota síncrona: chamada simples ao Gemini; streaming só com quem possa cancelar
+    assert recebidos == [None, stream]
+
+
+# ==================== HEDGING ====================
+
+def _hedge(latencias=()):
+    from services.hedge_service import HedgeService
+
+    servico = HedgeService()
+    servico.ativo = True
+    servico.min_amostras = 10
+    servico.latencias.extend(latencias)
+    return servico
+
+
+def test_hedge_limiar_e_o_percentil_das_latencias_recentes():
+    servico = _hedge([0.5] * 9)
+    assert servico.calcular_limiar() is None  # Menos amostras que o mínimo
+
+    servico.latencias.clear()
+    servico.latencias.extend(range(100, 0, -1))
+    assert servico.calcular_limiar() == 96  # p95 de 1..100
+
+
+def test_hedge_respeita_o_teto_de_requisicoes_extras():
+    servico = _hedge()
+
+    servico.chamadas = 9
+    assert not servico._pode_disparar()
+
+    servico.chamadas = 10
+    assert servico._pode_disparar()
+    assert not servico._pode_disparar()  # Um segundo extra passaria de 10% das chamadas
+
+    servico.chamadas = 20
+    assert servico._pode_disparar()
+    assert servico.hedges_disparados == 2
+
+
+def test_hedge_vencedor_contabilizado_e_perdedor_interrompido(monkeypatch):
+    from services.cancelamento_service import Cancelamento
+
+    modulo = sys.modules["services.hedge_service"]
+    monkeypatch.setattr(modulo.api_monitor, "registrar_requisicao", lambda *a, **k: None)
+    servico = _hedge([0.01] * 10)
+    servico.chamadas = 9
+    tentativas, interrompidas = [], []
+
+    def tentativa(cancelamento, primeiro_token):
+        tentativas.append(cancelamento)
+        if len(tentativas) == 1:
+            # Principal: presa antes do primeiro token até a chamada ser cancelada
+            interrompida = threading.Event()
+            interrompidas.append(interrompida)
+            cancelamento.ao_cancelar(interrompida.set)
+            interrompida.wait(5)
+            return None
+        primeiro_token.set()
+        return "resposta do hedge"
+
+    geracao = Cancelamento(usuario_id=1, chat_id=1)
+    assert servico.executar(tentativa, geracao) == "resposta do hedge"
+
+    assert servico.hedges_disparados == 1
+    assert servico.hedges_vencedores == 1
+    assert interrompidas[0].is_set()
+    assert tentativas[0].motivo == "Hedge perdedor"
+    assert not geracao.cancelado
+
+
+# ==================== MICRO-LOTES ====================
+
+def test_lote_separa_as_respostas_na_ordem_das_perguntas():
+    from services.gemini_service import GeminiService
+
+    separar = GeminiService._separar_respostas_lote
+    texto = '{"respostas": [{"id": 2, "resposta": "B"}, {"id": 1, "resposta": "A"}]}'
+
+    assert separar(None, texto, 2) == ["A", "B"]
+    assert separar(None, texto, 3) is None  # Faltou a resposta de uma pergunta
+    assert separar(None, '{"respostas": [{"id": 1, "resposta": " "}]}', 1) is None
+    assert separar(None, "não é JSON", 1) is None
+
+
+def _microlote(monkeypatch, lote):
+    from services.microlote_service import MicroloteService
+
+    modulo = sys.modules["services.microlote_service"]
+    individuais = []
+
+    def gerar_resposta(mensagem, contexto, historico, cancelamento):
+        individuais.append(mensagem)
+        return True, f"individual: {mensagem}", None
+
+    monkeypatch.setattr(modulo.gemini_service, "gerar_respostas_em_lote", lote)
+    monkeypatch.setattr(modulo.gemini_service, "gerar_resposta", gerar_resposta)
+
+    servico = MicroloteService()
+    servico.ativo = True
+    servico.janela = 5  # Só o lote cheio (2 perguntas) libera o condutor
+    servico.max_perguntas = 2
+    return servico, individuais
+
+
+def _responder_juntos(servico, contexto, cancelamentos=(None, None)):
+    """Condutor e seguidor no mesmo lote; devolve o resultado (ou erro) de cada um"""
+    resultados = [None, None]
+
+    def responder(i, pergunta):
+        try:
+            resultados[i] = servico.responder(pergunta, contexto, cancelamentos[i])
+        except Exception as e:
+            resultados[i] = e
+
+    condutor = threading.Thread(target=responder, args=(0, "p1"))
+    condutor.start()
+    while not servico._abertos:
+        time.sleep(0.01)
+    responder(1, "p2")
+    condutor.join(5)
+    return resultados
+
+
+def test_lote_responde_todos_ou_recorre_a_perguntas_individuais(monkeypatch):
+    contexto = ["caderno de resumos " * 500]
+    servico, individuais = _microlote(monkeypatch, lambda perguntas, ctx: (True, [p.upper() for p in perguntas], None))
+
+    assert _responder_juntos(servico, contexto) == [(True, "P1", None, 1), (True, "P2", None, 0)]
+    assert individuais == []
+
+    servico, individuais = _microlote(monkeypatch, lambda perguntas, ctx: (False, None, "Resposta em lote inválida"))
+    resultados = _responder_juntos(servico, contexto)
+
+    assert [r[1] for r in resultados] == ["individual: p1", "individual: p2"]
+    assert sorted(individuais) == ["p1", "p2"]
+    assert servico.obter_relatorio()['fallbacks'] == 2
+
+
+def test_lote_sem_capacidade_nao_recorre_a_perguntas_individuais(monkeypatch):
+    def lote(perguntas, ctx):
+        raise CapacidadeEsgotadaError(4, 3)
+
+    servico, individuais = _microlote(monkeypatch, lote)
+    resultados = _responder_juntos(servico, ["contexto"])
+
+    assert all(isinstance(r, CapacidadeEsgotadaError) and r.retry_after == 3 for r in resultados)
+    assert individuais == []
+
+
+def test_lote_sem_o_condutor_cancelado(monkeypatch):
+    from services.cancelamento_service import Cancelamento
+
+    enviados = []
+
+    def lote(perguntas, ctx):
+        enviados.append(perguntas)
+        return True, perguntas, None
+
+    servico, individuais = _microlote(monkeypatch, lote)
+    cancelamento = Cancelamento(usuario_id=1, chat_id=1)
+    cancelamento.cancelar()
+    resultados = _responder_juntos(servico, ["contexto"], (cancelamento, None))
+
+    # A pergunta do condutor sai do lote; a do seguidor vai sozinha
+    assert resultados[0][0] is False and "cancelada" in resultados[0][2]
+    assert resultados[1] == (True, "individual: p2", None, 1)
+    assert enviados == [] and individuais == ["p2"]
+
+
+# ==================== COTAS ====================
+
+def _cota_service(monkeypatch, relogio, estado=None):
+    from services import cota_service as modulo
+
+    monkeypatch.setattr(modulo.time, "time", relogio)
+    cotas = modulo.CotaService(estado=estado or EstadoMemoria())
+    cotas.cotas_por_tipo = {
+        "participante": {"capacidade": 2, "recarga_minuto": 60},
+        "orientador": {"capacidade": 8, "recarga_minuto": 60}
+    }
+    cotas.cota_projeto = {"capacidade": 5, "recarga_minuto": 60}
+    cotas.custos = {"normal": 1, "thinking": 4}
+    return cotas
+
+
+def test_balde_recarrega_ate_a_capacidade():
+    from services.cota_service import BaldeFichas
+
+    balde = BaldeFichas(capacidade=10, recarga_minuto=60)
+    # Balde novo (0) está cheio; vazio, fica cheio 10s depois
+    assert balde.fichas(0, 1000) == 10
+    cheio_em = balde.consumir(0, 10, 1000)
+    assert cheio_em == 11000 and balde.consumir(cheio_em, 1, 1000) == cheio_em
+    assert balde.segundos_para(cheio_em, 3, 1000) == pytest.approx(3)
+
+    assert balde.fichas(cheio_em, 3000) == pytest.approx(2)
+    assert balde.fichas(cheio_em, 100000) == 10
+    # A devolução não passa da capacidade
+    assert balde.fichas(balde.devolver(cheio_em, 50, 3000), 3000) == 10
+
+
+def test_cota_por_tipo_de_usuario_e_custo_do_thinking(monkeypatch):
+    relogio = RelogioFalso()
+    cotas = _cota_service(monkeypatch, relogio)
+
+    # Participante: 2 fichas; a terceira mensagem espera 1s de recarga
+    assert cotas.consumir(1, "participante", None)[0]
+    assert cotas.consumir(1, "participante", None)[0]
+    permitido, cota = cotas.consumir(1, "participante", None)
+    assert not permitido and cota["bloqueado_por"] == "usuario" and cota["retry_after"] == 1
+
+    # Orientador: 8 fichas; thinking custa 4
+    assert cotas.consumir(2, "orientador", None, usar_thinking=True)[0]
+    assert cotas.consumir(2, "orientador", None, usar_thinking=True)[0]
+    assert not cotas.consumir(2, "orientador", None, usar_thinking=True)[0]
+
+    relogio.agora += 4
+    assert cotas.consumir(2, "orientador", None, usar_thinking=True)[0]
+
+
+def test_cota_do_projeto_compartilhada_e_devolucao(monkeypatch):
+    relogio = RelogioFalso()
+    cotas = _cota_service(monkeypatch, relogio)
+
+    assert cotas.consumir(1, "orientador", 9, usar_thinking=True)[0]
+    permitido, cota = cotas.consumir(2, "orientador", 9, usar_thinking=True)
+    assert not permitido and cota["bloqueado_por"] == "projeto"
+    # Bloqueio não consome nada do usuário
+    assert cota["restante_usuario"] == 8
+
+    cotas.devolver(1, "orientador", 9, usar_thinking=True)
+    assert cotas.consumir(2, "orientador", 9, usar_thinking=True)[0]
+    assert cotas.obter_relatorio()["bloqueios_projeto"] == 1
+
+
+def test_cota_compartilhada_entre_workers(monkeypatch, tmp_path):
+    relogio = RelogioFalso()
+    estado = EstadoSQLite(tmp_path / "estado.db")
+    worker_1 = _cota_service(monkeypatch, relogio, estado)
+    worker_2 = _cota_service(monkeypatch, relogio, EstadoSQLite(tmp_path / "estado.db"))
+
+    # Dois workers não dobram a cota: o participante tem 2 fichas no total
+    assert worker_1.consumir(1, "participante", 9)[0]
+    assert worker_2.consumir(1, "participante", 9)[0]
+    permitido, cota = worker_1.consumir(1, "participante", 9)
+    assert not permitido and cota["restante_projeto"] == 3
+
+    # A devolução feita por outro worker vale para todos
+    worker_2.devolver(1, "participante", 9)
+    permitido, cota = worker_1.consumir(1, "participante", 9)
+    assert permitido and cota["restante_usuario"] == 0 and cota["restante_projeto"] == 3
+
+
+def test_cota_devolvida_quando_a_geracao_e_cancelada(monkeypatch):
+    import controllers.gemini_controller  # noqa: F401
+    modulo = sys.modules["controllers.gemini_controller"]  # O pacote reexporta a instância com o mesmo nome
+    from services.cancelamento_service import Cancelamento
+    from services.cota_service import cota_service
+    from models.chat import Chat
+
+    controller = modulo.GeminiController()
+    estado = EstadoMemoria()
+    monkeypatch.setattr(cota_service, "estado", estado)
+    monkeypatch.setattr(modulo.api_monitor, "reservar_requisicao", lambda: (_reserva_livre(estado), None, None))
+    monkeypatch.setattr(modulo.api_monitor, "registrar_cancelamento", lambda *a, **k: None)
+    monkeypatch.setattr(controller.chat_dao, "buscar_por_id", lambda id: Chat(id=id, projeto_id=77))
+    monkeypatch.setattr(modulo.context_service, "carregar_todos_contextos", lambda: (True, [], None))
+    monkeypatch.setattr(controller.mensagem_dao, "listar_por_chat", lambda chat_id, limit: [])
+
+    cancelamento = Cancelamento(usuario_id=501, chat_id=1)
+    cancelamento.cancelar()
+    resposta = controller.processar_mensagem(1, 501, "Oi", cancelamento=cancelamento, tipo_usuario="participante")
+
+    assert resposta["success"] is False
+    # Consumidas e devolvidas: os dois baldes voltam a ficar cheios
+    agora_ms = int(time.time() * 1000)
+    assert estado.obter(cota_service._chave_usuario(501)) <= agora_ms
+    assert estado.obter(cota_service._chave_projeto(77)) <= agora_ms
+    assert estado.obter(cota_service._chave_usuario(501)) > 0
+    assert estado.contar_eventos('requisicoes') == 0  # A vaga no rate limit também volta
+
+
+# ==================== MÉTRICAS ====================
+
+def test_exposicao_de_metricas_no_formato_do_prometheus():
+    from utils.metricas import RegistroMetricas
+
+    registro = RegistroMetricas()
+    registro.contador("teste_total", "Contador de teste").inc(2, rota='/a"b')
+    registro.histograma("teste_segundos", "Latência de teste", limites=(0.1, 1)).observar(0.5, rota="/a")
+
+    assert registro.exportar() == (
+        '# HELP teste_segundos Latência de teste\n'
+        '# TYPE teste_segundos histogram\n'
+        'teste_segundos_bucket{rota="/a",le="0.1"} 0\n'
+        'teste_segundos_bucket{rota="/a",le="1"} 1\n'
+        'teste_segundos_bucket{rota="/a",le="+Inf"} 1\n'
+        'teste_segundos_sum{rota="/a"} 0.5\n'
+        'teste_segundos_count{rota="/a"} 1\n'
+        '# HELP teste_total Contador de teste\n'
+        '# TYPE teste_total counter\n'
+        'teste_total{rota="/a\\"b"} 2\n'
+    )
+
+
+def test_metrics_desligado_sem_token_e_recusa_token_errado(monkeypatch):
+    import main
+
+    cliente = main.app.test_client()
+    monkeypatch.setattr(settings, "METRICS_TOKEN", "")
+    assert cliente.get('/metrics', headers={'Authorization': 'Bearer '}).status_code == 404
+
+    monkeypatch.setattr(settings, "METRICS_TOKEN", "segredo")
+    assert cliente.get('/metrics').status_code == 401
+    assert cliente.get('/metrics', headers={'Authorization': 'Bearer outro'}).status_code == 401
+    assert cliente.get('/metrics', headers={'Authorization': 'segredo'}).status_code == 401
+
+    resposta = cliente.get('/metrics', headers={'Authorization': 'Bearer segredo'})
+    assert resposta.status_code == 200
+    assert resposta.mimetype == "text/plain" and "version=0.0.4" in resposta.content_type
+    assert "# TYPE apbia_http_duracao_segundos histogram" in resposta.get_data(as_text=True)
+
+
+def test_metricas_http_rotuladas_pela_rota_registrada(monkeypatch):
+    import main
+
+    cliente = main.app.test_client()
+    rota = "/api/chat/<int:chat_id>/mensagens"
+    antes = main._requisicoes_http.valor(rota=rota, metodo="GET", status=401)
+
+    # Sem token a rota responde 401, mas a requisição é medida do mesmo jeito
+    assert cliente.get('/api/chat/7/mensagens').status_code == 401
+    assert cliente.get('/api/chat/8/mensagens').status_code == 401
+    assert main._requisicoes_http.valor(rota=rota, metodo="GET", status=401) == antes + 2
+
+    monkeypatch.setattr(settings, "METRICS_TOKEN", "segredo")
+    texto = cliente.get('/metrics', headers={'Authorization': 'Bearer segredo'}).get_data(as_text=True)
+
+    # Uma série por rota (não por URL), com as faixas de latência e a contagem
+    assert f'apbia_http_requisicoes_total{{metodo="GET",rota="{rota}",status="401"}} {int(antes) + 2}' in texto
+    assert f'apbia_http_duracao_segundos_bucket{{metodo="GET",rota="{rota}",le="+Inf"}}' in texto
+    assert re.search(rf'apbia_http_duracao_segundos_count\{{metodo="GET",rota="{re.escape(rota)}"\}} [1-9]', texto)
+    assert "/api/chat/7/mensagens" not in texto
+
+
+# ==================== DAOs ====================
+
+class _Resultado:
+    def __init__(self, data):
+        self.data = data
+        self.count = len(data)
+
+
+class TabelaFalsa:
+    """Imita o query builder do Supabase e conta as idas ao banco"""
+
+    # Filtro de keyset gerado por BaseDAO.find_page: "c.op.v,and(c.eq.v,id.op.n)"
+    KEYSET = re.compile(r'^(\w+)\.(gt|lt)\.(.+),and\(\1\.eq\.\3,id\.\2\.(\d+)\)$')
+
+    def __init__(self, linhas, idas):
+        self.linhas = linhas
+        self.idas = idas
+        self.filtros = []
+        self.ordens = []
+        self.maximo = None
+
+    def select(self, *args, **kwargs):
+        return TabelaFalsa(self.linhas, self.idas)
+
+    def eq(self, campo, valor):
+        self.filtros.append(lambda linha: linha.get(campo) == valor)
+        return self
+
+    def in_(self, campo, valores):
+        self.filtros.append(lambda linha: linha.get(campo) in valores)
+        return self
+
+    def gt(self, campo, valor):
+        self.filtros.append(lambda linha: linha.get(campo) > valor)
+        return self
+
+    def lt(self, campo, valor):
+        self.filtros.append(lambda linha: linha.get(campo) < valor)
+        return self
+
+    def or_(self, filtro):
+        campo, operador, valor, id = self.KEYSET.match(filtro).groups()
+        chave = (valor.strip('"'), int(id))
+        if operador == "gt":
+            self.filtros.append(lambda linha: (linha.get(campo), linha["id"]) > chave)
+        else:
+            self.filtros.append(lambda linha: (linha.get(campo), linha["id"]) < chave)
+        return self
+
+    def order(self, campo, desc=False, **kwargs):
+        self.ordens.append((campo, desc))
+        return self
+
+    def limit(self, maximo):
+        self.maximo = maximo
+        return self
+
+    def range(self, *args):
+        return self
+
+    def update(self, dados):
+        self.dados = dados
+        return self
+
+    def insert(self, dados):
+        self.novas = dados if isinstance(dados, list) else [dados]
+        return self
+
+    def execute(self):
+        self.idas.append(1)
+        if getattr(self, "novas", None) is not None:
+            for linha in self.novas:
+                self.linhas.append({"id": len(self.linhas) + 1, **linha})
+            return _Resultado(self.linhas[-len(self.novas):])
+        linhas = [linha for linha in self.linhas if all(f(linha) for f in self.filtros)]
+        if getattr(self, "dados", None):
+            for linha in linhas:
+                linha.update(self.dados)
+        for campo, desc in reversed(self.ordens):
+            linhas.sort(key=lambda linha: linha.get(campo), reverse=desc)
+        return _Resultado(linhas[:self.maximo] if self.maximo is not None else linhas)
+
+
+def test_listar_mensagens_faz_uma_unica_consulta():
+    from dao.mensagem_dao import MensagemDAO
+
+    idas = []
+    autores = {1: {"nome_completo": "Ana"}, 2: {"nome_completo": "Rui"}}
+    anexos = {4: [{"id": 1, "mensagem_id": 4, "nome_arquivo": "a.txt"}, {"id": 2, "mensagem_id": 4, "nome_arquivo": "b.txt"}]}
+    dao = MensagemDAO()
+    # Autor e anexos chegam embutidos em cada linha, como no select do PostgREST
+    dao.table = TabelaFalsa([
+        {"id": i, "chat_id": 1, "usuario_id": (i % 3) or None, "conteudo": f"m{i}", "e_nota_orientador": False,
+         "data_envio": f"2024-01-01T10:{i // 60:02d}:{i % 60:02d}+00:00",
+         "usuarios": autores.get(i % 3), "arquivos_chat": anexos.get(i, [])}
+        for i in range(1, 101)
+    ], idas)
+
+    mensagens = dao.listar_por_chat(1)
+
+    assert len(mensagens) == 100
+    assert len(idas) == 1
+    assert mensagens[0].usuario_nome == "Ana"
+    assert mensagens[2].usuario_nome is None
+    assert [a["nome_arquivo"] for a in mensagens[3].arquivos] == ["a.txt", "b.txt"]
+
+
+def test_tabela_referencia_responde_da_memoria():
+    from dao.usuario_dao import TipoUsuarioDAO
+
+    idas = []
+    tipos = TipoUsuarioDAO()
+    tipos.table = TabelaFalsa([{"id": 1, "nome": "participante"}, {"id": 2, "nome": "orientador"}], idas)
+
+    for _ in range(50):
+        assert tipos.nome_por_id(1) == "participante"
+        assert tipos.buscar_por_nome("orientador").id == 2
+    assert len(idas) == 1
+
+    # Valor desconhecido recarrega, mas só uma vez por intervalo
+    tipos.table.linhas.append({"id": 3, "nome": "admin"})
+    assert tipos.buscar_por_nome("admin") is None
+    tipos._ultima_tentativa -= tipos.RECARGA_MIN_SECONDS
+    assert tipos.buscar_por_nome("admin").id == 3
+    assert tipos.buscar_por_nome("inexistente") is None
+    assert len(idas) == 2
+
+
+def test_listar_chats_com_resumo_faz_uma_unica_consulta():
+    from dao.chat_dao import ChatDAO
+
+    idas = []
+    dao = ChatDAO()
+    dao.tabela_resumo = TabelaFalsa([
+        {"id": i, "projeto_id": 7, "tipo_ia_id": 1, "titulo": f"c{i}", "total_mensagens": i * 2,
+         "data_criacao": f"2024-01-{i:02d}T09:00:00+00:00",
+         "ultima_mensagem_em": f"2024-01-{i:02d}T10:00:00+00:00", "ultima_atividade": f"2024-01-{i:02d}T10:00:00+00:00"}
+        for i in range(1, 21)
+    ], idas)
+
+    chats, ha_mais = dao.listar_resumo_por_projeto(7)
+    chats = [chat.to_dict() for chat in chats]
+
+    assert len(chats) == 20 and not ha_mais
+    assert len(idas) == 1
+    assert chats[0]["id"] == 20  # mais novos primeiro
+    assert chats[17]["total_mensagens"] == 6
+    assert chats[17]["ultima_mensagem_em"] == "2024-01-03T10:00:00+00:00"
+
+
+class ViewFalha:
+    """View do Supabase cuja consulta falha com o erro dado"""
+
+    def __init__(self, erro):
+        self.erro = erro
+
+    def select(self, *args, **kwargs):
+        raise self.erro
+
+
+def test_resumo_de_chats_so_recorre_a_contagem_sem_a_view(monkeypatch):
+    from postgrest.exceptions import APIError
+    from dao.chat_dao import ChatDAO
+
+    dao = ChatDAO()
+    contagens = []
+    dao.table = TabelaFalsa([
+        {"id": i, "projeto_id": 7, "tipo_ia_id": 1, "titulo": f"c{i}", "data_criacao": f"2024-01-{i:02d}T09:00:00+00:00"}
+        for i in range(1, 26)
+    ], [])
+    monkeypatch.setattr("dao.chat_dao.MensagemDAO.contar_mensagens_chat", lambda self, chat_id: contagens.append(chat_id) or 4)
+
+    dao.tabela_resumo = ViewFalha(APIError({"code": "PGRST205", "message": "Could not find the table 'public.chats_resumo'"}))
+    chats, ha_mais = dao.listar_resumo_por_projeto(7, 10)
+    assert [chat.id for chat in chats] == list(range(25, 15, -1)) and ha_mais
+    assert chats[0].total_mensagens == 4
+
+    # Sem a view a paginação continua valendo: só a página pedida é contada
+    ultimo = chats[-1]
+    chats, ha_mais = dao.listar_resumo_por_projeto(7, 10, "antes", (ultimo.data_criacao, ultimo.id))
+    assert [chat.id for chat in chats] == list(range(15, 5, -1)) and ha_mais
+    assert contagens == list(range(25, 5, -1))
+
+    # Timeout ou erro de consulta não vira o laço de contagens
+    for erro in (TimeoutError("read timeout"), APIError({"code": "PGRST100", "message": "failed to parse filter"})):
+        dao.tabela_resumo = ViewFalha(erro)
+        with pytest.raises(type(erro)):
+            dao.listar_resumo_por_projeto(7)
+    assert len(contagens) == 20
+
+
+def test_paginacao_de_mensagens_por_cursor():
+    from controllers.chat_controller import ChatController
+
+    controller = ChatController()
+    idas = []
+    # Várias mensagens no mesmo instante: o id desempata a ordenação
+    controller.mensagem_dao.table = TabelaFalsa([
+        {"id": i, "chat_id": 1, "usuario_id": None, "conteudo": f"m{i}",
+         "data_envio": f"2024-01-01T10:{i // 3:02d}:00+00:00"}
+        for i in range(1, 26)
+    ], idas)
+
+    def pagina(cursor=None):
+        resposta = controller.listar_mensagens_chat(1, 10, cursor)
+        assert resposta["success"]
+        return [m["id"] for m in resposta["data"]], resposta["paginacao"]
+
+    ids, paginacao = pagina()
+    assert ids == list(range(16, 26)) and paginacao["proximo"] is None
+
+    ids, paginacao = pagina(paginacao["anterior"])
+    assert ids == list(range(6, 16))
+
+    ids, antigas = pagina(paginacao["anterior"])
+    assert ids == list(range(1, 6)) and antigas["anterior"] is None
+
+    ids, _ = pagina(paginacao["proximo"])
+    assert ids == list(range(16, 26))
+    assert len(idas) == 4
+
+    invalida = controller.listar_mensagens_chat(1, 10, "nao-e-um-cursor")
+    assert invalida["success"] is False and invalida["message"] == "Cursor inválido"
+    assert controller.listar_chats_projeto(1, 10, "nao-e-um-cursor")["message"] == "Cursor inválido"
+    # O valor da posição vai para o filtro do PostgREST: só timestamps passam
+    from utils.helpers import helpers
+    injetado = helpers.encode_cursor(('x",id.gt.0,and(id.eq.1', 1), "antes")
+    assert controller.listar_mensagens_chat(1, 10, injetado)["message"] == "Cursor inválido"
+
+    # Timestamps do Postgres com 1 a 5 casas de fração de segundo são válidos
+    for fracao in ("1", "12", "123", "1234", "12345"):
+        cursor = helpers.encode_cursor((f"2024-01-01T10:03:00.{fracao}+00:00", 9), "antes")
+        assert helpers.decode_cursor(cursor) == ("antes", (f"2024-01-01T10:03:00.{fracao.ljust(6, '0')}+00:00", 9))
+
+
+def test_projecao_resumida_de_mensagens():
+    from controllers.chat_controller import ChatController
+
+    controller = ChatController()
+    colunas = []
+    tabela = TabelaFalsa([
+        {"id": 1, "chat_id": 1, "usuario_id": None, "data_envio": "2024-01-01T10:00:00+00:00", "previa": "Olá"}
+    ], [])
+    selecionar = tabela.select
+    tabela.select = lambda *args, **kwargs: colunas.append(args[0]) or selecionar()
+    controller.mensagem_dao.table = tabela
+
+    resposta = controller.listar_mensagens_chat(1, 10, resumo=True)
+
+    assert colunas == [controller.mensagem_dao.PROJECOES["resumo"]]
+    assert "previa" in colunas[0] and "conteudo" not in colunas[0]
+    assert resposta["data"][0]["previa"] == "Olá"
+    assert "conteudo" not in resposta["data"][0]
+
+
+def test_mapa_identidade_evita_reler_na_mesma_requisicao():
+    from flask import Flask
+    from dao.usuario_dao import UsuarioDAO
+
+    idas = []
+    dao = UsuarioDAO()
+    dao.table = TabelaFalsa([{"id": 1, "nome_completo": "Ana", "email": "ana@x.com", "tipo_usuario_id": 1}], idas)
+    dao.cache = None  # Só o mapa da requisição (o cache entre requisições tem teste próprio)
+    app = Flask(__name__)
+
+    with app.test_request_context():
+        assert dao.buscar_por_id(1, "publico").nome_completo == "Ana"
+        assert dao.buscar_por_id(1, "publico").nome_completo == "Ana"
+        assert dao.exists("id", 1)
+        assert len(idas) == 1
+
+        # Outra projeção é outra leitura; uma escrita invalida as duas
+        dao.buscar_por_id(1)
+        dao.update(1, {"nome_completo": "Ana Lima"})
+        assert dao.buscar_por_id(1, "publico").nome_completo == "Ana Lima"
+        assert len(idas) == 4
+
+    # Cada requisição começa com o mapa vazio
+    with app.test_request_context():
+        dao.buscar_por_id(1, "publico")
+        assert len(idas) == 5
+
+    # Fora de uma requisição não há mapa
+    dao.buscar_por_id(1, "publico")
+    dao.buscar_por_id(1, "publico")
+    assert len(idas) == 7
+
+
+def test_cache_lru_expira_e_descarta_o_menos_usado():
+    from utils.cache_lru import CacheLRU
+
+    agora = [0.0]
+    cache = CacheLRU("teste", ttl=10, max_itens=2, relogio=lambda: agora[0])
+    cache.definir("a", 1)
+    cache.definir("b", 2)
+    assert cache.obter("a") == 1  # "a" passa a ser o mais recente
+    cache.definir("c", 3)
+    assert cache.obter("b") is None and cache.obter("a") == 1
+
+    agora[0] = 11
+    assert cache.obter("a") is None and cache.obter("c") is None
+    assert cache.obter_relatorio()["descartes"] == 1
+
+    # Leitura que começou antes de uma invalidação não repõe o valor antigo
+    versao = cache.versao()
+    cache.invalidar_grupo("x")
+    cache.definir("a", "velho", versao=versao)
+    assert cache.obter("a") is None
+
+
+def test_cache_de_projetos_invalidado_pelas_escritas(monkeypatch):
+    from utils.cache_lru import obter_cache
+    from dao.projeto_dao import ProjetoDAO
+    import dao.projeto_dao as modulo
+
+    idas = []
+    dao = ProjetoDAO()
+    obter_cache("projetos").limpar()
+    linhas = [{"id": 7, "nome": "Robótica", "participantes_projetos": [], "orientadores_projetos": []}]
+    dao.table = TabelaFalsa(linhas, idas)
+
+    assert dao.buscar_por_id(7).nome == "Robótica"
+    assert ProjetoDAO().buscar_por_id(7).nome == "Robótica"  # Cache compartilhado entre instâncias
+    assert len(idas) == 1
+
+    dao.update(7, {"nome": "Robótica Livre"})
+    assert dao.buscar_por_id(7).nome == "Robótica Livre"
+    assert len(idas) == 3
+
+    vinculos = TabelaFalsa([], [])
+    monkeypatch.setattr(modulo.db, "get_table", lambda nome: vinculos)
+    assert dao.adicionar_participante(7, 3)
+    dao.buscar_por_id(7)
+    assert len(idas) == 4
+
+
+def test_cache_de_usuarios_entrega_copias_e_nao_guarda_a_senha():
+    from flask import Flask
+    from utils.cache_lru import obter_cache
+    from dao.usuario_dao import UsuarioDAO
+
+    idas = []
+    dao = UsuarioDAO()
+    obter_cache("usuarios").limpar()
+    dao.table = TabelaFalsa([{"id": 1, "nome_completo": "Ana", "senha_hash": "hash"}], idas)
+
+    # A projeção sem senha é compartilhada; a linha inteira ("*") sempre vai ao banco
+    assert dao.find_by_id(1, "publico")["nome_completo"] == "Ana"
+    assert UsuarioDAO().find_by_id(1, "publico")["nome_completo"] == "Ana"
+    assert len(idas) == 1
+    assert dao.find_by_id(1)["senha_hash"] == "hash"
+    assert dao.find_by_id(1)["senha_hash"] == "hash"
+    assert len(idas) == 3 and len(obter_cache("usuarios")) == 1
+
+    # Alterar o que recebeu não muda o que outra requisição lê
+    dao.find_by_id(1, "publico")["nome_completo"] = "Alterado"
+    assert dao.find_by_id(1, "publico")["nome_completo"] == "Ana"
+
+    # Nem o que a mesma requisição lê de novo pelo mapa de identidade
+    with Flask(__name__).test_request_context():
+        dao.cache = None
+        dao.find_by_id(1, "publico")["nome_completo"] = "Alterado"
+        assert dao.find_by_id(1, "publico")["nome_completo"] == "Ana"
+
+
+def test_create_many_insere_em_lotes():
+    from dao.mensagem_dao import MensagemDAO
+
+    idas, linhas = [], []
+    dao = MensagemDAO()
+    dao.INSERT_LOTE = 2
+    dao.table = TabelaFalsa(linhas, idas)
+
+    criados = dao.create_many([{"chat_id": 1, "conteudo": str(i)} for i in range(5)])
+    assert [c["id"] for c in criados] == [1, 2, 3, 4, 5]
+    assert len(idas) == 3
+    assert dao.create_many([]) == [] and len(idas) == 3
+
+
+def test_troca_gravada_numa_unica_ida_sem_a_funcao_no_banco(monkeypatch):
+    from postgrest.exceptions import APIError
+    from dao.mensagem_dao import MensagemDAO
+
+    idas, linhas = [], []
+    dao = MensagemDAO()
+    dao.table = TabelaFalsa(linhas, idas)
+
+    def rpc_inexistente(funcao, params):
+        raise APIError({"code": "PGRST202", "message": "Could not find the function"})
+    monkeypatch.setattr(dao, "rpc", rpc_inexistente)
+
+    pergunta, resposta = dao.salvar_troca(3, 12, "Como melhorar?", "Assim.", tokens=5)
+    assert (pergunta.usuario_id, pergunta.conteudo) == (12, "Como melhorar?")
+    assert resposta.is_from_ia() and resposta.conteudo == "Assim."
+    assert len(idas) == 1 and len(linhas) == 2
+
+    # Outros erros do banco não caem no INSERT: a troca não é gravada pela metade
+    def rpc_com_erro(funcao, params):
+        raise APIError({"code": "23503", "message": "violates foreign key constraint"})
+    monkeypatch.setattr(dao, "rpc", rpc_com_erro)
+    with pytest.raises(APIError):
+        dao.salvar_troca(999, 12, "?", "!")
+    assert len(linhas) == 2